@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Drive the slack-files.py handlers without Slack.
+
+Loads the bot with the fake slack_bolt and P4 modules (bench/fakes on
+PYTHONPATH), fires each slash command --repeat times from distinct users,
+follows one "Show more" button per paged reply, and waits for every reply.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import threading
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def load_bot():
+    os.environ.setdefault("SLACK_BOT_TOKEN", "xoxb-bench")
+    sys.path.insert(0, str(ROOT))
+    spec = importlib.util.spec_from_file_location("slack_files", ROOT / "slack-files.py")
+    bot = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bot)
+    # As the bot's entry point does: open P4_INDEX_DB and start the health prober.
+    bot.start_background()
+    return bot
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--change", default="2")
+    parser.add_argument("--path", default="//depot/...")
+    args = parser.parse_args()
+
+    bot = load_bot()
+    replies = []
+    done = threading.Semaphore(0)
+
+    def reply(message=None, **kwargs):
+        replies.append(message if message is not None else kwargs)
+        done.release()
+
+    def say(message=None, **kwargs):
+        if isinstance(message, dict) and "blocks" in message:
+            replies.append(message)
+            token = message["blocks"][-1]["elements"][0]["value"]
+            body = {"user": {"id": f"UMORE{token}"}, "actions": [{"value": token}]}
+            bot.app.actions["show_more"](ack=lambda *a, **k: None, say=reply, body=body)
+            return
+        reply(message, **kwargs)
+
+    commands = [
+        ("/files", args.path),
+        ("/describe", args.change),
+        ("/changes", args.path),
+        ("/locked", args.path),
+        ("/health", ""),
+    ]
+    sent = 0
+    for i in range(args.repeat):
+        for name, text in commands:
+            command = {"text": text, "user_id": f"U{i}{name}", "channel_id": "CBENCH"}
+            bot.app.commands[name](ack=lambda *a, **k: None, say=say, command=command)
+            sent += 1
+    for _ in range(sent):
+        done.acquire()
+    json.dump({"commands": sent, "replies": len(replies)}, sys.stdout)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
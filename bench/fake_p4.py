@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""Stand-in for the p4 command line client backed by fakedepot.
+
+Supports plain, -ztag and -G output for the commands the scripts in this
+repository run. Each call is appended to $FAKE_P4_LOG (see fakedepot.log).
+"""
+
+import marshal
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fakedepot  # noqa: E402
+
+
+def parse_range(spec):
+    if "@" not in spec:
+        return spec, None, None
+    path, rng = spec.split("@", 1)
+    lo, _, hi = rng.partition(",")
+    lo = lo.lstrip("@>")
+    hi = hi.lstrip("@")
+    lo_n = int(lo) if lo.isdigit() else None
+    hi_n = int(hi) if hi.isdigit() else None
+    return path, lo_n, hi_n
+
+
+def take_opts(args, with_value):
+    opts = {}
+    rest = []
+    i = 0
+    while i < len(args):
+        a = args[i]
+        if a.startswith("-") and len(a) > 1:
+            if a in with_value:
+                opts[a] = args[i + 1]
+                i += 2
+                continue
+            opts[a] = True
+        else:
+            rest.append(a)
+        i += 1
+    return opts, rest
+
+
+def prefix_of(path):
+    return path[:-3] if path.endswith("...") else path
+
+
+def cmd_info(args):
+    yield {"userName": "p4status", "clientName": "bench-ws", "clientHost": "bench",
+           "serverAddress": "fake:1666", "serverVersion": "P4D/LINUX26X86_64/2023.2/0"}
+
+
+def cmd_opened(args):
+    opts, rest = take_opts(args, {"-u", "-C", "-m", "-c"})
+    prefix = prefix_of(rest[0]) if rest else "//"
+    count = 0
+    limit = int(opts["-m"]) if "-m" in opts else None
+    for rec in fakedepot.opened_records():
+        if not rec["depotFile"].startswith(prefix):
+            continue
+        if "-u" in opts and rec["user"] != opts["-u"]:
+            continue
+        if "-C" in opts and rec["client"] != opts["-C"]:
+            continue
+        if limit is not None and count >= limit:
+            return
+        count += 1
+        yield rec
+
+
+def cmd_changes(args):
+    opts, rest = take_opts(args, {"-s", "-m", "-u", "-c"})
+    status = opts.get("-s")
+    limit = int(opts["-m"]) if "-m" in opts else None
+    lo = hi = None
+    if rest:
+        _, lo, hi = parse_range(rest[0])
+    count = 0
+    for n in range(fakedepot.CHANGES, 0, -1):
+        if status and fakedepot.change_status(n) != status:
+            continue
+        if lo is not None and n < lo:
+            break
+        if hi is not None and n > hi:
+            continue
+        rec = fakedepot.change_record(n, long_desc="-l" in opts or "-L" in opts)
+        if "-u" in opts and rec["user"] != opts["-u"]:
+            continue
+        if "-c" in opts and rec["client"] != opts["-c"]:
+            continue
+        if limit is not None and count >= limit:
+            return
+        count += 1
+        yield rec
+
+
+def cmd_describe(args):
+    opts, rest = take_opts(args, set())
+    for c in rest:
+        n = int(c)
+        if n > fakedepot.CHANGES or n < 1:
+            sys.stderr.write(f"{c} - no such changelist.\n")
+            continue
+        yield fakedepot.describe_record(n)
+
+
+def cmd_counter(args):
+    yield {"counter": args[-1], "value": str(fakedepot.CHANGES)}
+
+
+def cmd_counters(args):
+    yield {"counter": "change", "value": str(fakedepot.CHANGES)}
+
+
+def cmd_clients(args):
+    yield from fakedepot.client_records()
+
+
+def cmd_files(args):
+    opts, rest = take_opts(args, {"-m"})
+    prefix = prefix_of(rest[0]) if rest else "//"
+    limit = int(opts["-m"]) if "-m" in opts else None
+    count = 0
+    for rec in fakedepot.file_records():
+        if not rec["depotFile"].startswith(prefix):
+            continue
+        if limit is not None and count >= limit:
+            return
+        count += 1
+        yield rec
+
+
+def cmd_login(args):
+    yield {"User": "p4status", "TicketExpiration": "86400"}
+
+
+COMMANDS = {
+    "info": cmd_info,
+    "opened": cmd_opened,
+    "changes": cmd_changes,
+    "describe": cmd_describe,
+    "counter": cmd_counter,
+    "counters": cmd_counters,
+    "clients": cmd_clients,
+    "files": cmd_files,
+    "login": cmd_login,
+}
+
+
+def write_tagged(out, rec):
+    for key, value in rec.items():
+        lines = value.split("\n")
+        out.write(f"... {key} {lines[0]}".rstrip(" ") + "\n" if value == "" else f"... {key} {lines[0]}\n")
+        for extra in lines[1:]:
+            out.write(extra + "\n")
+    out.write("\n")
+
+
+def main(argv):
+    fakedepot.log({"argv": argv})
+    mode = "text"
+    i = 0
+    while i < len(argv):
+        a = argv[i]
+        if a in ("-ztag", "-Ztag"):
+            mode = "tag"
+        elif a == "-G":
+            mode = "marshal"
+        elif a in ("-p", "-u", "-P", "-c", "-C", "-H", "-x"):
+            i += 1
+        elif a.startswith("-"):
+            pass
+        else:
+            break
+        i += 1
+    if i >= len(argv):
+        sys.stderr.write("fake p4: no command\n")
+        return 1
+    cmd, args = argv[i], argv[i + 1:]
+    if cmd in os.environ.get("FAKE_P4_FAIL", "").split(","):
+        sys.stderr.write(f"fake p4: {cmd} failed\n")
+        return 1
+    latency = float(os.environ.get("FAKE_P4_LATENCY", "0"))
+    latency += random.uniform(0, float(os.environ.get("FAKE_P4_LATENCY_JITTER", "0")))
+    if latency:
+        time.sleep(latency)
+    handler = COMMANDS.get(cmd)
+    if handler is None:
+        sys.stderr.write(f"fake p4: unknown command {cmd}\n")
+        return 1
+    found = 0
+    try:
+        if mode == "marshal":
+            out = sys.stdout.buffer
+            for rec in handler(args):
+                found += 1
+                marshal.dump({k.encode(): v.encode() for k, v in rec.items()}, out, 0)
+        else:
+            out = sys.stdout
+            for rec in handler(args):
+                found += 1
+                if mode == "tag":
+                    write_tagged(out, rec)
+                elif cmd == "opened":
+                    lock = " *locked*" if "ourLock" in rec else ""
+                    out.write(f"{rec['depotFile']}#{rec['rev']} - {rec['action']} change {rec['change']} "
+                              f"({rec['type']}) by {rec['user']}@{rec['client']}{lock}\n")
+                elif cmd == "changes":
+                    out.write(f"Change {rec['change']} on 2023/11/14 by {rec['user']}@{rec['client']} '{rec['desc'].splitlines()[0]}'\n")
+                else:
+                    out.write(" ".join(f"{k}={v}" for k, v in rec.items()) + "\n")
+        out.flush()
+    except BrokenPipeError:
+        fakedepot.log({"records": found})
+        os._exit(0)
+    fakedepot.log({"records": found})
+    if not found and cmd == "opened":
+        sys.stderr.write("File(s) not opened anywhere.\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,122 @@
+"""Deterministic synthetic depot behind the fake p4 executable and P4 module.
+
+Sizes come from the environment so bench/run.py can scale them:
+
+    FAKE_P4_OPENED          opened files (every 50th is opened by two clients)
+    FAKE_P4_CHANGES         changelists; n % 10 == 0 pending, == 1 shelved
+    FAKE_P4_USERS           distinct users/clients
+    FAKE_P4_DESC_LINES      lines per changelist description
+    FAKE_P4_DESCRIBE_FILES  files listed by describe
+"""
+
+import json
+import os
+
+OPENED = int(os.environ.get("FAKE_P4_OPENED", "1000"))
+CHANGES = int(os.environ.get("FAKE_P4_CHANGES", "1000"))
+USERS = int(os.environ.get("FAKE_P4_USERS", "50"))
+DESC_LINES = int(os.environ.get("FAKE_P4_DESC_LINES", "3"))
+DESCRIBE_FILES = int(os.environ.get("FAKE_P4_DESCRIBE_FILES", "10"))
+BASE_TIME = 1700000000
+
+
+def depot_path(i):
+    return f"//depot/proj{i % 10}/dir{(i // 10) % 100:03d}/file{i:07d}.uasset"
+
+
+def change_status(n):
+    if n % 10 == 0:
+        return "pending"
+    if n % 10 == 1:
+        return "shelved"
+    return "submitted"
+
+
+def change_record(n, long_desc=False):
+    user = f"student{n % USERS:03d}"
+    lines = [f"Fix lighting bug {n}" if n % 97 == 0 else f"Change {n} work"]
+    lines += [f"detail line {i} for {n}" for i in range(1, DESC_LINES)]
+    desc = "\n".join(lines) + "\n"
+    if not long_desc:
+        desc = desc[:31]
+    return {
+        "change": str(n),
+        "time": str(BASE_TIME + n * 60),
+        "user": user,
+        "client": f"{user}-ws",
+        "status": "pending" if change_status(n) == "shelved" else change_status(n),
+        "changeType": "public",
+        "desc": desc,
+    }
+
+
+def describe_record(n):
+    rec = change_record(n, long_desc=True)
+    for i in range(DESCRIBE_FILES):
+        rec[f"depotFile{i}"] = f"//depot/proj{n % 10}/dir{i % 1000:03d}/file{n:07d}_{i}.uasset"
+        rec[f"action{i}"] = "edit"
+        rec[f"rev{i}"] = "2"
+        rec[f"type{i}"] = "binary+l"
+    return rec
+
+
+def opened_records():
+    for i in range(OPENED):
+        user = f"student{i % USERS:03d}"
+        depot = depot_path(i)
+        owners = [user]
+        if i % 50 == 0:
+            owners.append(f"student{(i + 1) % USERS:03d}")
+        for owner in owners:
+            rec = {
+                "depotFile": depot,
+                "clientFile": f"//{owner}-ws/{depot[2:]}",
+                "rev": "3",
+                "haveRev": "3",
+                "action": "edit",
+                "change": "default" if i % 3 == 0 else str(10 * ((i % CHANGES) // 10 + 1)),
+                "type": "binary+l" if i % 7 == 0 else "text",
+                "user": owner,
+                "client": f"{owner}-ws",
+            }
+            if i % 7 == 0:
+                rec["ourLock"] = ""
+            yield rec
+
+
+def client_records():
+    for u in range(USERS):
+        user = f"student{u:03d}"
+        yield {
+            "client": f"{user}-ws",
+            "Owner": user,
+            "Access": str(BASE_TIME + u * 3600),
+            "Update": str(BASE_TIME),
+            "Root": f"/home/{user}/ws",
+            "Host": f"lab{u % 20:02d}",
+        }
+
+
+def file_records():
+    """Depot files in depot-path order, generated without sorting."""
+    total = max(OPENED, CHANGES)
+    for proj in range(10):
+        for folder in range(100):
+            for i in range(proj + 10 * folder, total, 1000):
+                yield {
+                    "depotFile": depot_path(i),
+                    "rev": "3",
+                    "change": str(i % CHANGES + 1),
+                    "action": "edit",
+                    "type": "binary+l",
+                    "time": str(BASE_TIME + i),
+                }
+
+
+def log(entry):
+    """Append one JSON line to $FAKE_P4_LOG: {"argv": [...]} when a command
+    starts and {"records": n} when it finishes."""
+    path = os.environ.get("FAKE_P4_LOG")
+    if path:
+        with open(path, "a", encoding="utf-8") as fh:
+            fh.write(json.dumps(entry) + "\n")
@@ -0,0 +1,135 @@
+"""Stand-in for the P4Python module backed by fakedepot.
+
+Put bench/fakes first on PYTHONPATH to use it in place of p4python. Runs go
+through the same command handlers as the fake p4 executable and are logged
+to $FAKE_P4_LOG the same way.
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fake_p4  # noqa: E402
+import fakedepot  # noqa: E402
+
+
+class P4Exception(Exception):
+    pass
+
+
+class PyKeepAlive:
+    """Base for P4.setbreak() keepalives; isAlive() returning 0 cancels the command."""
+
+    def isAlive(self):
+        return 1
+
+
+class OutputHandler:
+    REPORT = 0
+    HANDLED = 1
+    CANCEL = 2
+
+    def outputStat(self, stat):
+        return OutputHandler.REPORT
+
+
+class P4:
+    def __init__(self):
+        self.port = os.environ.get("P4PORT")
+        self.user = os.environ.get("P4USER")
+        self.password = None
+        self.charset = None
+        self.ticket_file = None
+        self.trust_file = None
+        self.client = None
+        self.exception_level = 2
+        self.errors = []
+        self.warnings = []
+        self.handler = None
+        self._keepalive = None
+        self._connected = False
+
+    def setbreak(self, keepalive):
+        self._keepalive = keepalive
+
+    def _wait(self, seconds):
+        """Sleep like a slow server, polling the keepalive as the real client does."""
+        ends = time.monotonic() + seconds
+        while True:
+            left = ends - time.monotonic()
+            if left <= 0:
+                return
+            if self._keepalive is not None and not self._keepalive.isAlive():
+                self._connected = False
+                raise P4Exception("[P4#run] Command cancelled by keepalive; connection dropped.")
+            time.sleep(min(left, 0.05))
+
+    def connect(self):
+        latency = float(os.environ.get("FAKE_P4_CONNECT_LATENCY", "0"))
+        if latency:
+            time.sleep(latency)
+        self._connected = True
+        return self
+
+    def disconnect(self):
+        self._connected = False
+
+    def connected(self):
+        return self._connected
+
+    def run(self, *args, **kwargs):
+        if not self._connected:
+            raise P4Exception("not connected")
+        args = [str(a) for a in args]
+        fakedepot.log({"argv": args})
+        latency = float(os.environ.get("FAKE_P4_LATENCY", "0"))
+        latency += random.uniform(0, float(os.environ.get("FAKE_P4_LATENCY_JITTER", "0")))
+        if latency:
+            self._wait(latency)
+        self.errors = []
+        self.warnings = []
+        cmd, rest = args[0], args[1:]
+        if cmd in os.environ.get("FAKE_P4_FAIL", "").split(","):
+            self.errors = [f"fake p4: {cmd} failed"]
+            raise P4Exception(self.errors[0])
+        handler = fake_p4.COMMANDS.get(cmd)
+        if handler is None:
+            self.errors = [f"unknown command {cmd}"]
+            raise P4Exception(self.errors[0])
+        results = []
+        produced = 0
+        for rec in handler(rest):
+            produced += 1
+            if cmd == "describe":
+                rec = _fold_describe(rec)
+            if self.handler is not None:
+                verdict = self.handler.outputStat(rec)
+                if verdict & OutputHandler.CANCEL:
+                    break
+                if verdict & OutputHandler.HANDLED:
+                    continue
+            results.append(rec)
+        fakedepot.log({"records": produced})
+        if not results and cmd == "opened":
+            self.warnings = ["File(s) not opened anywhere."]
+            if self.exception_level >= 2:
+                raise P4Exception(self.warnings[0])
+        return results
+
+    def __getattr__(self, name):
+        if name.startswith("run_"):
+            return lambda *args: self.run(name[4:], *args)
+        raise AttributeError(name)
+
+
+def _fold_describe(rec):
+    folded = {}
+    for key, value in rec.items():
+        base = key.rstrip("0123456789")
+        if base != key and base in ("depotFile", "action", "rev", "type"):
+            folded.setdefault(base, []).append(value)
+        else:
+            folded[key] = value
+    return folded
@@ -0,0 +1,20 @@
+"""Minimal stand-in for slack_bolt: records listener registrations so bench/bot_driver.py can call them."""
+
+
+class App:
+    def __init__(self, token=None, **kwargs):
+        self.token = token
+        self.commands = {}
+        self.actions = {}
+
+    def command(self, name):
+        def register(fn):
+            self.commands[name] = fn
+            return fn
+        return register
+
+    def action(self, action_id):
+        def register(fn):
+            self.actions[action_id] = fn
+            return fn
+        return register
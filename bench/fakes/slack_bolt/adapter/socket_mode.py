@@ -0,0 +1,6 @@
+class SocketModeHandler:
+    def __init__(self, app, app_token):
+        self.app = app
+
+    def start(self):
+        raise RuntimeError("fake SocketModeHandler cannot connect")
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""Load-test the slack-files.py handlers against a fake Socket Mode stand-in.
+
+Slash commands arrive open-loop (Poisson, at --rate per second) in the
+--mix proportions for --duration seconds. Like Socket Mode, each request
+is handed to a fixed pool of --listener-threads that runs the Bolt
+listener, so a saturated pool shows up as late acks. Perforce is the fake
+P4 module from bench/fakes; --latency and --jitter set how slow each call
+is. Prints JSON with per-command p50/p95/p99 ack and completion latency
+(from the request's arrival), error rate and the peak thread count.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from bot_driver import load_bot
+
+# Slack shows an error to the user if a slash command is not acked in time.
+ACK_BUDGET = 3.0
+DEFAULT_MIX = "/locked=4,/describe=3,/changes=1,/files=1,/health=1"
+# Reply prefixes that mean the command did not do its job, and the reason
+# reported for each; the first match wins.
+ERROR_REPLIES = (
+    (":warning: Perforce is not answering", "degraded"),
+    (":warning:", "failed"),
+    (":x:", "failed"),
+    (":hourglass:", "busy"),
+)
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """``/locked=4,/describe=3`` -> relative weights per command."""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    """Nearest-rank p50/p95/p99 and max, in milliseconds."""
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    ordered = sorted(values)
+
+    def rank(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 1)
+
+    return {"p50": rank(50), "p95": rank(95), "p99": rank(99), "max": round(ordered[-1] * 1000, 1)}
+
+
+class Request:
+    """One slash command in flight: when it arrived, was acked and answered."""
+
+    def __init__(self, name: str, text: str, user: str, arrived: float):
+        self.name = name
+        self.text = text
+        self.user = user
+        self.arrived = arrived
+        self.acked: Optional[float] = None
+        self.completed: Optional[float] = None
+        self.error: Optional[str] = None
+        self.done = threading.Event()
+
+    def ack(self, *args, **kwargs) -> None:
+        if self.acked is None:
+            self.acked = time.perf_counter()
+
+    def say(self, message=None, **kwargs) -> None:
+        if self.completed is not None:
+            return
+        self.completed = time.perf_counter()
+        if isinstance(message, str):
+            self.error = next((reason for prefix, reason in ERROR_REPLIES if message.startswith(prefix)), None)
+        self.done.set()
+
+
+def command_text(name: str, rng: random.Random, changes: int, path: str) -> str:
+    """Argument text for one command, varied so not every request coalesces."""
+    if name == "/describe":
+        n = rng.randrange(2, max(3, changes))
+        while n % 10 in (0, 1):  # pending or shelved in the fake depot
+            n -= 1
+        return str(n)
+    if name in ("/locked", "/files", "/changes"):
+        return rng.choice([path, f"//depot/proj{rng.randrange(10)}/..."])
+    if name == "/search":
+        return rng.choice(["lighting bug", "work", "detail line"])
+    return ""
+
+
+def sample_threads(stop: threading.Event, peak: List[int]) -> None:
+    while not stop.wait(0.05):
+        peak[0] = max(peak[0], threading.active_count())
+
+
+def summarize(requests: List[Request], budget: float) -> Dict[str, Any]:
+    result = {}
+    for name in sorted({request.name for request in requests}):
+        group = [request for request in requests if request.name == name]
+        acks = [request.acked - request.arrived for request in group if request.acked is not None]
+        completions = [request.completed - request.arrived for request in group if request.completed is not None]
+        errors: Dict[str, int] = {}
+        for request in group:
+            if request.completed is None:
+                reason = "no_reply"
+            elif request.error:
+                reason = request.error
+            elif request.acked is None or request.acked - request.arrived > budget:
+                reason = "late_ack"
+            else:
+                continue
+            errors[reason] = errors.get(reason, 0) + 1
+        result[name] = {
+            "sent": len(group),
+            "completed": len(completions),
+            "errors": errors,
+            "error_rate": round(sum(errors.values()) / len(group), 4),
+            "ack_ms": percentiles(acks),
+            "completion_ms": percentiles(completions),
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rate", type=float, default=20, help="Slash commands per second (default: 20)")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of traffic (default: 10)")
+    parser.add_argument("--mix", default=DEFAULT_MIX,
+                        help=f"Relative weight per command (default: {DEFAULT_MIX})")
+    parser.add_argument("--users", type=int, default=100, help="Distinct Slack users sending (default: 100)")
+    parser.add_argument("--latency", type=float, default=None,
+                        help="Seconds every fake p4 call takes (default: $FAKE_P4_LATENCY or 0)")
+    parser.add_argument("--jitter", type=float, default=None,
+                        help="Up to this many extra seconds per fake p4 call (default: $FAKE_P4_LATENCY_JITTER or 0)")
+    parser.add_argument("--listener-threads", type=int, default=10,
+                        help="Threads running Bolt listeners, as Socket Mode's concurrency (default: 10)")
+    parser.add_argument("--path", default="//depot/...", help="Pathspec for /locked, /files and /changes")
+    parser.add_argument("--drain", type=float, default=60, help="Seconds to wait for replies after the last request")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.latency is not None:
+        os.environ["FAKE_P4_LATENCY"] = str(args.latency)
+    if args.jitter is not None:
+        os.environ["FAKE_P4_LATENCY_JITTER"] = str(args.jitter)
+    changes = int(os.environ.get("FAKE_P4_CHANGES", "1000"))
+    bot = load_bot()
+    mix = parse_mix(args.mix)
+    unknown = set(mix) - set(bot.app.commands)
+    if unknown:
+        parser.error(f"the bot has no {', '.join(sorted(unknown))} command")
+    names, weights = list(mix), list(mix.values())
+    rng = random.Random(args.seed)
+
+    requests: List[Request] = []
+    peak = [threading.active_count()]
+    stop = threading.Event()
+    sampler = threading.Thread(target=sample_threads, args=(stop, peak), daemon=True)
+    sampler.start()
+    listeners = ThreadPoolExecutor(max_workers=args.listener_threads, thread_name_prefix="socket-mode")
+
+    def deliver(request: Request) -> None:
+        command = {"text": request.text, "user_id": request.user, "channel_id": "CLOAD"}
+        try:
+            bot.app.commands[request.name](ack=request.ack, say=request.say, command=command)
+        except Exception as exc:
+            request.error = type(exc).__name__
+            request.completed = time.perf_counter()
+            request.done.set()
+
+    started = time.perf_counter()
+    due = started
+    while due - started < args.duration:
+        due += rng.expovariate(args.rate)
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        name = rng.choices(names, weights)[0]
+        request = Request(name, command_text(name, rng, changes, args.path), f"ULOAD{rng.randrange(args.users)}", due)
+        requests.append(request)
+        listeners.submit(deliver, request)
+    sent_for = time.perf_counter() - started
+
+    deadline = time.perf_counter() + args.drain
+    for request in requests:
+        request.done.wait(max(0.0, deadline - time.perf_counter()))
+    listeners.shutdown(wait=False, cancel_futures=True)
+    stop.set()
+    sampler.join()
+
+    per_command = summarize(requests, ACK_BUDGET)
+    failed = sum(sum(stats["errors"].values()) for stats in per_command.values())
+    json.dump({
+        "rate": args.rate,
+        "duration_s": round(sent_for, 3),
+        "offered": len(requests),
+        "latency": float(os.environ.get("FAKE_P4_LATENCY", "0")),
+        "jitter": float(os.environ.get("FAKE_P4_LATENCY_JITTER", "0")),
+        "listener_threads": args.listener_threads,
+        "ack_budget_s": ACK_BUDGET,
+        "error_rate": round(failed / len(requests), 4) if requests else 0.0,
+        "threads": {"peak": peak[0], "end": threading.active_count()},
+        "dispatcher": bot.DISPATCHER.stats(),
+        "commands": per_command,
+    }, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+run.py - Benchmark the scripts in this repository against a synthetic depot
+
+Every entry point runs as a child process with bench/bin (fake p4) first on
+PATH and bench/fakes (fake P4Python and slack_bolt) first on PYTHONPATH, so
+no Perforce server or Slack workspace is needed. Results are printed as JSON:
+
+    ./bench/run.py --opened 100000 --changes 100000 > bench_output.txt
+
+For each scenario: wall time, p4 invocations, records the fake server
+produced, peak RSS of the process tree and records per second.
+"""
+
+import argparse
+import http.server
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+BENCH = Path(__file__).resolve().parent
+ROOT = BENCH.parent
+PYTHON = sys.executable
+
+
+class FakeWebhook(http.server.BaseHTTPRequestHandler):
+    """Accepts Slack webhook posts and counts them."""
+
+    protocol_version = "HTTP/1.1"
+    posts = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", "0")))
+        FakeWebhook.posts += 1
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+def start_webhook() -> str:
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FakeWebhook)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}/hook"
+
+
+def newest_submitted(changes: int) -> int:
+    """Highest change number the fake depot reports as submitted."""
+    n = changes
+    while n % 10 in (0, 1):
+        n -= 1
+    return n
+
+
+def scenarios(args: argparse.Namespace, webhook: str) -> List[Dict[str, Any]]:
+    path = args.path
+    limit = str(args.limit)
+    change = str(newest_submitted(args.changes))
+    p4status = [PYTHON, str(ROOT / "p4status.py"), path, "--limit", limit]
+    return [
+        {"name": "p4status.py ztag", "argv": p4status},
+        {"name": "p4status.py marshal", "argv": p4status + ["--backend", "marshal"]},
+        {"name": "p4status.py p4python", "argv": p4status + ["--backend", "p4python"]},
+        {"name": "p4status.py exact-totals", "argv": p4status + ["--exact-totals"]},
+        {"name": "p4status.py text", "argv": p4status + ["--format", "text"]},
+        {"name": "p4status.py compact", "argv": p4status + ["--compact"]},
+        {"name": "p4status.py ndjson", "argv": p4status + ["--format", "ndjson"]},
+        {"name": "p4status.sh text", "argv": ["bash", str(ROOT / "p4status.sh"), path, "--limit", limit]},
+        {"name": "p4status.sh json", "argv": ["bash", str(ROOT / "p4status.sh"), path, "--limit", limit, "--json"]},
+        {"name": "submit-slack.py direct", "argv": [PYTHON, str(ROOT / "submit-slack.py"), change, "student001"],
+         "env": {"SLACK_WEBHOOK": webhook}},
+        {"name": "submit-slack.py spool", "argv": [PYTHON, str(ROOT / "submit-slack.py"), "--spool", change, "student001"]},
+        {"name": "slack-files.py handlers", "argv": [PYTHON, str(BENCH / "bot_driver.py"),
+                                                     "--repeat", str(args.repeat), "--change", change, "--path", path]},
+        {"name": "slack-files.py load", "argv": [PYTHON, str(BENCH / "load_bot.py"), "--rate", str(args.rate),
+                                                 "--duration", str(args.load_duration), "--path", path]},
+    ]
+
+
+def read_log(path: str) -> Dict[str, int]:
+    calls = records = 0
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            entry = json.loads(line)
+            if "argv" in entry:
+                calls += 1
+            else:
+                records += entry["records"]
+    return {"p4_calls": calls, "p4_records": records}
+
+
+def run_scenario(scenario: Dict[str, Any], env: Dict[str, str], workdir: str) -> Dict[str, Any]:
+    """Run one scenario and measure it; peak RSS comes from wait4() on the child."""
+    log = os.path.join(workdir, "p4.log")
+    open(log, "w").close()
+    child_env = dict(env, FAKE_P4_LOG=log, SUBMIT_SLACK_SPOOL=os.path.join(workdir, "spool"),
+                     SUBMIT_SLACK_CHECKPOINT=os.path.join(workdir, "checkpoint"))
+    child_env.update(scenario.get("env", {}))
+    with tempfile.TemporaryFile() as stderr:
+        start = time.perf_counter()
+        proc = subprocess.Popen(scenario["argv"], env=child_env, cwd=workdir,
+                                stdout=subprocess.DEVNULL, stderr=stderr)
+        _, status, usage = os.wait4(proc.pid, 0)
+        wall = time.perf_counter() - start
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        stderr.seek(0)
+        error = stderr.read().decode("utf-8", "replace")[-2000:]
+    result: Dict[str, Any] = {
+        "name": scenario["name"],
+        "exit_code": proc.returncode,
+        "wall_s": round(wall, 4),
+        **read_log(log),
+        "peak_rss_kb": usage.ru_maxrss,
+    }
+    result["records_per_s"] = round(result["p4_records"] / wall, 1) if wall else None
+    if proc.returncode:
+        result["stderr"] = error
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Perforce/Slack scripts against a synthetic depot")
+    parser.add_argument("--opened", type=int, default=1000, help="Opened files in the fake depot (default: 1000)")
+    parser.add_argument("--changes", type=int, default=1000, help="Changelists in the fake depot (default: 1000)")
+    parser.add_argument("--users", type=int, default=50, help="Distinct users/clients (default: 50)")
+    parser.add_argument("--desc-lines", type=int, default=3, help="Lines per changelist description (default: 3)")
+    parser.add_argument("--describe-files", type=int, default=10, help="Files per describe (default: 10)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds of delay added to every p4 call")
+    parser.add_argument("--path", default="//depot/...", help="Pathspec the scripts query (default: //depot/...)")
+    parser.add_argument("--limit", type=int, default=20, help="--limit passed to the report scripts (default: 20)")
+    parser.add_argument("--repeat", type=int, default=20, help="Rounds of slash commands for the bot (default: 20)")
+    parser.add_argument("--rate", type=float, default=20,
+                        help="Slash commands per second for the bot load test (default: 20)")
+    parser.add_argument("--load-duration", type=float, default=5,
+                        help="Seconds of traffic for the bot load test (default: 5)")
+    parser.add_argument("--only", action="append", metavar="NAME",
+                        help="Run only scenarios whose name contains NAME (repeatable)")
+    args = parser.parse_args()
+
+    depot = {
+        "FAKE_P4_OPENED": str(args.opened),
+        "FAKE_P4_CHANGES": str(args.changes),
+        "FAKE_P4_USERS": str(args.users),
+        "FAKE_P4_DESC_LINES": str(args.desc_lines),
+        "FAKE_P4_DESCRIBE_FILES": str(args.describe_files),
+        "FAKE_P4_LATENCY": str(args.latency),
+    }
+    env = dict(os.environ, **depot)
+    env["PATH"] = f"{BENCH / 'bin'}{os.pathsep}{env.get('PATH', '')}"
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(BENCH / "fakes"), env.get("PYTHONPATH")]))
+    for name in ("P4CONFIG", "P4_TICKET", "P4_TICKET_FILE", "P4PORT"):
+        env.pop(name, None)
+
+    webhook = start_webhook()
+    results = []
+    with tempfile.TemporaryDirectory(prefix="p4bench.") as workdir:
+        for scenario in scenarios(args, webhook):
+            if args.only and not any(part in scenario["name"] for part in args.only):
+                continue
+            results.append(run_scenario(scenario, env, workdir))
+
+    json.dump({
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "depot": {key[len("FAKE_P4_"):].lower(): value for key, value in depot.items()},
+        "webhook_posts": FakeWebhook.posts,
+        "results": results,
+    }, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    sys.exit(1 if any(result["exit_code"] for result in results) else 0)
+
+
+if __name__ == "__main__":
+    main()
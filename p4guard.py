@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+p4guard.py - Deadlines and a circuit breaker for Perforce calls
+
+A deadline opened with ``deadline()`` covers every p4 call made inside it,
+including calls nested in helpers and in tasks started with a copy of the
+caller's context (``contextvars.copy_context()``). Each call asks
+``budget()`` for its timeout and gets what is left of the deadline, so a
+slow first call leaves less time for the next one rather than each call
+waiting its own full timeout.
+
+A ``CircuitBreaker`` counts calls that time out or cannot reach the server.
+After ``failures`` in a row it opens, and ``check()`` raises ``CircuitOpen``
+straight away instead of letting callers queue up behind a server that is
+not answering. Once ``cooldown`` seconds have passed, the next caller runs
+``probe`` (a ``p4 login -s``); the breaker closes if the server answers and
+stays open for another cooldown if it does not.
+"""
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+# Monotonic time by which the current request must be done, or None.
+_DEADLINE: "contextvars.ContextVar[Optional[float]]" = contextvars.ContextVar("p4_deadline", default=None)
+
+# Error text from the p4 client when the server never answered.
+UNREACHABLE = (
+    "Connect to server failed",
+    "TCP connect to",
+    "TCP receive failed",
+    "TCP send failed",
+    "Partner exited unexpectedly",
+)
+
+
+# Neither is an OSError: handlers for a failed p4 run (``except OSError``)
+# must not swallow them, as callers hold or degrade work on these two.
+class DeadlineExceeded(Exception):
+    """The request's deadline passed before or during a p4 call."""
+
+
+class CircuitOpen(Exception):
+    """The breaker is open: recent calls failed, so this one is not attempted."""
+
+
+@contextmanager
+def deadline(seconds: Optional[float]) -> Iterator[None]:
+    """Give the p4 calls in this block at most ``seconds`` in total.
+
+    Nested deadlines can only shorten an outer one. ``None`` adds no limit.
+    """
+    ends = _DEADLINE.get()
+    if seconds is not None:
+        ends = min(ends, time.monotonic() + seconds) if ends is not None else time.monotonic() + seconds
+    token = _DEADLINE.set(ends)
+    try:
+        yield
+    finally:
+        _DEADLINE.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current deadline, or None without one."""
+    ends = _DEADLINE.get()
+    return None if ends is None else ends - time.monotonic()
+
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def budget(timeout: Optional[float] = None) -> Optional[float]:
+    """Timeout for the next call: ``timeout`` cut down to what the deadline leaves.
+
+    Raises ``DeadlineExceeded`` when nothing is left.
+    """
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise DeadlineExceeded("deadline exceeded before the Perforce call started")
+    return left if timeout is None else min(timeout, left)
+
+
+def unreachable(message: str) -> bool:
+    """True if a p4 error message says the server could not be reached."""
+    return any(marker in message for marker in UNREACHABLE)
+
+
+def keepalive(base: type) -> Any:
+    """A P4Python keepalive for ``P4.setbreak()`` that cancels the running
+    command once the caller's deadline has passed. ``base`` is
+    ``P4.PyKeepAlive``."""
+
+    class DeadlineKeepAlive(base):
+        def isAlive(self):
+            return 0 if expired() else 1
+
+    return DeadlineKeepAlive()
+
+
+class CircuitBreaker:
+    """Fails Perforce calls fast after ``failures`` consecutive failures.
+
+    Callers run ``check()`` before a call and report its outcome with
+    ``success()`` or ``failure()``. Only failures that say nothing came
+    back (timeouts, connection errors) should be reported as failures; a
+    command error is an answer and counts as a success.
+    """
+
+    def __init__(
+        self,
+        failures: int = 3,
+        cooldown: float = 30.0,
+        probe: Optional[Callable[[], bool]] = None,
+    ):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.probe = probe
+        self._lock = threading.Lock()
+        self._consecutive = 0
+        self._opened_at: Optional[float] = None
+        self._opened_wall: Optional[float] = None
+        self._probing = False
+        self.reason = ""
+        self.counters = {"opened": 0, "rejected": 0, "probes": 0}
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if self._probing or time.monotonic() - self._opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def _describe(self) -> str:
+        since = time.strftime("%H:%M:%S", time.localtime(self._opened_wall or 0))
+        retry = max(0.0, self.cooldown - (time.monotonic() - (self._opened_at or 0)))
+        return f"Perforce marked degraded at {since} ({self.reason}); next check in {retry:.0f}s"
+
+    def check(self) -> None:
+        """Return if a call may go ahead; raise ``CircuitOpen`` if not.
+
+        In the half-open state one caller runs the probe while the others
+        keep failing fast.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if self._probing or time.monotonic() - self._opened_at < self.cooldown:
+                self.counters["rejected"] += 1
+                raise CircuitOpen(self._describe())
+            self._probing = True
+            self.counters["probes"] += 1
+        if self.probe is None:
+            # The caller's own call is the trial; success() or failure() settles it.
+            return
+        healthy = False
+        try:
+            healthy = self.probe()
+        finally:
+            if healthy:
+                self.success()
+            else:
+                self.failure("health check failed")
+        if not healthy:
+            with self._lock:
+                raise CircuitOpen(self._describe())
+
+    def success(self) -> None:
+        with self._lock:
+            self._consecutive = 0
+            self._opened_at = None
+            self._probing = False
+
+    def failure(self, reason: str) -> None:
+        with self._lock:
+            self._consecutive += 1
+            reopen = self._probing or (self._opened_at is not None and self._state() == "half-open")
+            if self._opened_at is None and self._consecutive >= self.failures or reopen:
+                if self._opened_at is None:
+                    self.counters["opened"] += 1
+                self._opened_at = time.monotonic()
+                self._opened_wall = time.time()
+                self.reason = reason
+            self._probing = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self.counters)
+            stats["state"] = self._state()
+            stats["consecutive_failures"] = self._consecutive
+        return stats
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+p4history.py - Trend history of p4status reports
+
+Each recorded report is stored as its difference from the previous one:
+an opened file is a span from the report that first showed it to the one
+that no longer did, so an unchanged checkout costs nothing per run. Per-day
+and per-user-per-day rollups are updated as reports arrive, so range
+queries never replay snapshots. Per-run counts are kept for a few days and
+then only survive in the daily rollup.
+"""
+
+import argparse
+import datetime as _dt
+import json
+import sqlite3
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS spans (
+    file TEXT NOT NULL,
+    client TEXT NOT NULL,
+    user TEXT,
+    action TEXT,
+    change TEXT,
+    locked INTEGER NOT NULL,
+    start REAL NOT NULL,
+    end REAL
+);
+CREATE INDEX IF NOT EXISTS spans_open ON spans (end);
+CREATE INDEX IF NOT EXISTS spans_user ON spans (user, start);
+
+CREATE TABLE IF NOT EXISTS snapshots (
+    taken_at REAL PRIMARY KEY,
+    opened INTEGER NOT NULL,
+    conflicts INTEGER NOT NULL,
+    locked INTEGER NOT NULL,
+    pending INTEGER,
+    shelved INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS daily (
+    day TEXT PRIMARY KEY,
+    samples INTEGER NOT NULL,
+    opened_max INTEGER NOT NULL,
+    opened_sum INTEGER NOT NULL,
+    conflicts_max INTEGER NOT NULL,
+    conflicts_sum INTEGER NOT NULL,
+    locked_max INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS user_daily (
+    day TEXT NOT NULL,
+    user TEXT NOT NULL,
+    opened_max INTEGER NOT NULL,
+    opened_sum INTEGER NOT NULL,
+    locked_max INTEGER NOT NULL,
+    PRIMARY KEY (day, user)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Per-run snapshot rows older than this are dropped; the daily rollup keeps them.
+KEEP_RAW_DAYS = 7
+# Closed spans older than this are dropped (a semester and then some).
+KEEP_SPANS_DAYS = 200
+
+SPAN_FIELDS = ("user", "action", "change", "locked")
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """Open (and create if needed) the history database."""
+    db = sqlite3.connect(path, timeout=30)
+    db.row_factory = sqlite3.Row
+    db.execute("PRAGMA journal_mode=WAL")
+    db.executescript(SCHEMA)
+    return db
+
+
+def get_meta(db: sqlite3.Connection, key: str) -> Optional[str]:
+    row = db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def set_meta(db: sqlite3.Connection, key: str, value: Any) -> None:
+    db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+
+def day_of(epoch: float) -> str:
+    return _dt.datetime.fromtimestamp(epoch, tz=_dt.timezone.utc).date().isoformat()
+
+
+def report_time(report: Dict[str, Any]) -> float:
+    generated_at = report.get("metadata", {}).get("generated_at")
+    if generated_at:
+        return _dt.datetime.fromisoformat(generated_at).timestamp()
+    return _dt.datetime.now(tz=_dt.timezone.utc).timestamp()
+
+
+def record(
+    db: sqlite3.Connection,
+    report: Dict[str, Any],
+    keep_raw_days: float = KEEP_RAW_DAYS,
+    keep_spans_days: float = KEEP_SPANS_DAYS,
+) -> Dict[str, Any]:
+    """Add one p4status report to the history; returns counts of what changed.
+
+    Only the difference from the open spans is written: opens that went
+    away (or changed action, changelist or lock) are closed, new ones are
+    started. A report whose opened query failed is not recorded, so an
+    error never shows up as every checkout ending. Filtered reports
+    (``metadata.filters``) are refused: a ``--user`` run would end every
+    other user's checkouts.
+    """
+    metadata = report.get("metadata", {})
+    path = metadata.get("path")
+    recorded_path = get_meta(db, "path")
+    if recorded_path and path != recorded_path:
+        raise ValueError(f"history covers {recorded_path}, not {path}")
+    if metadata.get("filters"):
+        raise ValueError(f"history needs unfiltered reports, not one filtered by {', '.join(sorted(metadata['filters']))}")
+    if "opened" in report.get("errors", {}):
+        return {"skipped": "opened query failed"}
+    taken = report_time(report)
+    last = db.execute("SELECT MAX(taken_at) FROM snapshots").fetchone()[0]
+    if last is not None and taken <= last:
+        return {"skipped": "not newer than the last recorded report"}
+
+    current: Dict[Tuple[str, str], Tuple[Any, ...]] = {}
+    for entry in report.get("opened_files", []):
+        key = (entry.get("file") or "", entry.get("client") or "")
+        current[key] = tuple(int(bool(entry.get(f))) if f == "locked" else entry.get(f) for f in SPAN_FIELDS)
+
+    with db:
+        closed = []
+        for row in db.execute("SELECT rowid, file, client, user, action, change, locked FROM spans WHERE end IS NULL"):
+            key = (row["file"], row["client"])
+            if current.get(key) == tuple(row[f] for f in SPAN_FIELDS):
+                del current[key]
+            else:
+                closed.append((taken, row["rowid"]))
+        db.executemany("UPDATE spans SET end = ? WHERE rowid = ?", closed)
+        db.executemany(
+            "INSERT INTO spans (file, client, user, action, change, locked, start) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            ((file, client, *fields, taken) for (file, client), fields in current.items()),
+        )
+
+        counts = {
+            "opened": len(report.get("opened_files", [])),
+            "conflicts": len(report.get("opened_conflicts", [])),
+            "locked": sum(1 for entry in report.get("opened_files", []) if entry.get("locked")),
+            "pending": report.get("pending_changes", {}).get("total"),
+            "shelved": report.get("shelved_changes", {}).get("total"),
+        }
+        db.execute("INSERT INTO snapshots VALUES (?, ?, ?, ?, ?, ?)", (taken, *counts.values()))
+        day = day_of(taken)
+        db.execute(
+            "INSERT INTO daily VALUES (?, 1, ?, ?, ?, ?, ?) ON CONFLICT (day) DO UPDATE SET "
+            "samples = samples + 1, opened_max = MAX(opened_max, excluded.opened_max), "
+            "opened_sum = opened_sum + excluded.opened_sum, conflicts_max = MAX(conflicts_max, excluded.conflicts_max), "
+            "conflicts_sum = conflicts_sum + excluded.conflicts_sum, locked_max = MAX(locked_max, excluded.locked_max)",
+            (day, counts["opened"], counts["opened"], counts["conflicts"], counts["conflicts"], counts["locked"]),
+        )
+        per_user: Dict[str, List[int]] = {}
+        for entry in report.get("opened_files", []):
+            tally = per_user.setdefault(entry.get("user") or "<none>", [0, 0])
+            tally[0] += 1
+            tally[1] += int(bool(entry.get("locked")))
+        db.executemany(
+            "INSERT INTO user_daily VALUES (?, ?, ?, ?, ?) ON CONFLICT (day, user) DO UPDATE SET "
+            "opened_max = MAX(opened_max, excluded.opened_max), opened_sum = opened_sum + excluded.opened_sum, "
+            "locked_max = MAX(locked_max, excluded.locked_max)",
+            ((day, user, opens, opens, locks) for user, (opens, locks) in per_user.items()),
+        )
+
+        # Downsample: old per-run rows live on in the daily rollup only.
+        dropped = db.execute("DELETE FROM snapshots WHERE taken_at < ?", (taken - keep_raw_days * 86400,)).rowcount
+        db.execute("DELETE FROM spans WHERE end IS NOT NULL AND end < ?", (taken - keep_spans_days * 86400,))
+        set_meta(db, "path", path)
+        set_meta(db, "recorded_at", taken)
+    return {"spans_closed": len(closed), "spans_started": len(current), "snapshots_dropped": dropped, **counts}
+
+
+def since(days: float, now: Optional[float] = None) -> float:
+    now = _dt.datetime.now(tz=_dt.timezone.utc).timestamp() if now is None else now
+    return now - days * 86400
+
+
+def user_opens(db: sqlite3.Connection, days: float = 30, user: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Opened files per user per day: the day's peak and its average over runs."""
+    sql = (
+        "SELECT u.day, u.user, u.opened_max, 1.0 * u.opened_sum / d.samples AS opened_avg, u.locked_max "
+        "FROM user_daily u JOIN daily d ON d.day = u.day WHERE u.day >= ?"
+    )
+    params: List[Any] = [day_of(since(days))]
+    if user is not None:
+        sql += " AND u.user = ?"
+        params.append(user)
+    sql += " ORDER BY u.day, u.user"
+    return [dict(row, opened_avg=round(row["opened_avg"], 2)) for row in db.execute(sql, params)]
+
+
+def lock_durations(db: sqlite3.Connection, days: float = 30) -> List[Dict[str, Any]]:
+    """How long exclusive locks held in the window lasted, per user, in hours.
+
+    Locks still held count up to now (``held`` says how many).
+    """
+    now = _dt.datetime.now(tz=_dt.timezone.utc).timestamp()
+    rows = db.execute(
+        "SELECT user, COUNT(*) AS locks, SUM(end IS NULL) AS held, "
+        "AVG(COALESCE(end, ?) - start) / 3600.0 AS avg_hours, MAX(COALESCE(end, ?) - start) / 3600.0 AS max_hours "
+        "FROM spans WHERE locked AND COALESCE(end, ?) >= ? GROUP BY user ORDER BY max_hours DESC",
+        (now, now, now, since(days, now)),
+    )
+    return [dict(row, avg_hours=round(row["avg_hours"], 2), max_hours=round(row["max_hours"], 2)) for row in rows]
+
+
+def weekly_conflicts(db: sqlite3.Connection, weeks: int = 16) -> List[Dict[str, Any]]:
+    """Files opened by more than one workspace, per ISO week: peak and average.
+
+    SQLite's strftime has no ISO week, so the daily rows are grouped here.
+    """
+    groups: Dict[str, Dict[str, Any]] = {}
+    rows = db.execute(
+        "SELECT day, samples, conflicts_max, conflicts_sum, opened_max FROM daily WHERE day >= ? ORDER BY day",
+        (day_of(since(weeks * 7)),),
+    )
+    for row in rows:
+        year, week, _ = _dt.date.fromisoformat(row["day"]).isocalendar()
+        group = groups.setdefault(
+            f"{year}-W{week:02d}", {"samples": 0, "conflicts_max": 0, "conflicts_sum": 0, "opened_max": 0},
+        )
+        group["samples"] += row["samples"]
+        group["conflicts_sum"] += row["conflicts_sum"]
+        group["conflicts_max"] = max(group["conflicts_max"], row["conflicts_max"])
+        group["opened_max"] = max(group["opened_max"], row["opened_max"])
+    return [
+        {
+            "week": week,
+            "conflicts_max": group["conflicts_max"],
+            "conflicts_avg": round(group["conflicts_sum"] / group["samples"], 2),
+            "opened_max": group["opened_max"],
+        }
+        for week, group in groups.items()
+    ]
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description="Record p4status reports and query trends over time")
+    parser.add_argument("database", help="SQLite history file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("record", help="Record a p4status.py JSON report")
+    add.add_argument("report", nargs="?", default="-", help="Report file (default: stdin)")
+    add.add_argument("--keep-raw-days", type=float, default=KEEP_RAW_DAYS,
+                     help=f"Keep per-run counts this long before only the daily rollup remains (default: {KEEP_RAW_DAYS})")
+    add.add_argument("--keep-spans-days", type=float, default=KEEP_SPANS_DAYS,
+                     help=f"Keep ended checkouts this long (default: {KEEP_SPANS_DAYS})")
+    users = commands.add_parser("users", help="Opened files per user per day")
+    users.add_argument("--days", type=float, default=30)
+    users.add_argument("--user")
+    locks = commands.add_parser("locks", help="How long exclusive locks lasted, per user")
+    locks.add_argument("--days", type=float, default=30)
+    conflicts = commands.add_parser("conflicts", help="Conflicting opens per week")
+    conflicts.add_argument("--weeks", type=int, default=16)
+    args = parser.parse_args()
+
+    db = connect(args.database)
+    try:
+        if args.command == "record":
+            if args.report == "-":
+                report = json.load(sys.stdin)
+            else:
+                with open(args.report, encoding="utf-8") as fh:
+                    report = json.load(fh)
+            result: Any = record(db, report, args.keep_raw_days, args.keep_spans_days)
+        elif args.command == "users":
+            result = user_opens(db, args.days, args.user)
+        elif args.command == "locks":
+            result = lock_durations(db, args.days)
+        else:
+            result = weekly_conflicts(db, args.weeks)
+    finally:
+        db.close()
+    json.dump(result, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,565 @@
+#!/usr/bin/env python3
+"""
+p4index.py - Local SQLite mirror of opened files and changelists
+
+One refresher process keeps the mirror current; p4status.py (--index) and
+the Slack bot (P4_INDEX_DB) read from it instead of asking the server.
+"""
+
+import argparse
+import datetime as _dt
+import math
+import re
+import sqlite3
+import sys
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from p4status import (
+    BACKENDS,
+    P4Backend,
+    P4CommandError,
+    ZtagBackend,
+    filter_metadata,
+    parse_changes,
+    parse_opened,
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS opened (
+    file TEXT NOT NULL,
+    client TEXT NOT NULL,
+    user TEXT,
+    host TEXT,
+    action TEXT,
+    change TEXT,
+    type TEXT,
+    rev TEXT,
+    locked INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (file, client)
+);
+CREATE INDEX IF NOT EXISTS opened_user ON opened (user);
+CREATE INDEX IF NOT EXISTS opened_client ON opened (client);
+CREATE INDEX IF NOT EXISTS opened_change ON opened (change);
+
+CREATE TABLE IF NOT EXISTS changes (
+    status TEXT NOT NULL,
+    change INTEGER NOT NULL,
+    user TEXT,
+    client TEXT,
+    time INTEGER,
+    desc TEXT,
+    PRIMARY KEY (status, change)
+);
+CREATE INDEX IF NOT EXISTS changes_user ON changes (user);
+CREATE INDEX IF NOT EXISTS changes_client ON changes (client);
+CREATE INDEX IF NOT EXISTS changes_change ON changes (change);
+
+-- Inverted index of submitted changelists: one posting per (term, change).
+CREATE TABLE IF NOT EXISTS search_terms (
+    term TEXT NOT NULL,
+    change INTEGER NOT NULL,
+    weight INTEGER NOT NULL,
+    PRIMARY KEY (term, change)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Report metadata field -> p4 info field, stored in meta at refresh time.
+INFO_KEYS = {
+    "server": "serverAddress",
+    "client": "clientName",
+    "user": "userName",
+    "host": "clientHost",
+}
+
+# Posting weight of a term per occurrence, by where it appears in the change.
+SEARCH_WEIGHTS = {"desc": 3, "user": 2, "client": 2, "path": 1}
+# Changelists per 'describe -s' call when collecting paths for the search index.
+DESCRIBE_BATCH = 100
+
+OPENED_COLUMNS = ("file", "client", "user", "host", "action", "change", "type", "rev", "locked")
+
+# Pending and shelved lists are refetched when the change counter moves or
+# after this many seconds, for the edits and deletes that leave it alone.
+DEFAULT_CHANGES_MAX_AGE = 300
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """Open (and create if needed) the index database."""
+    db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    db.row_factory = sqlite3.Row
+    # WAL lets readers keep going while the refresher writes.
+    db.execute("PRAGMA journal_mode=WAL")
+    db.executescript(SCHEMA)
+    db.create_function("REGEXP", 2, lambda pattern, value: value is not None and re.match(pattern, value) is not None)
+    return db
+
+
+def get_meta(db: sqlite3.Connection, key: str) -> Optional[str]:
+    row = db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def set_meta(db: sqlite3.Connection, key: str, value: Any) -> None:
+    db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+
+def pathspec_regex(pathspec: str) -> str:
+    """Translate a depot pathspec into an anchored regular expression."""
+    parts = re.split(r"(\.\.\.|\*)", pathspec)
+    wildcards = {"...": ".*", "*": "[^/]*"}
+    return "".join(wildcards.get(part) or re.escape(part) for part in parts) + r"\Z"
+
+
+def pathspec_prefix(pathspec: str) -> str:
+    """Literal leading part of a pathspec, for an indexed range scan."""
+    return re.split(r"\.\.\.|\*", pathspec, maxsplit=1)[0]
+
+
+def read_counter(backend: P4Backend) -> int:
+    records = list(backend.stream(["counter", "change"]))
+    return int(records[0].get("value", "0")) if records else 0
+
+
+def refresh_opened(db: sqlite3.Connection, backend: P4Backend, pathspec: str) -> Dict[str, int]:
+    """Apply the difference between the server's opened files and the mirror.
+
+    This is the one full scan left in a pass: no p4 command lists only the
+    opens that changed, and most of them do not move the change counter, so
+    the server runs the whole ``opened -a`` every time. The snapshot is
+    streamed into a temporary table and diffed in SQL, so only added,
+    removed or changed rows are written locally.
+    """
+    db.execute("CREATE TEMP TABLE IF NOT EXISTS opened_new AS SELECT * FROM opened WHERE 0")
+    db.execute("DELETE FROM opened_new")
+    rows = (
+        (
+            record.get("depotFile", ""),
+            record.get("client") or "",
+            record.get("user"),
+            record.get("host"),
+            record.get("action"),
+            record.get("change"),
+            record.get("type"),
+            record.get("rev"),
+            int("ourLock" in record),
+        )
+        for record in backend.stream(["opened", "-a", pathspec])
+    )
+    db.executemany(f"INSERT OR REPLACE INTO opened_new VALUES ({', '.join('?' * len(OPENED_COLUMNS))})", rows)
+    removed = db.execute(
+        "DELETE FROM opened WHERE NOT EXISTS "
+        "(SELECT 1 FROM opened_new n WHERE n.file = opened.file AND n.client = opened.client)"
+    ).rowcount
+    upserted = db.execute(
+        "INSERT OR REPLACE INTO opened SELECT * FROM opened_new n WHERE NOT EXISTS "
+        "(SELECT 1 FROM opened o WHERE o.file = n.file AND o.client = n.client AND "
+        + " AND ".join(f"o.{col} IS n.{col}" for col in OPENED_COLUMNS[2:])
+        + ")"
+    ).rowcount
+    db.execute("DELETE FROM opened_new")
+    return {"opened_removed": removed, "opened_upserted": upserted}
+
+
+def change_rows(status: str, records: Iterable[Dict[str, str]]) -> Iterator[tuple]:
+    for record in records:
+        if not record.get("change", "").isdigit():
+            continue
+        when = record.get("time", "")
+        yield (status, int(record["change"]), record.get("user"), record.get("client"),
+               int(when) if when.isdigit() else None, record.get("desc", ""))
+
+
+def refresh_changes(
+    db: sqlite3.Connection,
+    backend: P4Backend,
+    pathspec: str,
+    counter: int,
+    max_age: float = DEFAULT_CHANGES_MAX_AGE,
+) -> Dict[str, int]:
+    """Bring the changelist tables up to date.
+
+    Submitted changes never change, so only those above the last indexed
+    number are fetched, and only when the change counter has moved.
+    Pending and shelved changes can be edited or deleted, and there can be
+    tens of thousands of them, so their lists are replaced only when the
+    counter has moved (new changelists, submits, new shelves) or the last
+    fetch is ``max_age`` seconds old. An edit or delete that leaves the
+    counter alone shows up within ``max_age``.
+    """
+    stats = {}
+    indexed_counter = int(get_meta(db, "counter") or 0)
+    submitted_through = get_meta(db, "submitted_through")
+    if submitted_through is None or counter != indexed_counter:
+        args = ["changes", "-l", "-s", "submitted", pathspec]
+        if submitted_through is not None:
+            args[-1] = f"{pathspec}@{int(submitted_through) + 1},@now"
+        rows = change_rows("submitted", backend.stream(args))
+        stats["submitted_added"] = db.executemany(
+            "INSERT OR REPLACE INTO changes VALUES (?, ?, ?, ?, ?, ?)", rows
+        ).rowcount
+        newest = db.execute("SELECT MAX(change) FROM changes WHERE status = 'submitted'").fetchone()[0]
+        set_meta(db, "submitted_through", newest or 0)
+    fetched_at = float(get_meta(db, "pending_fetched_at") or 0)
+    if counter != indexed_counter or time.time() - fetched_at >= max_age:
+        for status in ("pending", "shelved"):
+            db.execute("DELETE FROM changes WHERE status = ?", (status,))
+            stats[status] = db.executemany(
+                "INSERT INTO changes VALUES (?, ?, ?, ?, ?, ?)",
+                change_rows(status, backend.stream(["changes", "-l", "-s", status, pathspec])),
+            ).rowcount
+        set_meta(db, "pending_fetched_at", time.time())
+    return stats
+
+
+def terms(text: str) -> List[str]:
+    """Lower-case words of two or more letters or digits; paths split on / . _ -."""
+    return [word for word in re.findall(r"[a-z0-9]+", text.lower()) if len(word) > 1]
+
+
+def describe_paths(backend: P4Backend, changes: List[int]) -> Dict[int, List[str]]:
+    """Depot files of each change, from 'describe -s' calls of DESCRIBE_BATCH changes."""
+    paths: Dict[int, List[str]] = {}
+    for start in range(0, len(changes), DESCRIBE_BATCH):
+        batch = [str(change) for change in changes[start:start + DESCRIBE_BATCH]]
+        for record in backend.stream(["describe", "-s", *batch]):
+            files = paths.setdefault(int(record.get("change", "0")), [])
+            for key, value in record.items():
+                if key.rstrip("0123456789") == "depotFile":
+                    # P4Python folds depotFile0..n into one list.
+                    files.extend(value if isinstance(value, list) else [value])
+    return paths
+
+
+def refresh_search(db: sqlite3.Connection, backend: P4Backend) -> Dict[str, int]:
+    """Index submitted changes above ``search_through`` for /search.
+
+    Descriptions, users and clients come from the changes table, so only
+    depot paths cost server calls: one 'describe -s' per DESCRIBE_BATCH new
+    changes. Submitted changes never change, so postings are only added.
+    """
+    through = int(get_meta(db, "search_through") or 0)
+    rows = db.execute(
+        "SELECT change, user, client, desc FROM changes WHERE status = 'submitted' AND change > ? ORDER BY change",
+        (through,),
+    ).fetchall()
+    if not rows:
+        return {"search_indexed": 0}
+    paths = describe_paths(backend, [row["change"] for row in rows])
+    postings = []
+    for row in rows:
+        weights: Dict[str, int] = {}
+        fields = [("desc", row["desc"] or ""), ("user", row["user"] or ""), ("client", row["client"] or "")]
+        fields += [("path", path) for path in paths.get(row["change"], [])]
+        for field, text in fields:
+            for term in terms(text):
+                weights[term] = weights.get(term, 0) + SEARCH_WEIGHTS[field]
+        postings.extend((term, row["change"], weight) for term, weight in weights.items())
+    db.executemany("INSERT OR REPLACE INTO search_terms VALUES (?, ?, ?)", postings)
+    set_meta(db, "search_through", rows[-1]["change"])
+    return {"search_indexed": len(rows)}
+
+
+def search(db: sqlite3.Connection, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+    """Submitted changes containing every term of ``query``, best match first.
+
+    A change scores the sum over the query terms of its posting weight times
+    the term's inverse document frequency, so rare words count for more than
+    "fix" or "update". Ties go to the newer change.
+    """
+    words = list(dict.fromkeys(terms(query)))
+    if not words:
+        return []
+    indexed = db.execute("SELECT COUNT(*) FROM changes WHERE status = 'submitted'").fetchone()[0] or 1
+    idf = {}
+    for word in words:
+        df = db.execute("SELECT COUNT(*) FROM search_terms WHERE term = ?", (word,)).fetchone()[0]
+        if not df:
+            return []
+        idf[word] = math.log(1 + indexed / df)
+    # Start from the rarest term so the join touches the fewest postings.
+    words.sort(key=lambda word: -idf[word])
+    sql = "SELECT t0.change, " + " + ".join(f"t{i}.weight * ?" for i in range(len(words))) + " AS score"
+    sql += " FROM search_terms t0"
+    for i in range(1, len(words)):
+        sql += f" JOIN search_terms t{i} ON t{i}.term = ? AND t{i}.change = t0.change"
+    sql += " WHERE t0.term = ? ORDER BY score DESC, t0.change DESC LIMIT ?"
+    params: List[Any] = [idf[word] for word in words] + words[1:] + [words[0], limit]
+    scores = db.execute(sql, params).fetchall()
+    results = []
+    for change, score in scores:
+        row = db.execute("SELECT * FROM changes WHERE status = 'submitted' AND change = ?", (change,)).fetchone()
+        record = parse_changes([change_record(row)])[0]
+        record["score"] = round(score, 3)
+        results.append(record)
+    return results
+
+
+def refresh(
+    db: sqlite3.Connection,
+    backend: P4Backend,
+    pathspec: str,
+    with_search: bool = False,
+    changes_max_age: float = DEFAULT_CHANGES_MAX_AGE,
+) -> Dict[str, Any]:
+    """Run one refresh pass; returns counts of what changed.
+
+    ``with_search`` also brings the /search index up to date.
+    ``changes_max_age`` bounds how stale the pending and shelved lists get
+    (see ``refresh_changes``).
+    """
+    indexed_path = get_meta(db, "path")
+    if indexed_path and indexed_path != pathspec:
+        raise ValueError(f"index covers {indexed_path}, not {pathspec}")
+    counter = read_counter(backend)
+    info = next(iter(backend.stream(["info"])), {})
+    with db:
+        stats = refresh_changes(db, backend, pathspec, counter, changes_max_age)
+        stats.update(refresh_opened(db, backend, pathspec))
+        if with_search:
+            stats.update(refresh_search(db, backend))
+        for key in INFO_KEYS.values():
+            set_meta(db, key, info.get(key, ""))
+        set_meta(db, "path", pathspec)
+        set_meta(db, "counter", counter)
+        set_meta(db, "refreshed_at", _dt.datetime.now(tz=_dt.timezone.utc).isoformat())
+    stats["counter"] = counter
+    return stats
+
+
+def query_opened(
+    db: sqlite3.Connection,
+    pathspec: str = "//...",
+    user: Optional[str] = None,
+    client: Optional[str] = None,
+    change: Optional[str] = None,
+    limit: Optional[int] = None,
+    after: Optional[Tuple[str, str]] = None,
+) -> List[sqlite3.Row]:
+    """Opened-file rows under pathspec, ordered by file then client.
+
+    ``after`` is a (file, client) key; only rows past it are returned.
+    """
+    prefix = pathspec_prefix(pathspec)
+    sql = "SELECT * FROM opened WHERE file >= ? AND file < ?"
+    params: List[Any] = [prefix, prefix + "\U0010ffff"]
+    if pathspec[len(prefix):] != "...":
+        sql += " AND file REGEXP ?"
+        params.append(pathspec_regex(pathspec))
+    for column, value in (("user", user), ("client", client), ("change", change)):
+        if value is not None:
+            sql += f" AND {column} = ?"
+            params.append(value)
+    if after is not None:
+        sql += " AND (file, client) > (?, ?)"
+        params.extend(after)
+    sql += " ORDER BY file, client"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return db.execute(sql, params).fetchall()
+
+
+def changes_where(status: str, user: Optional[str], client: Optional[str]) -> Tuple[str, List[Any]]:
+    sql = "status = ?"
+    params: List[Any] = [status]
+    for column, value in (("user", user), ("client", client)):
+        if value is not None:
+            sql += f" AND {column} = ?"
+            params.append(value)
+    return sql, params
+
+
+def count_changes(
+    db: sqlite3.Connection,
+    status: str,
+    user: Optional[str] = None,
+    client: Optional[str] = None,
+) -> int:
+    where, params = changes_where(status, user, client)
+    return db.execute(f"SELECT COUNT(*) FROM changes WHERE {where}", params).fetchone()[0]
+
+
+def query_changes(
+    db: sqlite3.Connection,
+    status: str,
+    limit: Optional[int] = None,
+    user: Optional[str] = None,
+    client: Optional[str] = None,
+) -> List[sqlite3.Row]:
+    """Changelists with the given status, newest first."""
+    where, params = changes_where(status, user, client)
+    sql = f"SELECT * FROM changes WHERE {where} ORDER BY change DESC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return db.execute(sql, params).fetchall()
+
+
+def opened_record(row: sqlite3.Row) -> Dict[str, str]:
+    """An index row in the shape of a tagged ``opened`` record."""
+    record = {
+        "depotFile": row["file"],
+        "client": row["client"],
+        "user": row["user"],
+        "host": row["host"],
+        "action": row["action"],
+        "change": row["change"],
+        "type": row["type"],
+        "rev": row["rev"],
+    }
+    record = {key: value for key, value in record.items() if value is not None}
+    if row["locked"]:
+        record["ourLock"] = ""
+    return record
+
+
+def change_record(row: sqlite3.Row) -> Dict[str, str]:
+    """An index row in the shape of a tagged ``changes`` record."""
+    return {
+        "change": str(row["change"]),
+        "user": row["user"] or "",
+        "client": row["client"] or "",
+        "time": str(row["time"] or ""),
+        "desc": row["desc"] or "",
+        "status": "pending" if row["status"] == "shelved" else row["status"],
+    }
+
+
+def read_report(
+    db: sqlite3.Connection,
+    pathspec: str,
+    limit: int,
+    user: Optional[str] = None,
+    client: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Build a p4status report from the index without contacting the server.
+
+    ``user`` and ``client`` filter rows with the indexed columns.
+    """
+    indexed_path = get_meta(db, "path")
+    data: Dict[str, Any] = {
+        "metadata": {
+            "path": pathspec,
+            "limit": limit,
+            "generated_at": _dt.datetime.now(tz=_dt.timezone.utc).isoformat(),
+            **{field: get_meta(db, key) for field, key in INFO_KEYS.items()},
+            "source": "index",
+            "index_path": indexed_path,
+            "index_refreshed_at": get_meta(db, "refreshed_at"),
+            "index_counter": get_meta(db, "counter"),
+            **filter_metadata(user, client),
+        },
+        "opened_files": [],
+        "opened_conflicts": [],
+        "errors": {},
+    }
+    if indexed_path is None:
+        data["errors"]["index"] = {"status": "index", "stderr": "index has not been refreshed yet", "command": ""}
+        return data
+    opened = parse_opened([opened_record(row) for row in query_opened(db, pathspec, user=user, client=client)])
+    data["opened_files"] = opened
+    by_file: Dict[str, List[Dict[str, Any]]] = {}
+    for entry in opened:
+        by_file.setdefault(entry["file"], []).append(entry)
+    data["opened_conflicts"] = [
+        {"file": file_path, "entries": entries}
+        for file_path, entries in by_file.items()
+        if len(entries) > 1
+    ]
+    for status in ("pending", "submitted", "shelved"):
+        key = f"{status}_changes"
+        if pathspec != indexed_path:
+            data[key] = {"total": 0, "items": [], "has_more": False}
+            data["errors"][status] = {
+                "status": "index",
+                "stderr": f"changelists are indexed for {indexed_path} only",
+                "command": "",
+            }
+            continue
+        rows = query_changes(db, status, limit + 1, user=user, client=client)
+        items = parse_changes([change_record(row) for row in rows[:limit]])
+        has_more = len(rows) > limit
+        # Counting the local table is cheap, so index reports always have an exact total.
+        total = count_changes(db, status, user=user, client=client) if has_more else len(items)
+        data[key] = {"total": total, "items": items, "has_more": has_more}
+    # Keep the same key order as a live report.
+    data["errors"] = data.pop("errors")
+    return data
+
+
+def search_report(db: sqlite3.Connection, query: str, limit: int) -> Dict[str, Any]:
+    """``search()`` results with the index's freshness, for p4status.py --search."""
+    data: Dict[str, Any] = {
+        "metadata": {
+            "query": query,
+            "limit": limit,
+            "generated_at": _dt.datetime.now(tz=_dt.timezone.utc).isoformat(),
+            "source": "index",
+            "index_path": get_meta(db, "path"),
+            "index_refreshed_at": get_meta(db, "refreshed_at"),
+            "search_through": get_meta(db, "search_through"),
+        },
+        "results": [],
+        "errors": {},
+    }
+    if data["metadata"]["search_through"] is None:
+        data["errors"]["index"] = {
+            "status": "index", "stderr": "search index is empty; refresh with p4index.py --search", "command": "",
+        }
+    else:
+        data["results"] = search(db, query, limit)
+    return data
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description="Maintain a local SQLite index of Perforce opened files and changes")
+    parser.add_argument("database", help="SQLite index file")
+    parser.add_argument("pathspec", nargs="?", default="//...",
+                        help="Perforce path specification to mirror (default: //...)")
+    parser.add_argument("--interval", type=float, default=None,
+                        help="Keep refreshing every this many seconds instead of once")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default=ZtagBackend.name,
+                        help="How to talk to Perforce (see p4status.py)")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="Kill any single p4 command after this many seconds")
+    parser.add_argument("--search", action="store_true",
+                        help="Also maintain the full-text index of submitted changelists used by /search")
+    parser.add_argument("--changes-max-age", type=float, default=DEFAULT_CHANGES_MAX_AGE, metavar="SECONDS",
+                        help="Refetch pending and shelved changelists at least this often, even if the change "
+                             f"counter has not moved (default: {DEFAULT_CHANGES_MAX_AGE})")
+    args = parser.parse_args()
+
+    pathspec = args.pathspec
+    if not pathspec.endswith("..."):
+        pathspec = f"{pathspec.rstrip('/')}/..."
+
+    db = connect(args.database)
+    backend = BACKENDS[args.backend](timeout=args.timeout)
+    try:
+        while True:
+            started = time.monotonic()
+            try:
+                stats = refresh(db, backend, pathspec, with_search=args.search, changes_max_age=args.changes_max_age)
+                stats["seconds"] = round(time.monotonic() - started, 3)
+                print(" ".join(f"{key}={value}" for key, value in stats.items()), flush=True)
+            except P4CommandError as exc:
+                print(f"refresh failed: {exc.info}", file=sys.stderr, flush=True)
+                if args.interval is None:
+                    sys.exit(1)
+            if args.interval is None:
+                break
+            time.sleep(max(0.0, args.interval - (time.monotonic() - started)))
+    finally:
+        backend.close()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
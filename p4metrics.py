@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+p4metrics.py - Timing, size and error metrics for Perforce calls
+
+The scripts record every p4 call (and Slack post) into METRICS.
+p4status.py --profile copies the calls into the report metadata; the bot and
+the submit-slack.py forwarder serve the totals as Prometheus text over HTTP.
+"""
+
+import bisect
+import collections
+import http.server
+import io
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Histogram bucket upper bounds in seconds.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    """Cumulative latency histogram; quantiles are estimated from the buckets."""
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Interpolate linearly inside the bucket holding rank ``q * count``."""
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for index, count in enumerate(self.counts):
+            upper = self.buckets[index] if index < len(self.buckets) else lower
+            if count and seen + count >= rank:
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = upper
+        return lower
+
+
+class Metrics:
+    """Histograms and byte/record/error totals per (kind, name), e.g. ("p4", "opened").
+
+    The last ``recent`` observations are also kept with their details.
+    """
+
+    def __init__(self, recent: int = 100):
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self.recent: "collections.deque[Dict[str, Any]]" = collections.deque(maxlen=recent)
+
+    def observe(
+        self,
+        kind: str,
+        name: str,
+        seconds: float,
+        nbytes: int = 0,
+        records: int = 0,
+        error: bool = False,
+        **detail: Any,
+    ) -> None:
+        with self._lock:
+            series = self._series.get((kind, name))
+            if series is None:
+                series = self._series[(kind, name)] = {
+                    "histogram": Histogram(), "bytes": 0, "records": 0, "errors": 0,
+                }
+            series["histogram"].observe(seconds)
+            series["bytes"] += nbytes
+            series["records"] += records
+            series["errors"] += int(error)
+            self.recent.append({
+                "kind": kind,
+                "name": name,
+                "seconds": round(seconds, 6),
+                "bytes": nbytes,
+                "records": records,
+                "error": error,
+                **{key: round(value, 6) if isinstance(value, float) else value for key, value in detail.items()},
+            })
+
+    def summary(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """Totals and p50/p95/p99 per kind and name."""
+        summary: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        with self._lock:
+            for (kind, name), series in sorted(self._series.items()):
+                histogram = series["histogram"]
+                entry = {
+                    "calls": histogram.count,
+                    "total_s": round(histogram.sum, 6),
+                    "bytes": series["bytes"],
+                    "records": series["records"],
+                    "errors": series["errors"],
+                }
+                for q in QUANTILES:
+                    entry[f"p{int(q * 100)}_s"] = round(histogram.quantile(q), 6)
+                summary.setdefault(kind, {})[name] = entry
+        return summary
+
+    def render(self, prefix: str = "p4") -> str:
+        """Prometheus text exposition of every series."""
+        families: Dict[str, List[Tuple[str, Dict[str, Any]]]] = collections.defaultdict(list)
+        with self._lock:
+            for (kind, name), series in sorted(self._series.items()):
+                families[kind].append((name, series))
+            lines = []
+            for kind, members in families.items():
+                base = f"{prefix}_{kind}"
+                lines.append(f"# TYPE {base}_seconds histogram")
+                for name, series in members:
+                    histogram = series["histogram"]
+                    cumulative = 0
+                    for bound, count in zip((*histogram.buckets, "+Inf"), histogram.counts):
+                        cumulative += count
+                        lines.append(f'{base}_seconds_bucket{{name="{name}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{base}_seconds_sum{{name="{name}"}} {histogram.sum:.6f}')
+                    lines.append(f'{base}_seconds_count{{name="{name}"}} {histogram.count}')
+                lines.append(f"# TYPE {base}_seconds_estimate gauge")
+                for name, series in members:
+                    for q in QUANTILES:
+                        value = series["histogram"].quantile(q)
+                        lines.append(f'{base}_seconds_estimate{{name="{name}",quantile="{q}"}} {value:.6f}')
+                for total in ("bytes", "records", "errors"):
+                    if total != "errors" and not any(series[total] for _, series in members):
+                        continue
+                    lines.append(f"# TYPE {base}_{total}_total counter")
+                    for name, series in members:
+                        lines.append(f'{base}_{total}_total{{name="{name}"}} {series[total]}')
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = "127.0.0.1", prefix: str = "p4") -> http.server.ThreadingHTTPServer:
+        """Serve ``render()`` on ``http://host:port/metrics`` from a daemon thread."""
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render(prefix).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+        return server
+
+
+METRICS = Metrics()
+
+
+@contextmanager
+def timed(kind: str, name: str, metrics: Optional[Metrics] = None) -> Iterator[Dict[str, Any]]:
+    """Time the block and record it. The caller may set ``nbytes``, ``records``
+    and ``error`` on the yielded dict; an exception marks the call as an error."""
+    call: Dict[str, Any] = {"nbytes": 0, "records": 0, "error": False}
+    start = time.perf_counter()
+    try:
+        yield call
+    except BaseException:
+        call["error"] = True
+        raise
+    finally:
+        (metrics or METRICS).observe(kind, name, time.perf_counter() - start, **call)
+
+
+# Global p4 options that take a value, e.g. ``p4 -p host:1666 -u user opened``.
+P4_VALUE_OPTIONS = {"-c", "-C", "-d", "-H", "-L", "-p", "-P", "-Q", "-r", "-u", "-v", "-x", "-z"}
+
+
+def command_name(argv: List[str]) -> str:
+    """The p4 command in a command line such as ``["p4", "-ztag", "opened", "-a"]``."""
+    args = iter(argv[1:])
+    for arg in args:
+        if arg in P4_VALUE_OPTIONS:
+            next(args, None)
+        elif not arg.startswith("-"):
+            return arg
+    return "p4"
+
+
+def record_bytes(record: Any) -> int:
+    """Approximate size of a P4Python result record (the text it carries)."""
+    if isinstance(record, dict):
+        return sum(record_bytes(value) for value in record.values())
+    if isinstance(record, (list, tuple)):
+        return sum(record_bytes(value) for value in record)
+    return len(record) if isinstance(record, (str, bytes)) else 0
+
+
+class CountingReader(io.RawIOBase):
+    """Raw reader that counts the bytes read and the time spent waiting for them."""
+
+    def __init__(self, raw: io.RawIOBase):
+        self.raw = raw
+        self.nbytes = 0
+        self.wait_s = 0.0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> Optional[int]:
+        start = time.perf_counter()
+        count = self.raw.readinto(buffer)
+        self.wait_s += time.perf_counter() - start
+        self.nbytes += count or 0
+        return count
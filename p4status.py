@@ -5,27 +5,41 @@ p4status.py - Generate JSON status report for Perforce depot
 
 import argparse
 import collections
+import contextvars
 import datetime as _dt
+import fcntl
+import heapq
+import io
+import itertools
 import json
+import marshal
+import os
+import resource
+import shutil
 import subprocess
 import sys
-from typing import Dict, List, Optional, Tuple, Any
-
-
-def run_p4(args: List[str]) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
-    """Run a Perforce command, returning stdout on success."""
-    result = subprocess.run([
-        "p4",
-        "-ztag",
-        *args,
-    ], capture_output=True, text=True)
-    if result.returncode != 0:
-        return None, {
-            "status": result.returncode,
-            "stderr": result.stderr.strip(),
-            "command": " ".join(["p4", "-ztag", *args]),
-        }
-    return result.stdout, None
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Any
+
+import p4guard
+import p4metrics
+
+DEFAULT_JOBS = 5
+# Longest a cached section is trusted while the change counter stands still.
+DEFAULT_CACHE_MAX_AGE = 300
+# Message severities at or above this are command failures (E_FAILED).
+P4_SEVERITY_FAILED = 3
+
+
+class P4CommandError(Exception):
+    """A Perforce command failed; ``info`` is the dict reported under ``errors``."""
+
+    def __init__(self, info: Dict[str, Any]):
+        super().__init__(info.get("stderr", ""))
+        self.info = info
 
 
 def parse_info(output: str) -> Dict[str, str]:
@@ -41,49 +55,478 @@ def parse_info(output: str) -> Dict[str, str]:
     return info
 
 
-def parse_records(output: str, start_key: str) -> List[Dict[str, str]]:
-    """Parse p4 tagged output into records starting with start_key."""
-    records = []
+def iter_records(lines: Iterable[str], start_key: str) -> Iterator[Dict[str, str]]:
+    """Yield p4 tagged records starting with start_key as the lines arrive."""
     current = None
-    for raw_line in output.splitlines():
+    for raw_line in lines:
         if not raw_line.startswith("... "):
             continue
-        parts = raw_line[4:].split(" ", 1)
-        key = parts[0]
+        parts = raw_line[4:].rstrip("\n").split(" ", 1)
+        key = sys.intern(parts[0])
         value = parts[1] if len(parts) > 1 else ""
         if key == start_key:
             if current:
-                records.append(current)
+                yield current
             current = {key: value}
         else:
             if current is None:
                 current = {}
             current[key] = value
     if current:
-        records.append(current)
-    return records
+        yield current
+
+
+def parse_records(output: str, start_key: str) -> List[Dict[str, str]]:
+    """Parse p4 tagged output into records starting with start_key."""
+    return list(iter_records(output.splitlines(), start_key))
+
+
+def iter_marshal(stream: BinaryIO) -> Iterator[Dict[str, str]]:
+    """Yield ``p4 -G`` marshal records as str dicts until the stream ends."""
+    while True:
+        try:
+            raw = marshal.load(stream)
+        except EOFError:
+            return
+        yield {
+            key.decode("utf-8", "replace"): value.decode("utf-8", "replace")
+            if isinstance(value, bytes) else str(value)
+            for key, value in raw.items()
+        }
+
+
+def stream_process(
+    command: List[str],
+    timeout: Optional[float],
+    read: Callable[[BinaryIO], Iterator[Dict[str, str]]],
+    env: Optional[Dict[str, str]] = None,
+) -> Iterator[Dict[str, str]]:
+    """Yield records parsed from a p4 subprocess's stdout as it runs.
+
+    Closing the generator early kills the process, so a caller that has
+    what it needs stops paying for the rest of the output. A process that
+    runs past ``timeout`` seconds, or past the caller's ``p4guard``
+    deadline, is killed and raises ``P4CommandError``.
+
+    Each call is recorded in ``p4metrics.METRICS`` with its spawn time, time
+    spent waiting for output, time spent parsing, bytes and records.
+    """
+    try:
+        timeout = p4guard.budget(timeout)
+    except p4guard.DeadlineExceeded as exc:
+        raise P4CommandError({"status": "timeout", "stderr": str(exc), "command": " ".join(command)})
+    started = time.perf_counter()
+    with tempfile.TemporaryFile() as errfile:
+        proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=errfile, bufsize=0, env=env)
+        spawn_s = time.perf_counter() - started
+        stdout = p4metrics.CountingReader(proc.stdout)
+        expired = threading.Event()
+        closed_early = False
+        records = 0
+        reading_s = 0.0
+
+        def expire() -> None:
+            expired.set()
+            proc.kill()
+
+        timer = threading.Timer(timeout, expire) if timeout else None
+        if timer:
+            timer.daemon = True
+            timer.start()
+        try:
+            parsed = read(io.BufferedReader(stdout))
+            while True:
+                before = time.perf_counter()
+                try:
+                    record = next(parsed)
+                except StopIteration:
+                    break
+                finally:
+                    reading_s += time.perf_counter() - before
+                records += 1
+                yield record
+        finally:
+            if timer:
+                timer.cancel()
+            if proc.poll() is None and not expired.is_set():
+                # Early close or a read error; drain nothing more.
+                closed_early = True
+                proc.kill()
+            proc.stdout.close()
+            returncode = proc.wait()
+            p4metrics.METRICS.observe(
+                "p4", p4metrics.command_name(command), time.perf_counter() - started,
+                nbytes=stdout.nbytes,
+                records=records,
+                error=expired.is_set() or (returncode != 0 and not closed_early),
+                spawn_s=spawn_s,
+                wait_s=stdout.wait_s,
+                parse_s=max(0.0, reading_s - stdout.wait_s),
+            )
+        if expired.is_set():
+            raise P4CommandError({
+                "status": "timeout",
+                "stderr": f"timed out after {round(timeout, 2)}s",
+                "command": " ".join(command),
+            })
+        if returncode != 0:
+            errfile.seek(0)
+            raise P4CommandError({
+                "status": returncode,
+                "stderr": errfile.read().decode("utf-8", "replace").strip(),
+                "command": " ".join(command),
+            })
+
+
+class P4Backend:
+    """Runs a Perforce command and yields its tagged records as dicts."""
+
+    name = ""
+
+    def __init__(
+        self,
+        timeout: Optional[float] = None,
+        port: Optional[str] = None,
+        user: Optional[str] = None,
+        ticket: Optional[str] = None,
+    ):
+        """``port``, ``user`` and ``ticket`` override P4PORT, P4USER and P4PASSWD.
+        They are passed in the environment, so tickets stay out of argv and
+        of the command strings reported under ``errors``."""
+        self.timeout = timeout
+        self.port = port
+        self.user = user
+        self.ticket = ticket
+        overrides = {"P4PORT": port, "P4USER": user, "P4PASSWD": ticket}
+        overrides = {key: value for key, value in overrides.items() if value}
+        self.env = dict(os.environ, **overrides) if overrides else None
+
+    def stream(self, args: List[str], limit: Optional[int] = None) -> Iterator[Dict[str, str]]:
+        """Yield at most ``limit`` records; raise ``P4CommandError`` on failure."""
+        raise NotImplementedError
+
+    def run(self, args: List[str]) -> Tuple[Optional[List[Dict[str, str]]], Optional[Dict[str, Any]]]:
+        """Return every record, or the error dict, in the style of a p4 call."""
+        try:
+            return list(self.stream(args)), None
+        except P4CommandError as exc:
+            return None, exc.info
+
+    def count(self, args: List[str]) -> int:
+        """Count records without keeping them."""
+        total = 0
+        for _ in self.stream(args):
+            total += 1
+        return total
+
+    def close(self) -> None:
+        pass
+
+
+class ZtagBackend(P4Backend):
+    """``p4 -ztag`` text output, split back into records line by line."""
+
+    name = "ztag"
+
+    # First field of each record, per command; commands not listed here
+    # produce a single record.
+    START_KEYS = {
+        "opened": "depotFile",
+        "files": "depotFile",
+        "changes": "change",
+        "describe": "change",
+        "clients": "client",
+    }
+
+    def stream(self, args: List[str], limit: Optional[int] = None) -> Iterator[Dict[str, str]]:
+        start_key = self.START_KEYS.get(args[0])
+
+        def read(stdout: BinaryIO) -> Iterator[Dict[str, str]]:
+            lines = io.TextIOWrapper(stdout, encoding="utf-8", errors="replace")
+            if start_key is None:
+                yield parse_info(lines.read())
+            else:
+                yield from iter_records(lines, start_key)
+
+        records = stream_process(["p4", "-ztag", *args], self.timeout, read, self.env)
+        try:
+            yield from itertools.islice(records, limit)
+        finally:
+            records.close()
+
+
+class MarshalBackend(P4Backend):
+    """``p4 -G`` output, decoded straight from Python marshal records."""
+
+    name = "marshal"
+
+    def stream(self, args: List[str], limit: Optional[int] = None) -> Iterator[Dict[str, str]]:
+        command = ["p4", "-G", *args]
+        records = stream_process(command, self.timeout, iter_marshal, self.env)
+        messages = []
+        produced = 0
+        try:
+            for record in records:
+                code = record.pop("code", "stat")
+                if code == "error" and int(record.get("severity", "0")) >= P4_SEVERITY_FAILED:
+                    messages.append(record.get("data", "").strip())
+                elif code == "stat":
+                    if limit is not None and produced >= limit:
+                        break
+                    produced += 1
+                    yield record
+        finally:
+            records.close()
+        if messages:
+            raise P4CommandError({
+                "status": 1,
+                "stderr": "\n".join(messages),
+                "command": " ".join(command),
+            })
+
+
+class P4PythonBackend(P4Backend):
+    """One P4Python connection shared by every query in the run.
+
+    P4Python connections are not thread-safe, so queries on this backend
+    are serialized. ``timeout`` does not apply, but a ``p4guard`` deadline
+    cancels the running command through ``P4.setbreak()`` where P4Python
+    provides it. Records are collected through an output handler that
+    cancels the command once ``limit`` is hit.
+    """
+
+    name = "p4python"
+
+    def __init__(
+        self,
+        timeout: Optional[float] = None,
+        port: Optional[str] = None,
+        user: Optional[str] = None,
+        ticket: Optional[str] = None,
+    ):
+        super().__init__(timeout, port, user, ticket)
+        from P4 import P4, P4Exception, OutputHandler
+
+        self._exception_type = P4Exception
+        self._handler_type = OutputHandler
+        self._lock = threading.Lock()
+        self._p4 = P4()
+        if port:
+            self._p4.port = port
+        if user:
+            self._p4.user = user
+        if ticket:
+            self._p4.password = ticket
+        # Warnings such as "file(s) not opened" are not failures.
+        self._p4.exception_level = 1
+        try:
+            from P4 import PyKeepAlive
+        except ImportError:
+            pass
+        else:
+            self._p4.setbreak(p4guard.keepalive(PyKeepAlive))
+        self._p4.connect()
+
+    def _run_handled(self, args: List[str], on_record: Callable[[Dict[str, str]], bool]) -> None:
+        """Run a command, feeding each record to ``on_record`` until it returns False."""
+        base = self._handler_type
+
+        class Handler(base):
+            def outputStat(self, stat):
+                call["records"] += 1
+                call["nbytes"] += p4metrics.record_bytes(stat)
+                if on_record(stat):
+                    return base.HANDLED
+                return base.HANDLED | base.CANCEL
+
+        with self._lock, p4metrics.timed("p4", args[0]) as call:
+            command = " ".join(["p4", *args])
+            try:
+                p4guard.budget()
+            except p4guard.DeadlineExceeded as exc:
+                raise P4CommandError({"status": "timeout", "stderr": str(exc), "command": command})
+            self._p4.handler = Handler()
+            try:
+                self._p4.run(*args)
+            except self._exception_type as exc:
+                if p4guard.expired():
+                    raise P4CommandError({
+                        "status": "timeout",
+                        "stderr": "cancelled at the deadline",
+                        "command": command,
+                    })
+                raise P4CommandError({
+                    "status": 1,
+                    "stderr": "\n".join(self._p4.errors) or str(exc),
+                    "command": " ".join(["p4", *args]),
+                })
+            finally:
+                self._p4.handler = None
+
+    def stream(self, args: List[str], limit: Optional[int] = None) -> Iterator[Dict[str, str]]:
+        records = []
+
+        def keep(record: Dict[str, str]) -> bool:
+            records.append(record)
+            return limit is None or len(records) < limit
+
+        if limit != 0:
+            self._run_handled(args, keep)
+        yield from records
+
+    def count(self, args: List[str]) -> int:
+        total = 0
+
+        def tally(record: Dict[str, str]) -> bool:
+            nonlocal total
+            total += 1
+            return True
 
+        self._run_handled(args, tally)
+        return total
 
-def parse_opened(output: str) -> List[Dict[str, Optional[str]]]:
-    """Parse p4 opened output into structured data."""
-    records = parse_records(output, "depotFile")
-    opened = []
+    def close(self) -> None:
+        with self._lock:
+            if self._p4.connected():
+                self._p4.disconnect()
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (ZtagBackend, MarshalBackend, P4PythonBackend)
+}
+
+
+def run_concurrently(
+    tasks: Dict[str, Callable[[], Any]],
+    jobs: int = DEFAULT_JOBS,
+) -> Dict[str, Tuple[Any, Optional[Dict[str, Any]]]]:
+    """Run independent Perforce tasks concurrently, at most ``jobs`` at a time.
+
+    Returns ``(result, error)`` for each task name, where ``error`` is the
+    ``P4CommandError`` info. Queued tasks are cancelled if the caller is
+    interrupted. Each task runs in a copy of the caller's context, so a
+    ``p4guard`` deadline covers it.
+    """
+    def call(task: Callable[[], Any]) -> Tuple[Any, Optional[Dict[str, Any]]]:
+        try:
+            return task(), None
+        except P4CommandError as exc:
+            return None, exc.info
+
+    pool = ThreadPoolExecutor(max_workers=max(1, jobs))
+    try:
+        futures = {name: pool.submit(contextvars.copy_context().run, call, task) for name, task in tasks.items()}
+        return {name: future.result() for name, future in futures.items()}
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def intern(value: Optional[str]) -> Optional[str]:
+    return sys.intern(value) if value is not None else None
+
+
+class OpenedFile:
+    """One entry of ``opened_files``.
+
+    A depot-wide ``opened -a`` can return hundreds of thousands of these, so
+    they use slots rather than a dict each, and share one copy of every
+    user, client, host, action, change and type string. They read like the
+    dicts they replace (``entry["file"]``, ``entry.get("user")``,
+    ``dict(entry)``); ``record_json`` turns them into JSON objects.
+    """
+
+    __slots__ = ("file", "user", "client", "host", "action", "change", "type", "locked")
+
+    def __init__(self, file: str, user: Optional[str], client: Optional[str], host: Optional[str],
+                 action: Optional[str], change: Optional[str], type: Optional[str], locked: bool):
+        self.file = file
+        self.user = intern(user)
+        self.client = intern(client)
+        self.host = intern(host)
+        self.action = intern(action)
+        self.change = intern(change)
+        self.type = intern(type)
+        self.locked = locked
+
+    def keys(self) -> Tuple[str, ...]:
+        return self.__slots__
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "file": self.file, "user": self.user, "client": self.client, "host": self.host,
+            "action": self.action, "change": self.change, "type": self.type, "locked": self.locked,
+        }
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, OpenedFile):
+            return all(getattr(self, key) == getattr(other, key) for key in self.__slots__)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"OpenedFile({self.as_dict()!r})"
+
+
+def record_json(value: Any) -> Dict[str, Any]:
+    """``json.dump`` default: compact records become plain objects only here."""
+    # Not isinstance: p4index imports this file as p4status while it runs as __main__.
+    try:
+        return value.as_dict()
+    except AttributeError:
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable") from None
+
+
+def parse_opened(records: Iterable[Dict[str, str]]) -> List[OpenedFile]:
+    """Convert p4 opened records into structured data.
+
+    Tagged ``opened -a`` output carries an ``ourLock`` field on every open
+    that holds the exclusive lock, so lock state comes from the same query.
+    ``records`` may be a live stream, so raw records are dropped as soon as
+    they are converted. Conversion time is recorded as ("parse", "opened").
+    """
+    entries = []
+    convert_s = 0.0
     for record in records:
-        opened.append({
-            "file": record.get("depotFile", ""),
-            "user": record.get("user"),
-            "client": record.get("client"),
-            "host": record.get("host"),
-            "action": record.get("action"),
-            "change": record.get("change"),
-            "type": record.get("type"),
-        })
-    return opened
+        started = time.perf_counter()
+        entries.append(opened_entry(record))
+        convert_s += time.perf_counter() - started
+    p4metrics.METRICS.observe("parse", "opened", convert_s, records=len(entries))
+    return entries
 
 
-def parse_changes(output: str) -> List[Dict[str, Any]]:
-    """Parse p4 changes output into structured data."""
-    records = parse_records(output, "change")
+def opened_entry(record: Dict[str, str]) -> OpenedFile:
+    return OpenedFile(
+        record.get("depotFile", ""),
+        record.get("user"),
+        record.get("client"),
+        record.get("host"),
+        record.get("action"),
+        record.get("change"),
+        record.get("type"),
+        "ourLock" in record,
+    )
+
+
+def info_metadata(info: Dict[str, str]) -> Dict[str, Optional[str]]:
+    """Report metadata fields taken from a ``p4 info`` record."""
+    return {
+        "server": info.get("serverAddress"),
+        "client": info.get("clientName"),
+        "user": info.get("userName"),
+        "host": info.get("clientHost"),
+    }
+
+
+def parse_changes(records: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+    """Convert p4 changes records into structured data."""
     parsed = []
     for record in records:
         desc = record.get("desc", "").replace("\r", "")
@@ -110,42 +553,362 @@ def parse_changes(output: str) -> List[Dict[str, Any]]:
     return parsed
 
 
-def section_with_limit(items: List[Any], limit: int) -> Dict[str, Any]:
-    """Create a section dictionary with pagination info."""
-    total = len(items)
-    visible = items[:limit]
+def p4_date(value: str) -> str:
+    """A revision specifier for ``value``: a change number as is, a date such
+    as 2025-09-01 or 2025/09/01 (optionally with :HH:MM:SS) in p4 form."""
+    value = value.strip()
+    if value.isdigit() or value == "now":
+        return value
+    date, _, clock = value.replace("T", ":", 1).partition(":")
+    parts = date.replace("-", "/").split("/")
+    if len(parts) != 3 or not all(part.isdigit() for part in parts):
+        raise ValueError(f"not a change number or YYYY/MM/DD date: {value!r}")
+    return "/".join(parts) + (f":{clock}" if clock else "")
+
+
+def ranged_pathspec(pathspec: str, since: Optional[str] = None, changes_range: Optional[str] = None) -> str:
+    """Append a ``@from,@to`` revision range so ``changes`` filters server-side.
+
+    ``since`` is a date or change number; ``changes_range`` is ``FROM,TO``
+    where either end may be a change number or a date and TO defaults to now.
+    """
+    if since and changes_range:
+        raise ValueError("use either since or changes_range, not both")
+    if since:
+        return f"{pathspec}@{p4_date(since)},@now"
+    if changes_range:
+        low, _, high = changes_range.partition(",")
+        return f"{pathspec}@{p4_date(low)},@{p4_date(high or 'now')}"
+    return pathspec
+
+
+def opened_filters(user: Optional[str] = None, client: Optional[str] = None) -> List[str]:
+    """``opened`` flags restricting the listing to one user and/or workspace."""
+    return [*(["-u", user] if user else []), *(["-C", client] if client else [])]
+
+
+def changes_filters(user: Optional[str] = None, client: Optional[str] = None) -> List[str]:
+    """``changes`` flags restricting the listing to one user and/or workspace."""
+    return [*(["-u", user] if user else []), *(["-c", client] if client else [])]
+
+
+class ReportCache:
+    """Raw changelist query results on disk, reused while the change counter holds.
+
+    Each entry keeps the rows of one ``changes`` query with the server's
+    ``change`` counter and the pathspec at the time it was fetched. The
+    counter is read once per report (``counter change``, on the first
+    lookup); an entry whose counter still matches is served without asking
+    the server. Only ``SECTIONS`` are cached: a submit or a new shelf moves
+    the counter, but editing or deleting a pending changelist does not.
+    Shelving into an existing changelist, or submitting the newest one,
+    does not move it either, so no entry is trusted for more than
+    ``max_age`` seconds.
+
+    The file is shared between concurrent runs. It is replaced atomically,
+    so readers never take a lock; writers hold ``<path>.lock`` while they
+    merge their entries into the current file.
+    """
+
+    SECTIONS = ("submitted", "shelved")
+    VERSION = 1
+
+    def __init__(self, path: str, max_age: float = DEFAULT_CACHE_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self.counter: Optional[int] = None
+        self.error: Optional[Any] = None
+        self.status: Dict[str, str] = {}
+        self._probed = False
+        self._lock = threading.Lock()
+        self._entries = self._load()
+        self._fresh: Dict[str, Dict[str, Any]] = {}
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.path, encoding="utf-8") as fh:
+                data = json.load(fh)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(data, dict) or data.get("version") != self.VERSION:
+            return {}
+        return data.get("entries", {})
+
+    def _probe(self, backend: P4Backend) -> None:
+        with self._lock:
+            if self._probed:
+                return
+            self._probed = True
+            try:
+                records = list(backend.stream(["counter", "change"]))
+                self.counter = int(records[0]["value"]) if records else None
+            except P4CommandError as exc:
+                self.error = exc.info
+            except (KeyError, ValueError):
+                self.error = "unreadable change counter"
+
+    def lookup(
+        self,
+        section: str,
+        backend: P4Backend,
+        request: List[Any],
+        pathspec: str,
+        fetch: Callable[[], Any],
+    ) -> Any:
+        """Return the cached result of ``request`` or call ``fetch`` and keep it.
+
+        Without a counter (the probe failed) every lookup is a miss and
+        nothing is stored.
+        """
+        self._probe(backend)
+        port = backend.port or os.environ.get("P4PORT", "")
+        key = json.dumps([port, *request])
+        entry = self._entries.get(key)
+        if (
+            entry is not None
+            and self.counter is not None
+            and entry.get("counter") == self.counter
+            and entry.get("pathspec") == pathspec
+            and time.time() - entry.get("stored_at", 0) < self.max_age
+        ):
+            self.status[section] = "hit"
+            return entry["result"]
+        result = fetch()
+        self.status[section] = "miss"
+        if self.counter is not None:
+            with self._lock:
+                self._fresh[key] = {
+                    "port": port,
+                    "counter": self.counter,
+                    "pathspec": pathspec,
+                    "stored_at": time.time(),
+                    "result": result,
+                }
+        return result
+
+    def save(self) -> None:
+        """Merge this run's misses into the file; entries for an older counter
+        of the same server are dropped, as they can never match again."""
+        if not self._fresh:
+            return
+        try:
+            with open(f"{self.path}.lock", "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                entries = self._load()
+                entries.update(self._fresh)
+                ports = {entry["port"] for entry in self._fresh.values()}
+                entries = {
+                    key: entry for key, entry in entries.items()
+                    if entry.get("port") not in ports or entry.get("counter") == self.counter
+                }
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as fh:
+                    json.dump({"version": self.VERSION, "entries": entries}, fh, separators=(",", ":"))
+                    fh.flush()
+                    os.fsync(fh.fileno())
+                os.replace(tmp_path, self.path)
+        except OSError as exc:
+            self.error = str(exc)
+        self._fresh = {}
+
+    def metadata(self) -> Dict[str, Any]:
+        """``metadata.cache``: the counter seen and hit or miss per section."""
+        result: Dict[str, Any] = {"counter": self.counter, "sections": dict(sorted(self.status.items()))}
+        if self.error is not None:
+            result["error"] = self.error
+        return result
+
+
+def fetch_changes_section(
+    backend: P4Backend,
+    status: str,
+    pathspec: str,
+    limit: int,
+    exact_totals: bool = False,
+    filters: Iterable[str] = (),
+    cache: Optional[ReportCache] = None,
+) -> Dict[str, Any]:
+    """Fetch one changes section, asking the server for only ``limit + 1`` rows.
+
+    The extra row tells us whether there is more. ``total`` is exact when
+    everything fits in ``limit``; past that it is None unless
+    ``exact_totals``, which streams the full list and counts it without
+    keeping it. ``filters`` are extra
+    ``changes`` flags (see ``changes_filters``). With a ``cache``, the rows
+    and count of its sections come from disk while the counter allows.
+    """
+    filters = list(filters)
+    args = ["changes", "-s", status, *filters, "-m", str(limit + 1), pathspec]
+
+    def fetch() -> Dict[str, Any]:
+        records = list(backend.stream(args))
+        count = None
+        if len(records) > limit and exact_totals:
+            count = backend.count(["changes", "-s", status, *filters, pathspec])
+        return {"records": records, "count": count}
+
+    if cache is not None and status in cache.SECTIONS:
+        raw = cache.lookup(status, backend, [*args, exact_totals], pathspec, fetch)
+    else:
+        raw = fetch()
+    records = raw["records"]
+    items = parse_changes(records[:limit])
+    has_more = len(records) > limit
+    total = raw["count"] if has_more else len(items)
     return {
         "total": total,
-        "items": visible,
-        "has_more": total > limit,
+        "items": items,
+        "has_more": has_more,
     }
 
 
-def file_is_locked(file: str, user: Optional[str], client: Optional[str]) -> bool:
-    """Check if a file is locked by checking p4 opened output."""
-    try:
-        result = subprocess.run(
-            ["p4", "opened", "-a", file], 
-            capture_output=True, 
-            text=True,
-            timeout=30
-        )
-        out = result.stdout
-        for line in out.splitlines():
-            if f"by {user}@{client}" in line and "*locked*" in line:
-                return True
-    except (subprocess.TimeoutExpired, subprocess.SubprocessError):
-        pass
-    return False
+class StaleCheckouts:
+    """Ages opens as they go past and aggregates those older than ``days``.
+
+    An open's age comes from its pending changelist's time or, for the
+    default changelist, from its workspace's last access. Both are looked up
+    in dicts built from one ``changes -s pending`` and one ``clients`` call.
+    Only the ``limit`` oldest opens are kept.
+    """
+
+    def __init__(
+        self,
+        days: float,
+        limit: int,
+        change_times: Dict[str, int],
+        access_times: Dict[str, int],
+        now: Optional[float] = None,
+    ):
+        self.days = days
+        self.limit = limit
+        self.change_times = change_times
+        self.access_times = access_times
+        self.now = time.time() if now is None else now
+        self.edges = [days * 2 ** i for i in range(4)]
+        self.by_age: "collections.Counter[str]" = collections.Counter()
+        self.by_user: Dict[str, Dict[str, Any]] = {}
+        self.by_client: Dict[str, Dict[str, Any]] = {}
+        self.total = 0
+        self.unknown = 0
+        self._oldest: List[Tuple[float, int, Dict[str, Any]]] = []
+
+    def _bucket(self, age: float) -> str:
+        for low, high in zip(self.edges, self.edges[1:]):
+            if age < high:
+                return f"{low:g}-{high:g}d"
+        return f"{self.edges[-1]:g}d+"
+
+    def add(self, entry: Dict[str, Any]) -> None:
+        if entry.get("change") in (None, "", "default"):
+            since, basis = self.access_times.get(entry.get("client") or ""), "client_access"
+        else:
+            since, basis = self.change_times.get(entry["change"]), "change"
+        if since is None:
+            self.unknown += 1
+            return
+        age = (self.now - since) / 86400
+        if age < self.days:
+            return
+        self.total += 1
+        self.by_age[self._bucket(age)] += 1
+        for groups, key in ((self.by_user, entry.get("user")), (self.by_client, entry.get("client"))):
+            group = groups.setdefault(key or "<none>", {"opens": 0, "oldest_days": 0.0})
+            group["opens"] += 1
+            group["oldest_days"] = max(group["oldest_days"], round(age, 1))
+        item = dict(entry, age_days=round(age, 1), basis=basis,
+                    since=_dt.datetime.fromtimestamp(since, tz=_dt.timezone.utc).isoformat())
+        heapq.heappush(self._oldest, (age, self.total, item))
+        if len(self._oldest) > self.limit:
+            heapq.heappop(self._oldest)
+
+    def result(self) -> Dict[str, Any]:
+        def busiest(groups: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+            return dict(sorted(groups.items(), key=lambda kv: (-kv[1]["opens"], kv[0])))
+
+        buckets = [self._bucket(edge) for edge in self.edges]
+        return {
+            "after_days": self.days,
+            "total": self.total,
+            "unknown_age": self.unknown,
+            "by_age": {bucket: self.by_age[bucket] for bucket in buckets},
+            "by_user": busiest(self.by_user),
+            "by_client": busiest(self.by_client),
+            "items": [item for _, _, item in sorted(self._oldest, reverse=True)],
+        }
 
 
-def generate_status_report(pathspec: str, limit: int) -> Dict[str, Any]:
-    """Generate the complete status report."""
+def stale_lookups(
+    backend: P4Backend,
+    pathspec: str,
+    user: Optional[str] = None,
+    client: Optional[str] = None,
+) -> Dict[str, Callable[[], Dict[str, int]]]:
+    """Tasks building the change -> time and client -> access time dicts,
+    restricted to ``user``'s changes and ``client``'s workspace when given."""
+    return {
+        "stale_changes": lambda: {
+            record["change"]: int(record.get("time") or 0)
+            for record in backend.stream(["changes", "-s", "pending", *changes_filters(user, client), pathspec])
+        },
+        "stale_clients": lambda: {
+            record["client"]: int(record.get("Access") or 0)
+            for record in backend.stream(["clients", *(["-e", client] if client else [])])
+        },
+    }
+
+
+def filter_metadata(
+    user: Optional[str] = None,
+    client: Optional[str] = None,
+    since: Optional[str] = None,
+    changes_range: Optional[str] = None,
+) -> Dict[str, Dict[str, str]]:
+    """``{"filters": {...}}`` for report metadata, or nothing when unfiltered."""
+    filters = {"user": user, "client": client, "since": since, "changes_range": changes_range}
+    filters = {key: value for key, value in filters.items() if value}
+    return {"filters": filters} if filters else {}
+
+
+def generate_status_report(
+    pathspec: str,
+    limit: int,
+    backend: Optional[P4Backend] = None,
+    jobs: int = DEFAULT_JOBS,
+    exact_totals: bool = False,
+    sections: Optional[Iterable[str]] = None,
+    stale_after: Optional[float] = None,
+    user: Optional[str] = None,
+    client: Optional[str] = None,
+    since: Optional[str] = None,
+    changes_range: Optional[str] = None,
+    cache: Optional[ReportCache] = None,
+) -> Dict[str, Any]:
+    """Generate the complete status report.
+
+    The section queries are independent, so they run concurrently and the
+    report takes about as long as the slowest one. ``sections`` limits the
+    queries to a subset of info, opened, pending, submitted and shelved;
+    the others keep their empty defaults. With ``stale_after`` the report
+    gains a ``stale_checkouts`` section of opens older than that many days.
+
+    ``user`` and ``client`` become ``-u``/``-C`` (opened) and ``-u``/``-c``
+    (changes) flags, and ``since`` or ``changes_range`` a ``@from,@to``
+    range on the changes pathspec, so the server only returns matching rows.
+
+    With a ``cache`` the submitted and shelved sections are reused while
+    the change counter has not moved, and ``metadata.cache`` says which
+    were hits.
+    """
+    if backend is None:
+        backend = ZtagBackend()
+    changes_pathspec = ranged_pathspec(pathspec, since, changes_range)
     data = {
         "metadata": {
             "path": pathspec,
             "limit": limit,
+            "exact_totals": exact_totals,
             "generated_at": _dt.datetime.now(tz=_dt.timezone.utc).isoformat(),
+            **filter_metadata(user, client, since, changes_range),
         },
         "opened_files": [],
         "opened_conflicts": [],
@@ -167,83 +930,545 @@ def generate_status_report(pathspec: str, limit: int) -> Dict[str, Any]:
         "errors": {},
     }
 
+    def changes(status: str) -> Callable[[], Dict[str, Any]]:
+        return lambda: fetch_changes_section(
+            backend, status, changes_pathspec, limit, exact_totals, changes_filters(user, client), cache,
+        )
+
+    tasks = {
+        "info": lambda: list(backend.stream(["info"])),
+        "opened": lambda: parse_opened(backend.stream(["opened", "-a", *opened_filters(user, client), pathspec])),
+        "pending": changes("pending"),
+        "submitted": changes("submitted"),
+        "shelved": changes("shelved"),
+    }
+    if sections is not None:
+        tasks = {name: task for name, task in tasks.items() if name in sections}
+    if stale_after is not None:
+        tasks.update(stale_lookups(backend, pathspec, user, client))
+    results = run_concurrently(tasks, jobs=jobs)
+
     # Get server info
-    info_out, info_err = run_p4(["info"])
-    if info_err:
-        data["errors"]["info"] = info_err
-    else:
-        info = parse_info(info_out)
-        data["metadata"].update({
-            "server": info.get("serverAddress"),
-            "client": info.get("clientName"),
-            "user": info.get("userName"),
-            "host": info.get("clientHost"),
-        })
+    if "info" in results:
+        info_records, info_err = results["info"]
+        if info_err:
+            data["errors"]["info"] = info_err
+        else:
+            data["metadata"].update(info_metadata(info_records[0] if info_records else {}))
 
     # Get opened files
-    opened_out, opened_err = run_p4(["opened", "-a", pathspec])
-    if opened_err:
-        data["errors"]["opened"] = opened_err
-    else:
-        opened_entries = []
-        base_entries = parse_opened(opened_out)
-        for entry in base_entries:
-            locked = file_is_locked(entry["file"], entry.get("user"), entry.get("client"))
-            entry["locked"] = locked
-            opened_entries.append(entry)
-        data["opened_files"] = opened_entries
-
-        # Find conflicts (files opened by multiple clients)
-        grouped = collections.defaultdict(list)
-        for entry in opened_entries:
-            grouped[entry.get("file")].append(entry)
-        conflicts = []
-        for file_path, entries in grouped.items():
-            if file_path and len(entries) > 1:
-                conflicts.append({
-                    "file": file_path,
-                    "entries": entries,
-                })
-        data["opened_conflicts"] = conflicts
+    if "opened" in results:
+        opened_entries, opened_err = results["opened"]
+        if opened_err:
+            data["errors"]["opened"] = opened_err
+        else:
+            data["opened_files"] = opened_entries
 
-    # Get pending changes
-    pending_out, pending_err = run_p4(["changes", "-s", "pending", pathspec])
-    if pending_err:
-        data["errors"]["pending"] = pending_err
-    else:
-        pending = parse_changes(pending_out)
-        data["pending_changes"] = section_with_limit(pending, limit)
-
-    # Get submitted changes
-    submitted_out, submitted_err = run_p4([
-        "changes",
-        "-s",
-        "submitted",
-        "-m",
-        str(limit),
-        pathspec,
-    ])
-    if submitted_err:
-        data["errors"]["submitted"] = submitted_err
-    else:
-        submitted = parse_changes(submitted_out)
-        data["submitted_changes"] = {
-            "total": len(submitted),
-            "items": submitted,
-            "has_more": len(submitted) == limit,
-        }
+            # Find conflicts (files opened by multiple clients)
+            grouped = collections.defaultdict(list)
+            for entry in opened_entries:
+                grouped[entry.get("file")].append(entry)
+            conflicts = []
+            for file_path, entries in grouped.items():
+                if file_path and len(entries) > 1:
+                    conflicts.append({
+                        "file": file_path,
+                        "entries": entries,
+                    })
+            data["opened_conflicts"] = conflicts
 
-    # Get shelved changes
-    shelved_out, shelved_err = run_p4(["changes", "-s", "shelved", pathspec])
-    if shelved_err:
-        data["errors"]["shelved"] = shelved_err
-    else:
-        shelved = parse_changes(shelved_out)
-        data["shelved_changes"] = section_with_limit(shelved, limit)
+    # Get pending, submitted and shelved changes
+    for status in ("pending", "submitted", "shelved"):
+        if status in results:
+            section, err = results[status]
+            if err:
+                data["errors"][status] = err
+            else:
+                data[f"{status}_changes"] = section
 
+    if stale_after is not None:
+        (change_times, changes_err), (access_times, clients_err) = results["stale_changes"], results["stale_clients"]
+        if changes_err or clients_err:
+            data["errors"]["stale"] = changes_err or clients_err
+        elif "opened" not in data["errors"]:
+            stale = StaleCheckouts(stale_after, limit, change_times, access_times)
+            for entry in data["opened_files"]:
+                stale.add(entry)
+            data["stale_checkouts"] = stale.result()
+
+    if cache is not None:
+        cache.save()
+        data["metadata"]["cache"] = cache.metadata()
     return data
 
 
+def load_targets(path: str) -> List[Dict[str, Any]]:
+    """Read a --targets file: a JSON list of objects with ``port`` and ``path``
+    and optionally ``name``, ``user``, ``ticket_file``, ``timeout``,
+    ``backend`` and ``jobs``."""
+    with open(path, encoding="utf-8") as fh:
+        targets = json.load(fh)
+    for target in targets:
+        target.setdefault("name", f"{target['port']} {target['path']}")
+        ticket_file = target.get("ticket_file")
+        if ticket_file:
+            with open(ticket_file, encoding="utf-8") as fh:
+                target["ticket"] = fh.read().strip()
+    return targets
+
+
+def changes_key(item: Dict[str, Any]) -> Tuple[Any, ...]:
+    return item.get("change"), item.get("user"), item.get("client"), item.get("time_epoch")
+
+
+def opened_key(entry: Dict[str, Any]) -> Tuple[Any, ...]:
+    return entry.get("file"), entry.get("client"), entry.get("user"), entry.get("action"), entry.get("change")
+
+
+def merge_reports(reports: Dict[str, Dict[str, Any]], limit: int) -> Dict[str, Any]:
+    """Merge per-target reports into one.
+
+    Every opened file and changelist gains a ``targets`` list. An entry
+    reported identically by several targets (a replica and its master, or
+    overlapping paths) is kept once and counted under
+    ``metadata.duplicates``. Conflicts are recomputed over the merged opens:
+    a file opened by more than one (client, user) is a conflict, marked
+    ``cross_target`` only when no single target sees it, i.e. each target
+    reports opens by one workspace and they differ across targets.
+    """
+    merged: Dict[str, Any] = {
+        "metadata": {
+            "path": ", ".join(report["metadata"]["path"] for report in reports.values()),
+            "server": ", ".join(str(report["metadata"].get("server")) for report in reports.values()),
+            "limit": limit,
+            "generated_at": _dt.datetime.now(tz=_dt.timezone.utc).isoformat(),
+            "targets": {name: report["metadata"] for name, report in reports.items()},
+            "duplicates": {"opened": 0, "changes": 0},
+        },
+        "opened_files": [],
+        "opened_conflicts": [],
+        "errors": {name: report["errors"] for name, report in reports.items() if report["errors"]},
+    }
+    duplicates = merged["metadata"]["duplicates"]
+
+    opened: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
+    for name, report in reports.items():
+        for entry in report["opened_files"]:
+            key = opened_key(entry)
+            if key in opened:
+                opened[key]["targets"].append(name)
+                duplicates["opened"] += 1
+            else:
+                opened[key] = dict(entry, targets=[name])
+    merged["opened_files"] = list(opened.values())
+    grouped = collections.defaultdict(list)
+    for entry in merged["opened_files"]:
+        grouped[entry["file"]].append(entry)
+    for file_path, entries in grouped.items():
+        if not file_path or len(entries) < 2:
+            continue
+        workspaces = collections.defaultdict(set)
+        for entry in entries:
+            for name in entry["targets"]:
+                workspaces[name].add((entry.get("client"), entry.get("user")))
+        if len(set().union(*workspaces.values())) < 2:
+            # One open that the targets disagree about (a lagging replica), not a conflict.
+            continue
+        merged["opened_conflicts"].append({
+            "file": file_path,
+            "entries": entries,
+            "cross_target": all(len(seen) < 2 for seen in workspaces.values()),
+        })
+
+    for status in ("pending", "submitted", "shelved"):
+        section = f"{status}_changes"
+        items: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
+        total: Optional[int] = 0
+        has_more = False
+        for name, report in reports.items():
+            if total is not None and report[section]["total"] is not None:
+                total += report[section]["total"]
+            else:
+                total = None
+            has_more = has_more or report[section]["has_more"]
+            for item in report[section]["items"]:
+                key = changes_key(item)
+                if key in items:
+                    items[key]["targets"].append(name)
+                    duplicates["changes"] += 1
+                    if total is not None:
+                        total -= 1
+                else:
+                    items[key] = dict(item, targets=[name])
+        ordered = sorted(items.values(), key=lambda item: (item.get("time_epoch") or 0, int(item.get("change") or 0)), reverse=True)
+        merged[section] = {
+            "total": total,
+            "items": ordered[:limit],
+            "has_more": has_more or len(ordered) > limit,
+        }
+    return merged
+
+
+def generate_multi_report(
+    targets: List[Dict[str, Any]],
+    limit: int,
+    backend_name: str = "ztag",
+    timeout: Optional[float] = None,
+    jobs: int = DEFAULT_JOBS,
+    exact_totals: bool = False,
+    filters: Optional[Dict[str, Optional[str]]] = None,
+) -> Dict[str, Any]:
+    """Report on several (server, path) targets at once and merge the results.
+
+    Targets are queried concurrently, each with its own backend, credentials
+    and timeout, so the report takes as long as the slowest target. A target
+    that cannot be queried at all is reported under ``errors``. ``filters``
+    holds the user, client, since and changes_range arguments of
+    ``generate_status_report`` and applies to every target.
+    """
+    def one(target: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            backend = BACKENDS[target.get("backend", backend_name)](
+                timeout=target.get("timeout", timeout),
+                port=target["port"],
+                user=target.get("user"),
+                ticket=target.get("ticket"),
+            )
+        except Exception as exc:
+            return {
+                "metadata": {"path": target["path"], "limit": limit, "port": target["port"]},
+                "opened_files": [],
+                "opened_conflicts": [],
+                **{f"{status}_changes": empty_changes_section() for status in ("pending", "submitted", "shelved")},
+                "errors": {"python": str(exc)},
+            }
+        try:
+            report = generate_status_report(
+                target["path"], limit, backend=backend, jobs=target.get("jobs", jobs), exact_totals=exact_totals,
+                **(filters or {}),
+            )
+        finally:
+            backend.close()
+        report["metadata"]["port"] = target["port"]
+        return report
+
+    with ThreadPoolExecutor(max_workers=max(1, len(targets))) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, one, target) for target in targets]
+        reports = dict(zip((target["name"] for target in targets), (future.result() for future in futures)))
+    merged = merge_reports(reports, limit)
+    merged["metadata"].update(filter_metadata(**(filters or {})))
+    return merged
+
+
+def empty_changes_section() -> Dict[str, Any]:
+    return {"total": 0, "items": [], "has_more": False}
+
+
+class NDJSONWriter:
+    """One compact JSON object per line, tagged with its report section:
+    metadata, then one line per opened file and per conflict, one line per
+    changes section, and errors last."""
+
+    def __init__(self, out):
+        self.out = out
+
+    def _line(self, section: str, value: Dict[str, Any]) -> None:
+        self.out.write(json.dumps({"section": section, **value}, separators=(",", ":"), default=record_json) + "\n")
+
+    def begin(self, metadata: Dict[str, Any]) -> None:
+        self._line("metadata", metadata)
+
+    def opened(self, entry: Dict[str, Any]) -> None:
+        self._line("opened_files", entry)
+
+    def conflict(self, conflict: Dict[str, Any]) -> None:
+        self._line("opened_conflicts", conflict)
+
+    def section(self, name: str, value: Dict[str, Any]) -> None:
+        self._line(name, value)
+
+    def end(self, errors: Dict[str, Any]) -> None:
+        self._line("errors", errors)
+
+
+class CompactJSONWriter:
+    """The ``--format json`` document without indentation, written as it is
+    produced. Conflicts are spooled to a temporary file until the
+    opened_files array is closed."""
+
+    def __init__(self, out):
+        self.out = out
+        self._opened = 0
+        self._conflicts: Optional[IO[str]] = tempfile.TemporaryFile("w+", encoding="utf-8")
+        self._conflict_count = 0
+
+    def _dump(self, value: Any) -> None:
+        self.out.write(json.dumps(value, separators=(",", ":"), default=record_json))
+
+    def begin(self, metadata: Dict[str, Any]) -> None:
+        self.out.write('{"metadata":')
+        self._dump(metadata)
+        self.out.write(',"opened_files":[')
+
+    def opened(self, entry: Dict[str, Any]) -> None:
+        if self._opened:
+            self.out.write(",")
+        self._opened += 1
+        self._dump(entry)
+
+    def conflict(self, conflict: Dict[str, Any]) -> None:
+        if self._conflict_count:
+            self._conflicts.write(",")
+        self._conflict_count += 1
+        self._conflicts.write(json.dumps(conflict, separators=(",", ":"), default=record_json))
+
+    def _close_opened(self) -> None:
+        if self._conflicts is None:
+            return
+        self.out.write('],"opened_conflicts":[')
+        self._conflicts.seek(0)
+        shutil.copyfileobj(self._conflicts, self.out)
+        self._conflicts.close()
+        self._conflicts = None
+        self.out.write("]")
+
+    def section(self, name: str, value: Dict[str, Any]) -> None:
+        self._close_opened()
+        self.out.write(f",{json.dumps(name)}:")
+        self._dump(value)
+
+    def end(self, errors: Dict[str, Any]) -> None:
+        self._close_opened()
+        self.out.write(',"errors":')
+        self._dump(errors)
+        self.out.write("}\n")
+
+
+def write_report(data: Dict[str, Any], writer) -> None:
+    """Send an already built report through a streaming writer."""
+    writer.begin(data["metadata"])
+    for entry in data["opened_files"]:
+        writer.opened(entry)
+    for conflict in data["opened_conflicts"]:
+        writer.conflict(conflict)
+    for status in ("pending", "submitted", "shelved"):
+        writer.section(f"{status}_changes", data[f"{status}_changes"])
+    if "stale_checkouts" in data:
+        writer.section("stale_checkouts", data["stale_checkouts"])
+    writer.end(data["errors"])
+
+
+def stream_report(
+    pathspec: str,
+    limit: int,
+    backend: P4Backend,
+    writer,
+    jobs: int = DEFAULT_JOBS,
+    exact_totals: bool = False,
+    stale_after: Optional[float] = None,
+    user: Optional[str] = None,
+    client: Optional[str] = None,
+    since: Optional[str] = None,
+    changes_range: Optional[str] = None,
+) -> None:
+    """Write the report through ``writer`` while ``opened -a`` is still running.
+
+    The changelist sections run in the background; opened files are written
+    one at a time, so memory does not grow with the number of opens.
+    ``opened -a`` lists files in depot order, so the opens of one file are
+    adjacent and conflicts are found without keeping earlier files. If the
+    opened query fails partway, the entries already written stay and the
+    error is reported under ``errors``. Filters are pushed to the server as
+    in ``generate_status_report``.
+    """
+    metadata: Dict[str, Any] = {
+        "path": pathspec,
+        "limit": limit,
+        "exact_totals": exact_totals,
+        "generated_at": _dt.datetime.now(tz=_dt.timezone.utc).isoformat(),
+        **filter_metadata(user, client, since, changes_range),
+    }
+    changes_pathspec = ranged_pathspec(pathspec, since, changes_range)
+    errors: Dict[str, Any] = {}
+    statuses = ("pending", "submitted", "shelved")
+    stale = None
+    with ThreadPoolExecutor(max_workers=2) as side:
+        changes = side.submit(contextvars.copy_context().run, run_concurrently, {
+            status: (lambda status=status: fetch_changes_section(
+                backend, status, changes_pathspec, limit, exact_totals, changes_filters(user, client),
+            ))
+            for status in statuses
+        }, max(1, jobs - 1))
+        if stale_after is not None:
+            lookups = side.submit(
+                contextvars.copy_context().run, run_concurrently, stale_lookups(backend, pathspec, user, client), 2,
+            )
+        try:
+            metadata.update(info_metadata(next(iter(backend.stream(["info"])), {})))
+        except P4CommandError as exc:
+            errors["info"] = exc.info
+        writer.begin(metadata)
+
+        if stale_after is not None:
+            (change_times, changes_err), (access_times, clients_err) = lookups.result().values()
+            if changes_err or clients_err:
+                errors["stale"] = changes_err or clients_err
+            else:
+                stale = StaleCheckouts(stale_after, limit, change_times, access_times)
+
+        try:
+            entries = (
+                opened_entry(record)
+                for record in backend.stream(["opened", "-a", *opened_filters(user, client), pathspec])
+            )
+            for file_path, group in itertools.groupby(entries, key=lambda entry: entry["file"]):
+                group = list(group)
+                for entry in group:
+                    writer.opened(entry)
+                    if stale:
+                        stale.add(entry)
+                if file_path and len(group) > 1:
+                    writer.conflict({"file": file_path, "entries": group})
+        except P4CommandError as exc:
+            errors["opened"] = exc.info
+
+        for status, (section, err) in changes.result().items():
+            if err:
+                errors[status] = err
+                section = empty_changes_section()
+            writer.section(f"{status}_changes", section)
+    if stale and "opened" not in errors:
+        writer.section("stale_checkouts", stale.result())
+    writer.end(errors)
+
+
+WATCH_SECTIONS = {
+    "opened": ("opened_files", "opened_conflicts"),
+    "pending": ("pending_changes",),
+    "submitted": ("submitted_changes",),
+    "shelved": ("shelved_changes",),
+}
+# Sections --watch refetches only when the change counter moves (or they age out).
+# Not pending: editing or deleting a pending changelist leaves the counter alone.
+WATCH_COUNTER_SECTIONS = ("shelved",)
+# Default --watch-max-age, in polls.
+WATCH_MAX_AGE_POLLS = 3
+
+
+def newest_submitted(backend: P4Backend, pathspec: str, filters: Iterable[str] = ()) -> Optional[str]:
+    """Return the newest submitted change under ``pathspec`` (one-row query)."""
+    records = list(backend.stream(["changes", "-s", "submitted", *filters, "-m", "1", pathspec]))
+    return records[0].get("change") if records else None
+
+
+def change_counter(backend: P4Backend) -> Optional[int]:
+    """The server's ``change`` counter, or None if it cannot be read."""
+    try:
+        records = list(backend.stream(["counter", "change"]))
+        return int(records[0]["value"]) if records else None
+    except (P4CommandError, KeyError, ValueError):
+        return None
+
+
+def snapshot(data: Dict[str, Any]) -> Dict[str, Dict[Any, Any]]:
+    """Key each report section for diffing: opened files by (file, client),
+    conflicts by file, changelists by change number, errors by query."""
+    keyed = {
+        "opened_files": {(e["file"], e["client"]): e for e in data["opened_files"]},
+        "opened_conflicts": {c["file"]: c for c in data["opened_conflicts"]},
+        "errors": dict(data["errors"]),
+    }
+    for status in ("pending", "submitted", "shelved"):
+        section = f"{status}_changes"
+        keyed[section] = {c["change"]: c for c in data[section]["items"]}
+    return keyed
+
+
+def diff_snapshots(
+    old: Dict[str, Dict[Any, Any]],
+    new: Dict[str, Dict[Any, Any]],
+) -> Iterator[Dict[str, Any]]:
+    """Yield added, removed and changed entries between two snapshots."""
+    for section, items in new.items():
+        before = old.get(section, {})
+        for key, item in items.items():
+            if key not in before:
+                yield {"section": section, "op": "added", "key": key, "item": item}
+            elif before[key] != item:
+                yield {"section": section, "op": "changed", "key": key, "item": item}
+        for key, item in before.items():
+            if key not in items:
+                yield {"section": section, "op": "removed", "key": key, "item": item}
+
+
+def watch(
+    pathspec: str,
+    limit: int,
+    backend: P4Backend,
+    interval: float,
+    jobs: int = DEFAULT_JOBS,
+    out=sys.stdout,
+    filters: Optional[Dict[str, Optional[str]]] = None,
+    max_age: Optional[float] = None,
+) -> None:
+    """Poll the server every ``interval`` seconds and write one JSON line per
+    changed entry. The first poll reports everything as added.
+
+    The submitted section is refetched only when the newest submitted change
+    under the path moves. The shelved section is refetched when the change
+    counter moves (new shelves) and at least every ``max_age`` seconds
+    (default ``WATCH_MAX_AGE_POLLS`` intervals) for what the counter misses:
+    shelving into an existing change or deleting a shelf. Pending changes
+    and opened files have no cheap probe and are fetched every poll, as
+    edits and deletes of pending changes do not move the counter (see
+    ``ReportCache``). A section whose query fails keeps its
+    previous entries, so a transient error does not show up as mass
+    removals. ``filters`` holds the user, client, since and changes_range
+    arguments of ``generate_status_report``.
+    """
+    filters = filters or {}
+    if max_age is None:
+        max_age = WATCH_MAX_AGE_POLLS * interval
+    probe_pathspec = ranged_pathspec(pathspec, filters.get("since"), filters.get("changes_range"))
+    probe_filters = changes_filters(filters.get("user"), filters.get("client"))
+    previous: Dict[str, Dict[Any, Any]] = {}
+    newest = None
+    # Counter and time of the last good fetch of each counter-gated section.
+    fetched: Dict[str, Tuple[int, float]] = {}
+    while True:
+        sections = set(WATCH_SECTIONS)
+        try:
+            probe = newest_submitted(backend, probe_pathspec, probe_filters)
+        except P4CommandError:
+            probe = None
+        if previous and probe is not None and probe == newest:
+            sections.discard("submitted")
+        counter = change_counter(backend)
+        for name in WATCH_COUNTER_SECTIONS:
+            seen = fetched.get(name)
+            if previous and counter is not None and seen and seen[0] == counter and time.monotonic() - seen[1] < max_age:
+                sections.discard(name)
+        data = generate_status_report(pathspec, limit, backend=backend, jobs=jobs, sections=sections, **filters)
+        current = snapshot(data)
+        for name, keys in WATCH_SECTIONS.items():
+            if name not in sections or name in data["errors"]:
+                for key in keys:
+                    current[key] = previous.get(key, {})
+        if "submitted" in sections and "submitted" not in data["errors"]:
+            newest = probe
+        for name in WATCH_COUNTER_SECTIONS:
+            if name in sections and name not in data["errors"] and counter is not None:
+                fetched[name] = (counter, time.monotonic())
+
+        ts = _dt.datetime.now(tz=_dt.timezone.utc).isoformat()
+        for event in diff_snapshots(previous, current):
+            json.dump({"ts": ts, **event}, out, default=record_json)
+            out.write("\n")
+        out.flush()
+        previous = current
+        time.sleep(interval)
+
+
 def print_text_report(data: Dict[str, Any], limit: int) -> None:
     """Render the JSON-style report as human-readable text similar to the shell script output."""
     md = data.get("metadata", {})
@@ -329,12 +1554,42 @@ def print_text_report(data: Dict[str, Any], limit: int) -> None:
             print(f"{it.get('change',''):<8} {it.get('user',''):<16} {it.get('client',''):<20} {it.get('time_iso',''):<20} {it.get('description','')}")
 
     print("-" * 80)
+    stale = data.get("stale_checkouts")
+    if stale is not None:
+        print(f"STALE CHECKOUTS (open {stale['after_days']:g}+ days): {stale['total']}")
+        print("  " + "  ".join(f"{bucket}: {count}" for bucket, count in stale["by_age"].items()))
+        for u, group in list(stale["by_user"].items())[:limit]:
+            print(f"  {u:<16} {group['opens']:>6} opens, oldest {group['oldest_days']:g}d")
+        for it in stale["items"]:
+            print(f"  {it['age_days']:>7g}d {it.get('user') or '':<16} {shorten_middle(it.get('client') or '', 20):<20} {it.get('file')}")
+        print("-" * 80)
     if data.get("errors"):
         print("Errors:")
         for k, v in data.get("errors", {}).items():
             print(f"  {k}: {v}")
 
 
+def print_search_results(data: Dict[str, Any], output_format: str) -> None:
+    """Write a p4index.search_report() result as JSON, NDJSON or text."""
+    if output_format == "ndjson":
+        writer = NDJSONWriter(sys.stdout)
+        writer.begin(data["metadata"])
+        for item in data["results"]:
+            writer.section("results", item)
+        writer.end(data["errors"])
+    elif output_format == "json":
+        json.dump(data, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        print(f"SUBMITTED CHANGES MATCHING {data['metadata']['query']!r}")
+        if not data["results"]:
+            print("  (none)")
+        for it in data["results"]:
+            print(f"{it.get('change',''):<8} {it.get('user',''):<16} {it.get('time_iso',''):<26} {it.get('description','')}")
+        for k, v in data["errors"].items():
+            print(f"  {k}: {v}")
+
+
 def main():
     """Main entry point."""
     parser = argparse.ArgumentParser(description="Generate JSON status report for Perforce depot")
@@ -342,29 +1597,161 @@ def main():
                        help="Perforce path specification (default: //...)")
     parser.add_argument("--limit", type=int, default=20,
                        help="Limit number of results (default: 20)")
-    parser.add_argument("--format", choices=["json", "text"], default="json",
-                        help="Output format: json (default) or text")
+    parser.add_argument("--format", choices=["json", "text", "ndjson"], default="json",
+                        help="Output format: json (default), text, or ndjson (one record per line, streamed)")
+    parser.add_argument("--compact", action="store_true",
+                        help="With --format json, stream compact JSON as records arrive instead of indenting")
+    parser.add_argument("--jobs", type=int, default=DEFAULT_JOBS,
+                        help=f"Maximum concurrent p4 commands (default: {DEFAULT_JOBS})")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="Kill any single p4 command after this many seconds")
+    parser.add_argument("--deadline", type=float, metavar="SECONDS",
+                        help="Give all p4 commands of the report this many seconds in total; "
+                             "sections still running then are reported under errors")
+    parser.add_argument("--exact-totals", action="store_true",
+                        help="Count every matching changelist for section totals (streams the full list)")
+    parser.add_argument("--index", metavar="DB",
+                        help="Read the report from a p4index.py SQLite index instead of the server")
+    parser.add_argument("--search", metavar="TERMS",
+                        help="With --index, list the --limit submitted changelists that best match TERMS "
+                             "(needs an index kept with p4index.py --search)")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default=ZtagBackend.name,
+                        help="How to talk to Perforce: ztag (default), marshal (p4 -G) or p4python")
+    parser.add_argument("--targets", metavar="FILE",
+                        help="JSON list of {port, path, [name, user, ticket_file, timeout, backend, jobs]} to "
+                             "query concurrently into one merged report (the pathspec argument is ignored)")
+    parser.add_argument("--stale-after", type=float, metavar="DAYS",
+                        help="Add a stale_checkouts section: opens older than DAYS, bucketed by age, user and client")
+    parser.add_argument("--user", help="Only this user's opened files and changelists (p4 -u)")
+    parser.add_argument("--client", help="Only this workspace's opened files and changelists (p4 -C/-c)")
+    parser.add_argument("--since", metavar="DATE",
+                        help="Only changelists from DATE (YYYY/MM/DD or a change number) to now")
+    parser.add_argument("--changes-range", metavar="FROM,TO",
+                        help="Only changelists in this range of change numbers or dates; TO defaults to now")
+    parser.add_argument("--cache", metavar="FILE",
+                        help="Reuse the submitted and shelved sections from FILE while the change counter is unchanged")
+    parser.add_argument("--cache-max-age", type=float, default=DEFAULT_CACHE_MAX_AGE, metavar="SECONDS",
+                        help=f"Refetch cached sections older than this even if the counter is unchanged "
+                             f"(default: {DEFAULT_CACHE_MAX_AGE})")
+    parser.add_argument("--history", metavar="DB",
+                        help="Also record the report in a p4history.py trend database")
+    parser.add_argument("--profile", action="store_true",
+                        help="Add per-call timings (spawn, server wait, parse), bytes and records to metadata.profile")
+    parser.add_argument("--watch", type=float, metavar="INTERVAL",
+                        help="Keep running and print changed entries as JSON lines every INTERVAL seconds")
+    parser.add_argument("--watch-max-age", type=float, metavar="SECONDS",
+                        help="With --watch, refetch shelved changes at least this often even if the change counter "
+                             f"is unchanged (default: {WATCH_MAX_AGE_POLLS} x INTERVAL)")
     
     args = parser.parse_args()
+    streaming = args.format == "ndjson" or (args.format == "json" and args.compact)
+    if streaming and args.profile:
+        parser.error("--profile needs the indented json or text format")
+    if args.targets and (streaming or args.index or args.watch or args.stale_after is not None):
+        parser.error("--targets works with the indented json or text format only")
+    if args.since and args.changes_range:
+        parser.error("use either --since or --changes-range")
+    if args.index and (args.since or args.changes_range):
+        parser.error("--since and --changes-range are applied by the server, not --index")
+    filters = {"user": args.user, "client": args.client, "since": args.since, "changes_range": args.changes_range}
+    try:
+        ranged_pathspec("//...", args.since, args.changes_range)
+    except ValueError as exc:
+        parser.error(str(exc))
+    if args.history and (streaming or args.watch or args.search):
+        parser.error("--history records a whole report; use the indented json or text format")
+    if args.history and any(filters.values()):
+        parser.error("--history records unfiltered reports; drop --user, --client, --since and --changes-range")
+    if args.cache and (streaming or args.watch or args.index or args.targets):
+        parser.error("--cache works with a single server report in the indented json or text format")
+    if args.deadline is not None and args.watch:
+        parser.error("--deadline bounds one report; use --timeout with --watch")
+    if args.search and not args.index:
+        parser.error("--search reads the p4index.py index; pass --index DB")
+    if args.index and args.stale_after is not None:
+        parser.error("--stale-after needs the server's changelist and client times, not --index")
     
     # Ensure pathspec ends with ...
     pathspec = args.pathspec
     if not pathspec.endswith("..."):
         pathspec = f"{pathspec.rstrip('/')}/..."
     
-    # Check if p4 is available (existence). If p4 runs but returns non-zero due to
-    # authentication, continue; that will be captured per-command later.
-    try:
-        subprocess.run(["p4", "info"], capture_output=True, check=False)
-    except FileNotFoundError:
+    # Check if p4 is available (existence). Authentication problems are
+    # captured per-command later.
+    if args.index is None and args.backend != P4PythonBackend.name and shutil.which("p4") is None:
         json.dump({"errors": {"python": "p4 not found or not accessible"}}, sys.stdout, indent=2)
         sys.stdout.write("\n")
         sys.exit(1)
     
+    writer = None
+    if streaming:
+        writer = NDJSONWriter(sys.stdout) if args.format == "ndjson" else CompactJSONWriter(sys.stdout)
     try:
-        data = generate_status_report(pathspec, args.limit)
+        if args.targets:
+            with p4guard.deadline(args.deadline):
+                data = generate_multi_report(
+                    load_targets(args.targets), args.limit, backend_name=args.backend, timeout=args.timeout,
+                    jobs=args.jobs, exact_totals=args.exact_totals, filters=filters,
+                )
+        elif args.index:
+            import p4index
+
+            db = p4index.connect(args.index)
+            try:
+                if args.search:
+                    print_search_results(p4index.search_report(db, args.search, args.limit), args.format)
+                    return
+                data = p4index.read_report(db, pathspec, args.limit, user=args.user, client=args.client)
+            finally:
+                db.close()
+            if writer:
+                write_report(data, writer)
+                return
+        else:
+            backend = BACKENDS[args.backend](timeout=args.timeout)
+            try:
+                if args.watch:
+                    try:
+                        watch(pathspec, args.limit, backend, args.watch, jobs=args.jobs, filters=filters,
+                              max_age=args.watch_max_age)
+                    except KeyboardInterrupt:
+                        pass
+                    return
+                if writer:
+                    with p4guard.deadline(args.deadline):
+                        stream_report(
+                            pathspec, args.limit, backend, writer, jobs=args.jobs, exact_totals=args.exact_totals,
+                            stale_after=args.stale_after, **filters,
+                        )
+                    return
+                cache = ReportCache(args.cache, args.cache_max_age) if args.cache else None
+                started = time.perf_counter()
+                with p4guard.deadline(args.deadline):
+                    data = generate_status_report(
+                        pathspec, args.limit, backend=backend, jobs=args.jobs, exact_totals=args.exact_totals,
+                        stale_after=args.stale_after, cache=cache, **filters,
+                    )
+                if args.profile:
+                    summary = p4metrics.METRICS.summary()
+                    data["metadata"]["profile"] = {
+                        "wall_s": round(time.perf_counter() - started, 6),
+                        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                        "parse": summary.get("parse", {}),
+                        "calls": [call for call in p4metrics.METRICS.recent if call["kind"] == "p4"],
+                        "totals": summary.get("p4", {}),
+                    }
+            finally:
+                backend.close()
+        if args.history:
+            import p4history
+
+            db = p4history.connect(args.history)
+            try:
+                p4history.record(db, data)
+            finally:
+                db.close()
         if args.format == "json":
-            json.dump(data, sys.stdout, indent=2)
+            json.dump(data, sys.stdout, indent=2, default=record_json)
             sys.stdout.write("\n")
         else:
             # Text formatter
@@ -113,6 +113,7 @@ def parse_opened(output):
             "action": record.get("action"),
             "change": record.get("change"),
             "type": record.get("type"),
+            "locked": "ourLock" in record,
         })
     return opened
 
@@ -154,15 +155,6 @@ def section_with_limit(items):
         "has_more": total > LIMIT,
     }
 
-def file_is_locked(file, user, client):
-    out = subprocess.run(
-        ["p4", "opened", "-a", file], capture_output=True, text=True
-    ).stdout
-    for line in out.splitlines():
-        if f"by {user}@{client}" in line and "*locked*" in line:
-            return True
-    return False
-
 def main():
     data = {
         "metadata": {
@@ -207,12 +199,7 @@ def main():
     if opened_err:
         data["errors"]["opened"] = opened_err
     else:
-        opened_entries = []
-        base_entries = parse_opened(opened_out)
-        for entry in base_entries:
-            locked = file_is_locked(entry["file"], entry.get("user"), entry.get("client"))
-            entry["locked"] = locked
-            opened_entries.append(entry)
+        opened_entries = parse_opened(opened_out)
         data["opened_files"] = opened_entries
 
         grouped = collections.defaultdict(list)
@@ -1,15 +1,30 @@
 #!/usr/bin/env python3
+import collections
+import itertools
 import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from contextlib import contextmanager
 from pathlib import Path
-from typing import Iterable, List, Sequence, Tuple
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple, Union
 
 from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
 from P4 import P4, P4Exception
 
+import p4guard
+import p4index
+import p4metrics
+from p4status import changes_filters, opened_filters, ranged_pathspec
 from slackbot_commands import COMMAND_DESCRIPTIONS
 
+try:
+    from P4 import PyKeepAlive
+except ImportError:  # P4Python without setbreak(); deadlines are then checked between commands only
+    PyKeepAlive = None
+
 
 def load_ticket() -> str:
     """Return ticket string, hydrating from file if necessary."""
@@ -27,10 +42,55 @@ def load_ticket() -> str:
     return ticket_text
 
 
-@contextmanager
-def connect_p4() -> Iterable[P4]:
-    """Context manager that yields a connected P4 client."""
-    p4 = P4()
+def ticket_stamp() -> Optional[float]:
+    """Modification time of P4_TICKET_FILE, used to notice ticket refreshes."""
+    ticket_path = os.environ.get("P4_TICKET_FILE")
+    if not ticket_path:
+        return None
+    try:
+        return os.stat(ticket_path).st_mtime
+    except OSError:
+        return None
+
+
+def server_failure(exc: P4Exception) -> Optional[str]:
+    """Why a failed call means the server did not answer, or None if it did."""
+    if p4guard.expired():
+        return "timed out"
+    message = str(exc)
+    if p4guard.unreachable(message):
+        return message.strip().splitlines()[0][:200]
+    return None
+
+
+class TimedP4(P4):
+    """P4 client that records every command in p4metrics.METRICS and reports
+    its outcome to P4_BREAKER. A command still running when the request's
+    deadline passes is cancelled and raises ``p4guard.DeadlineExceeded``."""
+
+    def run(self, *args, **kwargs):
+        p4guard.budget()
+        with p4metrics.timed("p4", str(args[0])) as call:
+            try:
+                results = super().run(*args, **kwargs)
+            except P4Exception as exc:
+                reason = server_failure(exc)
+                if reason is None:
+                    P4_BREAKER.success()
+                    raise
+                P4_BREAKER.failure(reason)
+                if reason == "timed out":
+                    raise p4guard.DeadlineExceeded(f"p4 {args[0]} ran past the request deadline") from exc
+                raise
+            call["records"] = len(results)
+            call["nbytes"] = p4metrics.record_bytes(results)
+        P4_BREAKER.success()
+        return results
+
+
+def new_p4() -> P4:
+    """Build and connect a P4 client from the environment."""
+    p4 = TimedP4()
     p4.port = os.environ.get("P4PORT")
     p4.user = os.environ.get("P4USER")
     charset = os.environ.get("P4CHARSET")
@@ -45,17 +105,449 @@ def connect_p4() -> Iterable[P4]:
     ticket = load_ticket()
     if ticket:
         p4.password = ticket
-    try:
-        p4.connect()
-        yield p4
-    finally:
+    if PyKeepAlive is not None:
+        p4.setbreak(p4guard.keepalive(PyKeepAlive))
+    p4guard.budget()
+    with p4metrics.timed("p4", "connect"):
+        try:
+            p4.connect()
+        except P4Exception as exc:
+            reason = server_failure(exc)
+            if reason is not None:
+                P4_BREAKER.failure(reason)
+            raise
+    return p4
+
+
+class P4Pool:
+    """Thread-safe pool of long-lived, authenticated P4 connections.
+
+    Connections idle for longer than ``idle_check`` seconds are probed with
+    ``login -s`` before reuse. A rewritten P4_TICKET_FILE retires every
+    existing connection so new ones pick up the refreshed ticket.
+    """
+
+    def __init__(self, size: int, acquire_timeout: float, idle_check: float):
+        self.size = size
+        self.acquire_timeout = acquire_timeout
+        self.idle_check = idle_check
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle: "queue.LifoQueue[Tuple[P4, int, float]]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._ticket_stamp = ticket_stamp()
+        self.counters = {"connects": 0, "reuses": 0, "discards": 0, "timeouts": 0}
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+
+    def _check_ticket(self) -> None:
+        stamp = ticket_stamp()
+        with self._lock:
+            if stamp == self._ticket_stamp:
+                return
+            self._ticket_stamp = stamp
+            self._generation += 1
+        # Let load_ticket() re-read the file on the next connect.
+        os.environ.pop("P4_TICKET", None)
+
+    def _discard(self, p4: P4) -> None:
+        self._count("discards")
         try:
             p4.disconnect()
         except Exception:
             pass
 
+    def _usable(self, p4: P4, generation: int, last_used: float) -> bool:
+        if generation != self._generation or not p4.connected():
+            return False
+        if time.monotonic() - last_used < self.idle_check:
+            return True
+        try:
+            p4.run("login", "-s")
+        except (P4Exception, p4guard.DeadlineExceeded):
+            return False
+        return True
+
+    def acquire(self) -> Tuple[P4, int]:
+        timeout = p4guard.budget(self.acquire_timeout)
+        if not self._slots.acquire(timeout=timeout):
+            self._count("timeouts")
+            if p4guard.expired():
+                raise p4guard.DeadlineExceeded("no Perforce connection free within the request deadline")
+            raise P4Exception(f"no Perforce connection free after {self.acquire_timeout}s")
+        try:
+            self._check_ticket()
+            while True:
+                try:
+                    p4, generation, last_used = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                if self._usable(p4, generation, last_used):
+                    self._count("reuses")
+                    return p4, generation
+                self._discard(p4)
+            generation = self._generation
+            p4 = new_p4()
+            self._count("connects")
+            return p4, generation
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, p4: P4, generation: int, reuse: bool = True) -> None:
+        if reuse and generation == self._generation and p4.connected():
+            self._idle.put((p4, generation, time.monotonic()))
+        else:
+            self._discard(p4)
+        self._slots.release()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self.counters)
+        stats["idle"] = self._idle.qsize()
+        stats["size"] = self.size
+        return stats
+
+
+P4_POOL = P4Pool(
+    size=int(os.environ.get("P4_POOL_SIZE", "4")),
+    acquire_timeout=float(os.environ.get("P4_POOL_TIMEOUT", "10")),
+    idle_check=float(os.environ.get("P4_POOL_IDLE_CHECK", "60")),
+)
 
-REGISTERED_COMMANDS = {"/files", "/describe", "/changes", "/locked", "/health"}
+
+@contextmanager
+def connect_p4() -> Iterable[P4]:
+    """Context manager that yields a connected P4 client from the pool.
+
+    Raises ``p4guard.CircuitOpen`` without waiting while P4_BREAKER is open.
+    A connection whose command was cancelled at the deadline is not reused.
+    """
+    P4_BREAKER.check()
+    with p4metrics.timed("pool", "acquire"):
+        p4, generation = P4_POOL.acquire()
+    reuse = False
+    try:
+        yield p4
+        reuse = True
+    except P4Exception:
+        reuse = True
+        raise
+    finally:
+        P4_POOL.release(p4, generation, reuse)
+
+
+class LRUCache:
+    """Size-bounded least-recently-used map with hit/miss counters."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._items: "collections.OrderedDict[Hashable, Any]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            if key not in self._items:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return self._items[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def discard(self, key: Hashable) -> None:
+        with self._lock:
+            self._items.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._items)}
+
+
+class QueryCache:
+    """Path-scoped query results, valid until the server's change counter moves.
+
+    The counter is probed at most once per ``probe_interval`` seconds. Entries
+    also expire after ``ttl`` seconds, which is all that applies when the
+    counter cannot be read.
+    """
+
+    def __init__(self, size: int, ttl: float, probe_interval: float):
+        self.ttl = ttl
+        self.probe_interval = probe_interval
+        self._entries = LRUCache(size)
+        self._lock = threading.Lock()
+        self._counter: Optional[str] = None
+        self._probed_at = float("-inf")
+        self.stale = 0
+
+    def counter(self) -> Optional[str]:
+        now = time.monotonic()
+        with self._lock:
+            if now - self._probed_at < self.probe_interval:
+                return self._counter
+        try:
+            with connect_p4() as p4:
+                rows = p4.run("counter", "change")
+            value = rows[0].get("value") if rows and isinstance(rows[0], dict) else None
+        except (P4Exception, p4guard.CircuitOpen, p4guard.DeadlineExceeded):
+            # Unknown counter: entries live out their TTL, even while Perforce is down.
+            value = None
+        with self._lock:
+            self._counter = value
+            self._probed_at = now
+        return value
+
+    def get(self, key: Hashable) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        counter, stored_at, value = entry
+        current = self.counter()
+        fresh = time.monotonic() - stored_at < self.ttl
+        if fresh and (counter is None or current is None or counter == current):
+            return value
+        self._entries.discard(key)
+        with self._lock:
+            self.stale += 1
+        return None
+
+    def put(self, key: Hashable, counter: Optional[str], value: Any) -> None:
+        self._entries.put(key, (counter, time.monotonic(), value))
+
+    def stats(self) -> Dict[str, int]:
+        stats = self._entries.stats()
+        with self._lock:
+            stats["stale"] = self.stale
+        return stats
+
+
+# Submitted changelists never change, so their descriptions never expire.
+DESCRIBE_CACHE = LRUCache(int(os.environ.get("P4_DESCRIBE_CACHE_SIZE", "512")))
+QUERY_CACHE = QueryCache(
+    size=int(os.environ.get("P4_QUERY_CACHE_SIZE", "256")),
+    ttl=float(os.environ.get("P4_QUERY_CACHE_TTL", "300")),
+    probe_interval=float(os.environ.get("P4_COUNTER_PROBE_INTERVAL", "5")),
+)
+
+
+# A reply is either plain text or a Block Kit payload for say().
+Message = Union[str, Dict[str, Any]]
+
+
+class CommandDispatcher:
+    """Runs slash-command work on a bounded worker pool, off the Bolt listener thread.
+
+    At most ``per_user`` commands per user and ``max_pending`` overall may be
+    waiting or running; past that the command is refused. Commands with the
+    same key that are already in flight share one Perforce call. Each
+    command's Perforce calls share a budget of ``deadline`` seconds, counted
+    from when the command was queued.
+    """
+
+    def __init__(self, workers: int, per_user: int, max_pending: int, deadline: Optional[float] = None):
+        self.workers = workers
+        self.per_user = per_user
+        self.max_pending = max_pending
+        self.deadline = deadline
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="p4cmd")
+        self._lock = threading.Lock()
+        self._inflight: Dict[Hashable, Future] = {}
+        self._user_load: "collections.Counter[str]" = collections.Counter()
+        self._pending = 0
+        self._queued = 0
+        self.counters = {"submitted": 0, "coalesced": 0, "rejected": 0, "failed": 0, "degraded": 0}
+
+    def _run(self, key: Hashable, work: Callable[[], Message], queued_at: float) -> Message:
+        with self._lock:
+            self._queued -= 1
+        budget = None if self.deadline is None else self.deadline - (time.monotonic() - queued_at)
+        try:
+            with p4metrics.timed("command", str(key[0])), p4guard.deadline(budget):
+                return work()
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+                self._pending -= 1
+
+    def _deliver(self, user: str, future: Future, reply: Callable[[Message], None]) -> None:
+        with self._lock:
+            self._user_load[user] -= 1
+            if self._user_load[user] <= 0:
+                del self._user_load[user]
+        try:
+            message = future.result()
+        except (p4guard.CircuitOpen, p4guard.DeadlineExceeded) as exc:
+            with self._lock:
+                self.counters["degraded"] += 1
+            message = f":warning: Perforce is not answering right now, so this was not run. {exc}."
+        except Exception as exc:
+            with self._lock:
+                self.counters["failed"] += 1
+            message = f":x: command failed:\n```\n{exc}\n```"
+        with p4metrics.timed("slack", "post"):
+            reply(message)
+
+    def submit(self, user: str, key: Hashable, work: Callable[[], Message], reply: Callable[[Message], None]) -> bool:
+        """Queue ``work`` (or join an identical in-flight call); False if refused."""
+        with self._lock:
+            future = self._inflight.get(key)
+            if self._user_load[user] >= self.per_user or (future is None and self._pending >= self.max_pending):
+                self.counters["rejected"] += 1
+                return False
+            self._user_load[user] += 1
+            if future is None:
+                self._pending += 1
+                self._queued += 1
+                self.counters["submitted"] += 1
+                future = self._pool.submit(self._run, key, work, time.monotonic())
+                self._inflight[key] = future
+            else:
+                self.counters["coalesced"] += 1
+        future.add_done_callback(lambda done: self._deliver(user, done, reply))
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self.counters)
+            stats["queue_depth"] = self._queued
+            stats["running"] = self._pending - self._queued
+            stats["workers"] = self.workers
+        return stats
+
+
+DISPATCHER = CommandDispatcher(
+    workers=int(os.environ.get("BOT_WORKERS", "8")),
+    per_user=int(os.environ.get("BOT_PER_USER", "2")),
+    max_pending=int(os.environ.get("BOT_MAX_PENDING", "64")),
+    deadline=float(os.environ.get("BOT_COMMAND_DEADLINE", "20")),
+)
+
+
+def dispatch(user: str, say: Callable[..., Any], key: Hashable, work: Callable[[], Message]) -> None:
+    """Run ``work`` for a command or button in the background and post its message."""
+    if not DISPATCHER.submit(user, key, work, say):
+        say(":hourglass: The bot is busy with other Perforce requests; try again in a moment.")
+
+
+PAGE_SIZE = 25
+# "Show more" buttons carry a short token; the cursor behind it lives here.
+PAGE_TOKENS = LRUCache(int(os.environ.get("BOT_PAGE_TOKENS", "1024")))
+_page_ids = itertools.count(1)
+
+
+def page_token(kind: str, target: str, offset: int, after: Hashable, filters: Optional[Dict[str, str]] = None) -> str:
+    token = format(next(_page_ids), "x")
+    PAGE_TOKENS.put(token, (kind, target, offset, after, filters or {}))
+    return token
+
+
+# Filter words a command accepts after its path, e.g. ``/locked //class/... user:alice``.
+COMMAND_FILTERS = {
+    "locked": ("user", "client"),
+    "changes": ("user", "client", "since", "range"),
+}
+
+
+def parse_command(kind: str, text: str) -> Tuple[str, Dict[str, str]]:
+    """Split slash-command text into a path (default //...) and ``name:value``
+    filters; raises ValueError on an unknown filter or a malformed range."""
+    path = "//..."
+    filters: Dict[str, str] = {}
+    for word in text.split():
+        name, sep, value = word.partition(":")
+        if not sep or name.startswith("/"):
+            path = word
+        elif name not in COMMAND_FILTERS[kind] or not value or value.startswith("-"):
+            allowed = " ".join(f"`{name}:…`" for name in COMMAND_FILTERS[kind])
+            raise ValueError(f"unknown filter `{word}`; use {allowed}")
+        else:
+            filters["changes_range" if name == "range" else name] = value
+    ranged_pathspec(path, filters.get("since"), filters.get("changes_range"))
+    return path, filters
+
+
+def filter_note(filters: Dict[str, str]) -> str:
+    return "".join(f" {name}:{value}" for name, value in sorted(filters.items()))
+
+
+def page_after(
+    fetch: Callable[[int], List[Any]],
+    key: Callable[[Any], Hashable],
+    offset: int,
+    after: Hashable,
+    limit: int,
+) -> Tuple[List[Any], bool]:
+    """The page of ``limit`` rows that follows ``after``, and whether more follow.
+
+    This is offset paging, not keyset paging: ``files`` and ``opened`` cannot
+    start partway through a listing, so ``fetch(n)`` asks the server for the
+    first ``n`` rows (``-m n``) and the server reads everything ahead of the
+    page. The page starts after the cursor row rather than at ``offset``, so
+    rows added or removed ahead of it do not repeat or skip entries. If rows
+    were added ahead of the cursor and the page comes up short, the listing
+    is fetched once more with room for a full page. ``more`` is worked out
+    from the rows after the cursor. When the listing stopped at the ``-m``
+    limit, ``more`` is True because rows may follow.
+    """
+    def start_of(rows: List[Any]) -> int:
+        if after is not None:
+            for index, row in enumerate(rows):
+                if key(row) == after:
+                    return index + 1
+        return offset
+
+    wanted = offset + limit + 1
+    rows = fetch(wanted)
+    start = start_of(rows)
+    if len(rows) >= wanted and len(rows) - start <= limit:
+        wanted = start + limit + 1
+        rows = fetch(wanted)
+        start = start_of(rows)
+    following = rows[start:]
+    return following[:limit], len(following) > limit or len(rows) >= wanted
+
+
+def more_button(text: str, token: str) -> Dict[str, Any]:
+    return {
+        "text": text,
+        "blocks": [
+            {"type": "section", "text": {"type": "mrkdwn", "text": text[:3000]}},
+            {"type": "actions", "elements": [{
+                "type": "button",
+                "action_id": "show_more",
+                "text": {"type": "plain_text", "text": "Show more"},
+                "value": token,
+            }]},
+        ],
+    }
+
+
+# Optional local mirror maintained by p4index.py; /locked and /search read it
+# once open_index() has connected it.
+INDEX_DB = None
+INDEX_LOCK = threading.Lock()
+
+
+def open_index() -> None:
+    """Connect INDEX_DB to the mirror named by P4_INDEX_DB, if it is set."""
+    global INDEX_DB
+    path = os.environ.get("P4_INDEX_DB")
+    if path and INDEX_DB is None:
+        INDEX_DB = p4index.connect(path)
+
+
+REGISTERED_COMMANDS = {"/files", "/describe", "/changes", "/locked", "/search", "/health"}
 _missing_docs = REGISTERED_COMMANDS - COMMAND_DESCRIPTIONS.keys()
 if _missing_docs:
     raise RuntimeError(
@@ -70,16 +562,29 @@ if not _bot_token:
 app = App(token=_bot_token)
 
 
-def p4_list_files(pattern: str, limit: int = 20) -> List[str]:
-    with connect_p4() as p4:
-        try:
-            results = p4.run_files(pattern)
-        except P4Exception as exc:
-            return [f"ERROR: {exc}"]
-    return [item.get("depotFile", "") for item in results[:limit]]
+def p4_list_files(pattern: str, limit: int = 20, offset: int = 0, after: Optional[str] = None) -> Tuple[List[str], bool]:
+    key = ("files", pattern, limit, offset, after)
+    cached = QUERY_CACHE.get(key)
+    if cached is not None:
+        return cached
+    counter = QUERY_CACHE.counter()
+
+    def fetch(count: int) -> List[str]:
+        with connect_p4() as p4:
+            return [item.get("depotFile", "") for item in p4.run_files("-m", str(count), pattern)]
+
+    try:
+        page = page_after(fetch, lambda depot: depot, offset, after, limit)
+    except P4Exception as exc:
+        return [f"ERROR: {exc}"], False
+    QUERY_CACHE.put(key, counter, page)
+    return page
 
 
 def describe_change(cl: str) -> Tuple[bool, str]:
+    cached = DESCRIBE_CACHE.get(cl)
+    if cached is not None:
+        return cached
     with connect_p4() as p4:
         try:
             result = p4.run_describe("-s", cl)
@@ -111,17 +616,34 @@ def describe_change(cl: str) -> Tuple[bool, str]:
     body_text = "\n".join(body)
     if len(body_text) > 3000:
         body_text = body_text[:2997] + '...'
+    if data.get("status") == "submitted":
+        DESCRIBE_CACHE.put(cl, (True, body_text))
     return True, body_text
 
 
-def recent_changes(path: str, limit: int = 10) -> Tuple[bool, str]:
+def recent_changes(
+    path: str,
+    limit: int = 10,
+    user: Optional[str] = None,
+    client: Optional[str] = None,
+    since: Optional[str] = None,
+    changes_range: Optional[str] = None,
+) -> Tuple[bool, str]:
+    """The newest changes under path. Filters go to the server as ``-u``/``-c``
+    flags and an ``@from,@to`` range."""
+    key = ("changes", path, limit, user, client, since, changes_range)
+    cached = QUERY_CACHE.get(key)
+    if cached is not None:
+        return cached
+    counter = QUERY_CACHE.counter()
+    spec = ranged_pathspec(path, since, changes_range)
     with connect_p4() as p4:
         try:
-            rows = p4.run_changes("-m", str(limit), path)
+            rows = p4.run_changes("-m", str(limit), *changes_filters(user, client), spec)
         except P4Exception as exc:
-            return False, f":x: unable to list changes for `{path}`:\n```\n{exc}\n```"
+            return False, f":x: unable to list changes for `{spec}`:\n```\n{exc}\n```"
     if not rows:
-        return True, f"No submitted changes match `{path}`."
+        return True, f"No submitted changes match `{spec}`."
     lines = []
     for row in rows:
         change = row.get("change", "?")
@@ -130,23 +652,83 @@ def recent_changes(path: str, limit: int = 10) -> Tuple[bool, str]:
         status = row.get("status", "submitted")
         lines.append(f"`{change}` ({status}) — {summary} _by {user}_")
     text = "*Recent changes*\n" + "\n".join(lines)
+    QUERY_CACHE.put(key, counter, (True, text[:3000]))
     return True, text[:3000]
 
 
-def list_locked_files(path: str, limit: int = 25) -> Tuple[List[Tuple[str, bool]], bool, str]:
-    with connect_p4() as p4:
+def index_opened(
+    path: str,
+    limit: int,
+    after: Optional[Tuple[str, str]] = None,
+    user: Optional[str] = None,
+    client: Optional[str] = None,
+) -> List[Dict[str, str]]:
+    """Opened-file records for path from the local index (P4_INDEX_DB)."""
+    with INDEX_LOCK:
+        rows = p4index.query_opened(INDEX_DB, path, user=user, client=client, limit=limit, after=after)
+    return [p4index.opened_record(row) for row in rows]
+
+
+def index_freshness() -> str:
+    with INDEX_LOCK:
+        refreshed_at = p4index.get_meta(INDEX_DB, "refreshed_at")
+    return f"_from the local index as of {refreshed_at or 'never'}_"
+
+
+def search_message(query: str, limit: int = 10) -> str:
+    """Best-matching submitted changes for ``query`` from the local index."""
+    if INDEX_DB is None:
+        return ":x: `/search` needs the local index; set `P4_INDEX_DB` and run `p4index.py --search`."
+    with INDEX_LOCK:
+        results = p4index.search(INDEX_DB, query, limit)
+        through = p4index.get_meta(INDEX_DB, "search_through")
+    if through is None:
+        return ":x: the search index is empty; run `p4index.py --search` first."
+    if not results:
+        return f"No submitted changes match `{query}`."
+    lines = [
+        f"`{item['change']}` — {item['description']} _by {item['user']}_ ({(item['time_iso'] or '')[:10]})"
+        for item in results
+    ]
+    text = f"*Changes matching* `{query}`\n" + "\n".join(lines) + f"\n_indexed through change {through}_"
+    return text[:3000]
+
+
+def opened_key(entry: Dict[str, str]) -> Tuple[str, str]:
+    return entry.get("depotFile", ""), entry.get("client", "")
+
+
+def list_locked_files(
+    path: str,
+    limit: int = 25,
+    offset: int = 0,
+    after: Optional[Tuple[str, str]] = None,
+    user: Optional[str] = None,
+    client: Optional[str] = None,
+) -> Tuple[List[Tuple[str, bool]], bool, str, Optional[Tuple[str, str]]]:
+    """Rows for one page of opened files, whether more follow, a warning, and
+    the (file, client) key of the page's last entry. ``user`` and ``client``
+    become ``opened -u``/``-C`` so the server only sends their files."""
+    if INDEX_DB is not None:
+        # The index can seek, so the page starts right after the cursor.
+        entries = index_opened(path, limit + 1, after, user, client)
+        truncated = len(entries) > limit
+        entries = entries[:limit]
+    else:
+        def fetch(count: int) -> List[Dict[str, str]]:
+            with connect_p4() as p4:
+                entries = p4.run("opened", "-a", *opened_filters(user, client), "-m", str(count), path)
+            return list(entries) if isinstance(entries, Sequence) else []
+
         try:
-            entries = p4.run("opened", "-a", path)
+            entries, truncated = page_after(fetch, opened_key, offset, after, limit)
         except P4Exception as exc:
             message = str(exc)
             if "File(s) not opened anywhere." in message:
-                return [], False, ""
-            return [], False, f":warning: `p4 opened` failed:\n```\n{message[:2900]}\n```"
-    if not isinstance(entries, Sequence):
-        entries = []
-    truncated = len(entries) > limit
+                return [], False, "", None
+            return [], False, f":warning: `p4 opened` failed:\n```\n{message[:2900]}\n```", None
     rows = []
-    for entry in entries[:limit]:
+    for entry in entries:
         depot = entry.get("depotFile", "<unknown>")
         rev = entry.get("rev") or entry.get("workRev") or entry.get("haveRev")
         location = f"{depot}#{rev}" if rev else depot
@@ -159,39 +741,150 @@ def list_locked_files(path: str, limit: int = 25) -> Tuple[List[Tuple[str, bool]
         file_type = entry.get("type", "")
         is_exclusive = "+l" in file_type or bool(entry.get("ourLock")) or bool(entry.get("otherLock"))
         rows.append((summary, is_exclusive))
-    return rows, truncated, ""
+    return rows, truncated, "", opened_key(entries[-1]) if entries else None
 
 
-def login_status() -> Tuple[bool, str]:
-    with connect_p4() as p4:
-        try:
-            output = p4.run("login", "-s")
-        except P4Exception as exc:
-            return False, f":warning: p4 auth issue:\n```\n{exc}\n```"
+def probe_login() -> Tuple[bool, bool, str]:
+    """Run ``login -s`` on a fresh connection within P4_PROBE_TIMEOUT seconds.
+
+    Returns whether the server answered, whether the login is valid, and
+    the text for /health. A fresh connection keeps the probe out of the
+    pool, whose connections may all be stuck behind a slow server.
+    """
+    try:
+        with p4guard.deadline(PROBE_TIMEOUT):
+            p4 = new_p4()
+            try:
+                output = p4.run("login", "-s")
+            finally:
+                p4.disconnect()
+    except (P4Exception, p4guard.DeadlineExceeded) as exc:
+        answered = not isinstance(exc, p4guard.DeadlineExceeded) and server_failure(exc) is None
+        if answered:
+            return True, False, f":warning: p4 auth issue:\n```\n{exc}\n```"
+        return False, False, f":x: Perforce did not answer `p4 login -s`:\n```\n{exc}\n```"
     if not output:
-        return True, "`p4 login -s` returned no output."
+        return True, True, "`p4 login -s` returned no output."
     if isinstance(output, list):
         text = "\n".join(str(item) for item in output)
     else:
         text = str(output)
-    return True, f"```\n{text}\n```"
+    return True, True, f"```\n{text}\n```"
+
+
+class HealthProber:
+    """Runs ``probe_login`` every ``interval`` seconds on a daemon thread.
+
+    /health reads the last answer instead of calling Perforce, so it stays
+    instant while the server is slow. The breaker's half-open probes go
+    through ``check`` too, so they refresh the answer as well.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._last: Tuple[bool, str] = (False, "_Perforce has not been checked yet._")
+        self._checked_at: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def check(self) -> bool:
+        """Probe now; True if the server answered."""
+        with p4metrics.timed("probe", "login"):
+            answered, ok, text = probe_login()
+        with self._lock:
+            self._last = (ok, text)
+            self._checked_at = time.time()
+        return answered
+
+    def _loop(self) -> None:
+        while True:
+            try:
+                self.check()
+            except Exception as exc:
+                with self._lock:
+                    self._last = (False, f":x: health check failed: {exc}")
+            time.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="p4health", daemon=True)
+            self._thread.start()
+
+    def last(self) -> Tuple[bool, str, Optional[float]]:
+        with self._lock:
+            return self._last[0], self._last[1], self._checked_at
+
+
+PROBE_TIMEOUT = float(os.environ.get("P4_PROBE_TIMEOUT", "5"))
+HEALTH = HealthProber(float(os.environ.get("P4_HEALTH_INTERVAL", "30")))
+P4_BREAKER = p4guard.CircuitBreaker(
+    failures=int(os.environ.get("P4_BREAKER_FAILURES", "3")),
+    cooldown=float(os.environ.get("P4_BREAKER_COOLDOWN", "30")),
+    probe=HEALTH.check,
+)
+
+
+def login_status() -> Tuple[bool, str]:
+    """The prober's last ``login -s`` answer with the bot's counters; no Perforce call."""
+    ok, text, checked_at = HEALTH.last()
+    if checked_at is not None:
+        text += f"\n_checked {time.time() - checked_at:.0f}s ago_"
+    stats = "\n".join(
+        f"_{name}: " + " ".join(f"{key}={value}" for key, value in values.items()) + "_"
+        for name, values in (
+            ("breaker", P4_BREAKER.stats()),
+            ("pool", P4_POOL.stats()),
+            ("describe cache", DESCRIBE_CACHE.stats()),
+            ("query cache", QUERY_CACHE.stats()),
+            ("dispatcher", DISPATCHER.stats()),
+            ("command p95 seconds", {
+                name: series["p95_s"] for name, series in p4metrics.METRICS.summary().get("command", {}).items()
+            }),
+        )
+    )
+    return ok, f"{text}\n{stats}"
+
+
+def files_message(pattern: str, offset: int = 0, after: Optional[str] = None) -> Message:
+    files, more = p4_list_files(pattern, limit=PAGE_SIZE, offset=offset, after=after)
+    if not files:
+        return f"No more matches for `{pattern}`" if offset else f"No matches for `{pattern}`"
+    if len(files) == 1 and files[0].startswith("ERROR:"):
+        return files[0]
+    body = "*Files:*\n" + "\n".join(f"• `{f}`" for f in files)
+    if more:
+        return more_button(body, page_token("files", pattern, offset + len(files), files[-1]))
+    return body
+
+
+def locked_message(path: str, offset: int = 0, after: Optional[Tuple[str, str]] = None, **filters: str) -> Message:
+    rows, truncated, warning, last = list_locked_files(path, limit=PAGE_SIZE, offset=offset, after=after, **filters)
+    if warning:
+        return warning
+    if not rows:
+        if offset:
+            return f"No more open files under `{path}`{filter_note(filters)}."
+        return f"No files are currently open for edit under `{path}`{filter_note(filters)}."
+    bullets = []
+    for summary, exclusive in rows:
+        prefix = ":lock: " if exclusive else ""
+        bullets.append(f"• {prefix}{summary}")
+    body = "*Opened files*\n" + "\n".join(bullets)
+    if INDEX_DB is not None:
+        body += "\n" + index_freshness()
+    if truncated:
+        return more_button(body, page_token("locked", path, offset + len(rows), last, filters))
+    return body
+
+
+PAGED_MESSAGES: Dict[str, Callable[..., Message]] = {"files": files_message, "locked": locked_message}
 
 
 @app.command("/files")
 def files_cmd(ack, say, command):
     ack("Looking that up…")
     pattern = (command.get("text") or "").strip() or "//..."
-    files = p4_list_files(pattern, limit=25)
-    if not files:
-        say(f"No matches for `{pattern}`")
-        return
-    if len(files) == 1 and files[0].startswith("ERROR:"):
-        say(files[0])
-        return
-    body = "*Files:*\n" + "\n".join(f"• `{f}`" for f in files)
-    if len(files) == 25:
-        body += "\n_(truncated)_"
-    say(body)
+    dispatch(command.get("user_id") or "", say, ("files", pattern), lambda: files_message(pattern))
 
 
 @app.command("/describe")
@@ -201,44 +894,61 @@ def describe_cmd(ack, say, command):
     if not cl.isdigit():
         say("Usage: `/describe <changelist>`")
         return
-    ok, message = describe_change(cl)
-    say(message)
+    dispatch(command.get("user_id") or "", say, ("describe", cl), lambda: describe_change(cl)[1])
 
 
 @app.command("/changes")
 def changes_cmd(ack, say, command):
     ack("fetching changes…")
-    path = (command.get("text") or "").strip() or "//..."
-    ok, message = recent_changes(path, limit=10)
-    say(message)
+    try:
+        path, filters = parse_command("changes", command.get("text") or "")
+    except ValueError as exc:
+        say(f"Usage: `/changes [path] [user:NAME] [client:NAME] [since:YYYY/MM/DD | range:FROM,TO]` ({exc})")
+        return
+    key = ("changes", path, *sorted(filters.items()))
+    dispatch(command.get("user_id") or "", say, key, lambda: recent_changes(path, limit=10, **filters)[1])
 
 
 @app.command("/locked")
 def locked_cmd(ack, say, command):
     ack("checking locks…")
-    path = (command.get("text") or "").strip() or "//..."
-    rows, truncated, warning = list_locked_files(path, limit=25)
-    if warning:
-        say(warning)
+    try:
+        path, filters = parse_command("locked", command.get("text") or "")
+    except ValueError as exc:
+        say(f"Usage: `/locked [path] [user:NAME] [client:NAME]` ({exc})")
         return
-    if not rows:
-        say(f"No files are currently open for edit under `{path}`.")
+    key = ("locked", path, *sorted(filters.items()))
+    dispatch(command.get("user_id") or "", say, key, lambda: locked_message(path, **filters))
+
+
+@app.command("/search")
+def search_cmd(ack, say, command):
+    ack("searching…")
+    query = (command.get("text") or "").strip()
+    if not query:
+        say("Usage: `/search <terms>`")
         return
-    bullets = []
-    for summary, exclusive in rows:
-        prefix = ":lock: " if exclusive else ""
-        bullets.append(f"• {prefix}{summary}")
-    body = "*Opened files*\n" + "\n".join(bullets)
-    if truncated:
-        body += "\n_(truncated)_"
-    say(body)
+    dispatch(command.get("user_id") or "", say, ("search", query.lower()), lambda: search_message(query))
 
 
 @app.command("/health")
 def health_cmd(ack, say, command):
     ack("checking…")
-    ok, message = login_status()
-    say(message)
+    say(login_status()[1])
+
+
+@app.action("show_more")
+def show_more_action(ack, say, body):
+    ack()
+    token = body["actions"][0]["value"]
+    page = PAGE_TOKENS.get(token)
+    if page is None:
+        say("That page has expired; run the command again.")
+        return
+    kind, target, offset, after, filters = page
+    # Only commands listed in COMMAND_FILTERS take filters; /files has none.
+    filters = filters if kind in COMMAND_FILTERS else {}
+    dispatch(body["user"]["id"], say, ("more", token), lambda: PAGED_MESSAGES[kind](target, offset, after, **filters))
 
 
 # Uncomment to lock bot to particular channels
@@ -249,8 +959,19 @@ def health_cmd(ack, say, command):
 #     return
 
 
+def start_background() -> None:
+    """Open the optional index and start the health prober. Only the running
+    bot calls this, so importing the module starts no threads or connections."""
+    open_index()
+    HEALTH.start()
+
+
 if __name__ == "__main__":
     app_token = os.environ.get("SLACK_APP_TOKEN")
     if not app_token:
         raise RuntimeError("SLACK_APP_TOKEN is required to start the Socket Mode handler.")
+    metrics_port = os.environ.get("BOT_METRICS_PORT")
+    if metrics_port:
+        p4metrics.METRICS.serve(int(metrics_port), prefix="p4bot")
+    start_background()
     SocketModeHandler(app, app_token).start()
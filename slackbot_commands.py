@@ -1,9 +1,10 @@
 """Shared Slack bot metadata."""
 
 COMMAND_DESCRIPTIONS = {
-    "/files": "List up to 25 depot files matching the given pattern (defaults to //...).",
+    "/files": "List depot files matching the given pattern (defaults to //...), 25 at a time.",
     "/describe": "Show a summary of the specified changelist (`/describe 12345`).",
-    "/changes": "List the 10 most recent submitted changelists for an optional path.",
-    "/locked": "Show files currently opened for edit; exclusive locks are flagged with :lock:.",
-    "/health": "Run `p4 login -s` to confirm the service account is authenticated.",
+    "/changes": "List the 10 most recent submitted changelists for an optional path; narrow with `user:`, `client:` and `since:YYYY/MM/DD` or `range:FROM,TO`.",
+    "/locked": "Show files currently opened for edit, 25 at a time; exclusive locks are flagged with :lock:. Narrow with `user:` and `client:`.",
+    "/search": "Find submitted changelists whose description, author or files match all the given words (`/search lighting bug`).",
+    "/health": "Show the latest `p4 login -s` check of the service account, the circuit breaker state and bot counters.",
 }
@@ -1,27 +1,26 @@
 #!/usr/bin/python3
 
+import argparse
+import fcntl
+import http.client
+import io
+import json
+import marshal
 import sys
 import subprocess
 import os
+import time
+import urllib.parse
 from pathlib import Path
-try:
-    import requests
-    _have_requests = True
-except Exception:
-    _have_requests = False
-    import json
-    from urllib.request import Request, urlopen
-    from urllib.error import URLError, HTTPError
 
-webhook_url = os.environ.get("SLACK_WEBHOOK")
-if not webhook_url:
-    print("Environment variable SLACK_WEBHOOK is required (no default allowed)", file=sys.stderr)
-    sys.exit(2)
-
-if len(sys.argv) < 3:
-    print("Usage: submit-slack.py <change> <user>", file=sys.stderr)
-    sys.exit(2)
+import p4guard
+import p4metrics
 
+DEFAULT_SPOOL = str(Path(__file__).resolve().parent / "submit-slack.spool")
+DEFAULT_CHECKPOINT = str(Path(__file__).resolve().parent / "submit-slack.checkpoint")
+# Seconds for the p4 calls of one notification, forwarder batch or reconcile run.
+DEFAULT_DEADLINE = 30
+PROBE_TIMEOUT = 5
 
 
 def load_ticket():
@@ -58,22 +57,76 @@ def p4_cmd(*args):
     return cmd
 
 
-# Optional: preflight (helps logs if ticket missing/expired but doesn't fail hard)
-try:
-    subprocess.run(p4_cmd("login", "-s"),
-                   stdout=subprocess.DEVNULL,
-                   stderr=subprocess.DEVNULL,
-                   check=False)
-except Exception:
-    pass
-change = sys.argv[1]
-user = sys.argv[2]
+def server_failure(result):
+    """Why a finished p4 call means the server did not answer, or None if it did."""
+    if not result.returncode:
+        return None
+    for stream in (result.stderr, result.stdout):
+        if isinstance(stream, bytes):
+            stream = stream[:4096].decode("utf-8", "replace")
+        if stream and p4guard.unreachable(stream):
+            return stream.strip().splitlines()[0][:200]
+    return None
+
+
+def record_outcome(result):
+    reason = server_failure(result)
+    if reason:
+        P4_BREAKER.failure(reason)
+    else:
+        P4_BREAKER.success()
+
+
+def run_p4(command, guard=True, **kwargs):
+    """subprocess.run() for a p4 command line, recorded in p4metrics.METRICS.
+
+    The command may run for what is left of the p4guard deadline and raises
+    p4guard.DeadlineExceeded past it. With guard, P4_BREAKER is checked first
+    (p4guard.CircuitOpen while it is open) and told how the call went.
+    """
+    if guard:
+        P4_BREAKER.check()
+    timeout = p4guard.budget(kwargs.pop("timeout", None))
+    name = p4metrics.command_name(command)
+    with p4metrics.timed("p4", name) as call:
+        try:
+            out = subprocess.run(command, timeout=timeout, **kwargs)
+        except subprocess.TimeoutExpired as exc:
+            call["error"] = True
+            if guard:
+                P4_BREAKER.failure("timed out")
+            raise p4guard.DeadlineExceeded(f"p4 {name} timed out after {round(timeout, 2)}s") from exc
+        except subprocess.CalledProcessError as exc:
+            call["error"] = True
+            if guard:
+                record_outcome(exc)
+            raise
+        call["nbytes"] = len(out.stdout or "")
+        call["error"] = out.returncode != 0
+    if guard:
+        record_outcome(out)
+    return out
+
+
+def probe_login():
+    """Half-open check for P4_BREAKER: True if 'p4 login -s' got an answer."""
+    try:
+        with p4guard.deadline(PROBE_TIMEOUT):
+            out = run_p4(p4_cmd("login", "-s"), guard=False, capture_output=True, check=False)
+    except (OSError, p4guard.DeadlineExceeded):
+        return False
+    return server_failure(out) is None
+
+
+P4_BREAKER = p4guard.CircuitBreaker(failures=3, cooldown=30, probe=probe_login)
 
 
 def get_description_from_describe(change):
     try:
-        out = subprocess.run(["p4", "-Ztag", "describe", change], capture_output=True, text=True, check=True)
-    except subprocess.CalledProcessError:
+        out = run_p4(["p4", "-Ztag", "describe", change], capture_output=True, text=True, check=True)
+    except (p4guard.DeadlineExceeded, p4guard.CircuitOpen):
+        raise
+    except (subprocess.CalledProcessError, OSError):
         return None
     lines = []
     for line in out.stdout.splitlines():
@@ -85,8 +138,10 @@ def get_description_from_describe(change):
 
 def get_description_from_change_spec(change):
     try:
-        out = subprocess.run(["p4", "-ztag", "change", "-o", change], capture_output=True, text=True, check=True)
-    except subprocess.CalledProcessError:
+        out = run_p4(["p4", "-ztag", "change", "-o", change], capture_output=True, text=True, check=True)
+    except (p4guard.DeadlineExceeded, p4guard.CircuitOpen):
+        raise
+    except (subprocess.CalledProcessError, OSError):
         return None
     lines = out.stdout.splitlines()
     desc_lines = []
@@ -103,36 +158,626 @@ def get_description_from_change_spec(change):
     return "\n".join(desc_lines).strip() if desc_lines else None
 
 
-commit_message = get_description_from_describe(change)
-if not commit_message:
-    commit_message = get_description_from_change_spec(change)
-if not commit_message:
-    commit_message = "_No commit message provided_"
+def run_p4_marshal(*args):
+    """Run 'p4 -G <args>' and return its stat records with str keys and values.
+
+    Raises OSError if p4 cannot be run and RuntimeError if it fails without
+    returning any records; errors alongside records are only logged.
+    """
+    out = run_p4(p4_cmd("-G", *args), capture_output=True, check=False)
+    records = []
+    errors = []
+    stream = io.BytesIO(out.stdout)
+    while True:
+        try:
+            raw = marshal.load(stream)
+        except EOFError:
+            break
+        record = {
+            key.decode("utf-8", "replace"): value.decode("utf-8", "replace") if isinstance(value, bytes) else str(value)
+            for key, value in raw.items()
+        }
+        if record.get("code", "stat") == "stat":
+            records.append(record)
+        elif record.get("code") == "error":
+            errors.append(record.get("data", "").strip())
+    if not records and (errors or out.returncode != 0):
+        raise RuntimeError("\n".join(errors) or (out.stderr or b"").decode("utf-8", "replace").strip())
+    for error in errors:
+        print(f"p4 {args[0]}: {error}", file=sys.stderr)
+    return records
+
+
+def get_descriptions(changes):
+    """Fetch descriptions for several changelists with one 'p4 -G describe -s' call.
+
+    A timeout or open breaker is raised, so the forwarder can hold the batch.
+    """
+    if not changes:
+        return {}
+    try:
+        records = run_p4_marshal("describe", "-s", *changes)
+    except (p4guard.DeadlineExceeded, p4guard.CircuitOpen):
+        raise
+    except (OSError, RuntimeError) as e:
+        print(f"p4 describe failed: {e}", file=sys.stderr)
+        return {}
+    descriptions = {}
+    for record in records:
+        change = record.get("change", "")
+        desc = record.get("desc", "").strip()
+        if change and desc:
+            descriptions[change] = desc
+    return descriptions
+
+
+def format_message(change, user, commit_message):
+    if not commit_message:
+        commit_message = "_No commit message provided_"
+    return (
+        f"User *{user}* submitted changelist `{change}`:\n"
+        f"*Commit message:*\n{commit_message}\n"
+    )
+
+
+class SlackRejected(Exception):
+    """Slack refused a message for good (a 4xx other than 408 or 429); retrying cannot help."""
+
+    def __init__(self, status, reason):
+        super().__init__(f"HTTP {status} {reason}".strip())
+        self.status = status
+        self.reason = reason
+
+
+class SlackDelivery:
+    """Posts to a Slack incoming webhook over one kept-alive HTTP connection.
+
+    A token bucket paces posts to the webhook rate limit (Slack allows about
+    one message per second with short bursts). A 429 response pauses all
+    posting for its Retry-After period. post_many() folds a backlog that
+    exceeds the available tokens into digest messages.
+    """
+
+    DIGEST_SIZE = 20
+    DIGEST_CHARS = 30000
 
-message = (
-    f"User *{user}* submitted changelist `{change}`:\n"
-    f"*Commit message:*\n{commit_message}\n"
-)
+    def __init__(self, webhook_url, rate=1.0, burst=4, timeout=8, attempts=3):
+        url = urllib.parse.urlsplit(webhook_url)
+        self._connection_type = (
+            http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+        )
+        self._netloc = url.netloc
+        self._path = url.path + (f"?{url.query}" if url.query else "")
+        self._conn = None
+        self.rate = rate
+        self.burst = burst
+        self.timeout = timeout
+        self.attempts = attempts
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._not_before = 0.0
 
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
 
-def post_to_slack(payload_text):
-    if _have_requests:
+    def available(self):
+        """Posts that can go out right now without waiting."""
+        if time.monotonic() < self._not_before:
+            return 0
+        self._refill()
+        return int(self._tokens)
+
+    def _take_token(self):
+        while True:
+            now = time.monotonic()
+            if now < self._not_before:
+                time.sleep(self._not_before - now)
+                continue
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            time.sleep((1 - self._tokens) / self.rate)
+
+    def _send(self, body):
+        with p4metrics.timed("slack", "post") as call:
+            call["nbytes"] = len(body)
+            resp, reply = self._request(body)
+            call["error"] = resp.status != 200
+        return resp, reply
+
+    def _request(self, body):
+        if self._conn is None:
+            self._conn = self._connection_type(self._netloc, timeout=self.timeout)
         try:
-            requests.post(webhook_url, json={"text": payload_text}, timeout=8)
-            return True
-        except Exception as e:
-            print(f"Failed to post to Slack (requests): {e}", file=sys.stderr)
+            self._conn.request("POST", self._path, body=body, headers={"Content-Type": "application/json"})
+            resp = self._conn.getresponse()
+            reply = resp.read()
+        except (OSError, http.client.HTTPException):
+            self._conn.close()
+            self._conn = None
+            raise
+        if resp.getheader("Connection", "").lower() == "close":
+            self._conn.close()
+            self._conn = None
+        return resp, reply
+
+    def post(self, text):
+        """Post one message, honoring the rate limit; True once Slack accepts it.
+
+        False means it may go through later (network errors, 429s, 5xx).
+        Raises SlackRejected when Slack refuses the message itself.
+        """
+        body = json.dumps({"text": text}).encode("utf-8")
+        for attempt in range(self.attempts):
+            self._take_token()
+            try:
+                resp, reply = self._send(body)
+            except (OSError, http.client.HTTPException) as e:
+                # A kept-alive connection may have been closed by the server; reconnect once more.
+                print(f"Failed to post to Slack: {e}", file=sys.stderr)
+                continue
+            if resp.status == 200:
+                return True
+            if resp.status == 429:
+                try:
+                    delay = float(resp.getheader("Retry-After", "1"))
+                except ValueError:
+                    delay = 1.0
+                self._not_before = time.monotonic() + delay
+                print(f"Slack rate limited; waiting {delay}s", file=sys.stderr)
+                continue
+            if 400 <= resp.status < 500 and resp.status != 408:
+                raise SlackRejected(resp.status, reply[:200].decode("utf-8", "replace").strip())
+            print(f"Failed to post to Slack: HTTP {resp.status}", file=sys.stderr)
             return False
-    else:
-        data = json.dumps({"text": payload_text}).encode("utf-8")
-        req = Request(webhook_url, data=data, headers={"Content-Type": "application/json"})
+        return False
+
+    def digest(self, messages):
+        return f"*{len(messages)} changelists submitted:*\n\n" + "\n".join(messages)
+
+    def post_many(self, messages, on_delivered=None, on_rejected=None):
+        """Post messages in order and return how many were settled.
+
+        When more messages are waiting than tokens are available, they are
+        merged into digests of up to DIGEST_SIZE messages. A rejected digest
+        is retried one message at a time, so only the message Slack refuses
+        is passed to on_rejected(index, error) and skipped; it counts as
+        settled. on_delivered is called with the running count of settled
+        messages after each post.
+        """
+        if len(messages) <= max(self.available(), 1):
+            groups = [[message] for message in messages]
+        else:
+            groups = [[]]
+            size = 0
+            for message in messages:
+                if groups[-1] and (len(groups[-1]) >= self.DIGEST_SIZE or size + len(message) > self.DIGEST_CHARS):
+                    groups.append([])
+                    size = 0
+                groups[-1].append(message)
+                size += len(message) + 1
+        settled = 0
+        index = 0
+        while index < len(groups):
+            group = groups[index]
+            try:
+                delivered = self.post(group[0] if len(group) == 1 else self.digest(group))
+            except SlackRejected as e:
+                if len(group) > 1:
+                    # Find the message Slack refuses by posting the digest's messages one at a time.
+                    groups[index:index + 1] = [[message] for message in group]
+                    continue
+                self._rejected(settled, e, on_rejected)
+                delivered = True
+            if not delivered:
+                break
+            settled += len(group)
+            if on_delivered:
+                on_delivered(settled)
+            index += 1
+        return settled
+
+    def _rejected(self, index, error, on_rejected):
+        print(f"Slack rejected message {index + 1} of the batch: {error}; skipping it", file=sys.stderr)
+        if on_rejected:
+            on_rejected(index, error)
+
+
+# ---- Spool: the trigger appends, the forwarder drains
+
+def spool_append(spool_path, change, user):
+    """Append one submit to the spool and fsync it before returning."""
+    line = json.dumps({"change": change, "user": user}) + "\n"
+    fd = os.open(spool_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+    try:
+        # Shared lock: triggers append concurrently (O_APPEND keeps lines whole);
+        # the forwarder takes it exclusively to truncate.
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        os.write(fd, line.encode("utf-8"))
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def read_offset(offset_path):
+    try:
+        return int(Path(offset_path).read_text().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def write_offset(offset_path, offset):
+    """Atomically record how far into the spool has been delivered."""
+    tmp_path = f"{offset_path}.tmp"
+    with open(tmp_path, "w") as fh:
+        fh.write(f"{offset}\n")
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp_path, offset_path)
+
+
+def read_spool(spool_path, offset, limit):
+    """Return up to 'limit' (entry, end_offset) pairs of complete lines after 'offset'.
+
+    Malformed lines come back as (None, end_offset) so the caller can step past them.
+    """
+    entries = []
+    try:
+        fh = open(spool_path, "rb")
+    except FileNotFoundError:
+        return entries
+    with fh:
+        fh.seek(offset)
+        for raw in fh:
+            if not raw.endswith(b"\n"):
+                # A trigger is mid-write; pick it up next pass.
+                break
+            offset += len(raw)
+            try:
+                entry = json.loads(raw)
+            except ValueError:
+                print(f"Skipping malformed spool line: {raw!r}", file=sys.stderr)
+                entry = None
+            entries.append((entry, offset))
+            if len(entries) >= limit:
+                break
+    return entries
+
+
+def dead_letter(path, entry, error):
+    """Append a submit Slack refused to path, as a spool line with the reason.
+
+    Once the cause is fixed, the lines can be appended to the spool again.
+    """
+    line = json.dumps(dict(entry, status=error.status, error=error.reason, rejected_at=int(time.time()))) + "\n"
+    with open(path, "a", encoding="utf-8") as fh:
+        fh.write(line)
+
+
+def compact_spool(spool_path, offset_path, offset):
+    """Truncate a fully delivered spool so it does not grow forever."""
+    if offset == 0:
+        return offset
+    try:
+        fd = os.open(spool_path, os.O_WRONLY)
+    except FileNotFoundError:
+        return offset
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        if os.fstat(fd).st_size != offset:
+            return offset
+        os.ftruncate(fd, 0)
+        os.fsync(fd)
+        write_offset(offset_path, 0)
+        return 0
+    finally:
+        os.close(fd)
+
+
+def forward(spool_path, delivery, interval, batch, checkpoint_path=None, deadline=DEFAULT_DEADLINE):
+    """Drain the spool forever, posting each submit in order and retrying failures.
+
+    With checkpoint_path, delivered changes are recorded for the reconciler.
+    Each batch's p4 calls get deadline seconds. A batch whose describe times
+    out, or that arrives while P4_BREAKER is open, stays in the spool until
+    Perforce answers again, so it is posted with its descriptions. A submit
+    Slack rejects outright goes to <spool>.dead and is stepped past, so it
+    cannot hold up the ones behind it.
+    """
+    offset_path = f"{spool_path}.offset"
+    offset = read_offset(offset_path)
+    backoff = 0
+    while True:
         try:
-            with urlopen(req, timeout=5) as resp:
-                resp.read()
-            return True
-        except (HTTPError, URLError) as e:
-            print(f"Failed to post to Slack (urllib): {e}", file=sys.stderr)
-            return False
+            if offset > os.path.getsize(spool_path):
+                offset = 0
+        except FileNotFoundError:
+            offset = 0
+        entries = read_spool(spool_path, offset, batch)
+        if not entries:
+            offset = compact_spool(spool_path, offset_path, offset)
+            time.sleep(interval)
+            continue
+        changes = [str(entry.get("change", "")) for entry, _ in entries if entry]
+        posts = []
+        try:
+            with p4guard.deadline(deadline):
+                descriptions = get_descriptions(changes)
+                for entry, end_offset in entries:
+                    if entry is None:
+                        continue
+                    change = str(entry.get("change", ""))
+                    desc = descriptions.get(change) or get_description_from_change_spec(change)
+                    posts.append((format_message(change, entry.get("user", "unknown"), desc), end_offset, change, entry))
+        except (p4guard.DeadlineExceeded, p4guard.CircuitOpen) as e:
+            print(f"Holding {len(entries)} spooled submits: {e}", file=sys.stderr)
+            # While the breaker is open nothing changes before its next probe.
+            time.sleep(P4_BREAKER.cooldown if isinstance(e, p4guard.CircuitOpen) else interval)
+            continue
+
+        recorded = 0
+
+        def delivered_through(count):
+            nonlocal offset, recorded
+            if checkpoint_path:
+                record_delivered(checkpoint_path, [change for _, _, change, _ in posts[recorded:count]])
+                recorded = count
+            # Malformed lines after the last post are skipped along with it.
+            offset = posts[count - 1][1] if count < len(posts) else entries[-1][1]
+            write_offset(offset_path, offset)
+
+        def rejected(index, error):
+            dead_letter(f"{spool_path}.dead", posts[index][3], error)
+
+        if not posts:
+            delivered_through(0)
+            continue
+        if delivery.post_many([post[0] for post in posts], delivered_through, rejected) < len(posts):
+            backoff = min(max(backoff * 2, 1), 300)
+            print(f"Retrying undelivered changelists in {backoff}s", file=sys.stderr)
+            time.sleep(backoff)
+        else:
+            backoff = 0
+
+
+# ---- Reconciler: find submits whose notification never went out
+
+def record_delivered(checkpoint_path, changes):
+    """Note changes the trigger or forwarder delivered, so reconcile() skips them.
+
+    The post has already gone out, so a file that cannot be written is only
+    logged; the reconciler may then post those changes a second time.
+    """
+    if not changes:
+        return
+    try:
+        fd = os.open(f"{checkpoint_path}.delivered", os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            os.write(fd, "".join(f"{change}\n" for change in changes).encode("utf-8"))
+        finally:
+            os.close(fd)
+    except OSError as e:
+        print(f"Could not record delivered changelists for the reconciler: {e}", file=sys.stderr)
+
+
+def read_delivered(checkpoint_path):
+    try:
+        with open(f"{checkpoint_path}.delivered", encoding="utf-8") as fh:
+            return {int(line) for line in fh if line.strip().isdigit()}
+    except FileNotFoundError:
+        return set()
+
+
+def prune_delivered(checkpoint_path, through):
+    """Drop delivered entries at or below the checkpoint; they are settled."""
+    path = f"{checkpoint_path}.delivered"
+    try:
+        fd = os.open(path, os.O_RDWR)
+    except FileNotFoundError:
+        return
+    try:
+        # Exclusive lock: no trigger appends while the file is rewritten in place.
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        with os.fdopen(os.dup(fd), "r+", encoding="utf-8") as fh:
+            keep = [line for line in fh if line.strip().isdigit() and int(line) > through]
+            fh.seek(0)
+            fh.truncate()
+            fh.writelines(keep)
+    finally:
+        os.close(fd)
+
+
+def spooled_changes(spool_path):
+    """Changes waiting in the spool past the forwarder's offset."""
+    if not spool_path:
+        return set()
+    offset = read_offset(f"{spool_path}.offset")
+    try:
+        if offset > os.path.getsize(spool_path):
+            offset = 0
+    except FileNotFoundError:
+        return set()
+    changes = set()
+    for entry, _ in read_spool(spool_path, offset, sys.maxsize):
+        if entry and str(entry.get("change", "")).isdigit():
+            changes.add(int(entry["change"]))
+    return changes
+
+
+def reconcile(delivery, checkpoint_path, path="//...", settle=120, batch=200, spool_path=None):
+    """Post submits above the checkpoint that were never notified; return the count.
+
+    One 'p4 changes -l -s submitted path@N+1,@now' call lists everything since
+    the last run. Changes younger than settle seconds are left for their
+    trigger. Changes the trigger or forwarder recorded as delivered are
+    skipped; the rest go out in order through post_many(), which folds a
+    large backlog into digests. The checkpoint advances past each change as
+    it is settled; a change Slack rejects is written to <checkpoint>.dead. A first run only records the newest submitted change.
+
+    A change still waiting in spool_path belongs to the forwarder, however
+    long it has been held: the run stops short of it, and a later run
+    settles it once the forwarder has recorded it as delivered. The spool is
+    read before the delivered list because the forwarder records a change
+    as delivered before moving its offset past it.
+    """
+    lock = open(f"{checkpoint_path}.lock", "w")
+    try:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print("Another reconciler is running", file=sys.stderr)
+            return 0
+        through = read_offset(checkpoint_path)
+        if not through:
+            newest = run_p4_marshal("changes", "-m", "1", "-s", "submitted", path)
+            write_offset(checkpoint_path, int(newest[0]["change"]) if newest else 0)
+            return 0
+        records = run_p4_marshal("changes", "-l", "-s", "submitted", f"{path}@{through + 1},@now")
+        cutoff = time.time() - settle
+        spooled = spooled_changes(spool_path)
+        settled = []
+        for record in sorted(records, key=lambda record: int(record["change"])):
+            if int(record.get("time") or 0) > cutoff or int(record["change"]) in spooled:
+                break
+            settled.append(record)
+            if len(settled) >= batch:
+                break
+        if not settled:
+            return 0
+        delivered = read_delivered(checkpoint_path)
+        missed = [record for record in settled if int(record["change"]) not in delivered]
+
+        def delivered_through(count):
+            # Everything below the next undelivered change is settled.
+            if count < len(missed):
+                write_offset(checkpoint_path, int(missed[count]["change"]) - 1)
+            else:
+                write_offset(checkpoint_path, int(settled[-1]["change"]))
+
+        rejects = []
+
+        def rejected(index, error):
+            rejects.append(index)
+            record = missed[index]
+            dead_letter(f"{checkpoint_path}.dead", {"change": record["change"], "user": record.get("user")}, error)
+
+        delivered_through(0)
+        posted = 0
+        if missed:
+            messages = [format_message(record["change"], record.get("user", "unknown"), record.get("desc", "").strip())
+                        for record in missed]
+            posted = delivery.post_many(messages, delivered_through, rejected) - len(rejects)
+        prune_delivered(checkpoint_path, read_offset(checkpoint_path))
+        return posted
+    finally:
+        lock.close()
+
+
+def notify(delivery, change, user, checkpoint_path=None):
+    """Post one submit directly (the original synchronous trigger path).
+
+    The submit is posted without its description if Perforce does not
+    answer within the deadline or P4_BREAKER is open; a trigger cannot wait.
+    """
+    # Optional: preflight (helps logs if ticket missing/expired but doesn't fail hard)
+    try:
+        run_p4(p4_cmd("login", "-s"),
+               stdout=subprocess.DEVNULL,
+               stderr=subprocess.DEVNULL,
+               check=False)
+    except Exception:
+        pass
+    try:
+        commit_message = get_description_from_describe(change)
+        if not commit_message:
+            commit_message = get_description_from_change_spec(change)
+    except (p4guard.DeadlineExceeded, p4guard.CircuitOpen) as e:
+        print(f"Posting {change} without its description: {e}", file=sys.stderr)
+        commit_message = None
+    try:
+        delivered = delivery.post(format_message(change, user, commit_message))
+    except SlackRejected as e:
+        # Left to the reconciler, which dead-letters it if Slack refuses it again.
+        print(f"Slack rejected the notification for {change}: {e}", file=sys.stderr)
+        return
+    if delivered and checkpoint_path:
+        record_delivered(checkpoint_path, [change])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Post Perforce submits to Slack")
+    parser.add_argument("change", nargs="?")
+    parser.add_argument("user", nargs="?")
+    parser.add_argument("--spool", action="store_true",
+                        help="Only append the submit to the spool file and exit (trigger mode)")
+    parser.add_argument("--forward", action="store_true",
+                        help="Run forever, draining the spool to Slack")
+    parser.add_argument("--spool-file", default=os.environ.get("SUBMIT_SLACK_SPOOL", DEFAULT_SPOOL),
+                        help="Spool path (default: $SUBMIT_SLACK_SPOOL or submit-slack.spool next to this script)")
+    parser.add_argument("--interval", type=float, default=2.0,
+                        help="Forwarder poll interval in seconds when the spool is empty")
+    parser.add_argument("--batch", type=int, default=50,
+                        help="Changelists described per 'p4 describe' call in the forwarder")
+    parser.add_argument("--rate", type=float, default=1.0,
+                        help="Webhook posts per second (default: 1, Slack's webhook limit)")
+    parser.add_argument("--burst", type=int, default=4,
+                        help="Posts allowed back to back before --rate applies (default: 4)")
+    parser.add_argument("--reconcile", action="store_true",
+                        help="Post any submitted changelists since the checkpoint that were never notified, then exit")
+    parser.add_argument("--checkpoint-file", default=os.environ.get("SUBMIT_SLACK_CHECKPOINT"),
+                        help="Reconciler checkpoint (default: $SUBMIT_SLACK_CHECKPOINT or submit-slack.checkpoint "
+                             "next to this script). The trigger and forwarder record deliveries next to it only "
+                             "when it is set or a reconcile run has created it")
+    parser.add_argument("--path", default="//...",
+                        help="Depot path the reconciler watches (default: //...)")
+    parser.add_argument("--settle", type=float, default=120,
+                        help="Seconds a submit is left to its trigger before the reconciler posts it (default: 120)")
+    parser.add_argument("--deadline", type=float, default=DEFAULT_DEADLINE,
+                        help="Seconds allowed for the p4 calls of one notification, forwarder batch or reconcile run "
+                             f"(default: {DEFAULT_DEADLINE})")
+    parser.add_argument("--metrics-port", type=int,
+                        help="With --forward, serve p4/Slack call metrics on 127.0.0.1:PORT/metrics")
+    args = parser.parse_args()
+
+    if not (args.forward or args.reconcile) and not (args.change and args.user):
+        print("Usage: submit-slack.py [--spool] <change> <user> | --forward | --reconcile", file=sys.stderr)
+        sys.exit(2)
+
+    if args.spool:
+        spool_append(args.spool_file, args.change, args.user)
+        return
+
+    webhook_url = os.environ.get("SLACK_WEBHOOK")
+    if not webhook_url:
+        print("Environment variable SLACK_WEBHOOK is required (no default allowed)", file=sys.stderr)
+        sys.exit(2)
+
+    checkpoint = args.checkpoint_file or DEFAULT_CHECKPOINT
+    # Only sites that reconcile need <checkpoint>.delivered; reconcile() is what prunes it.
+    record_to = checkpoint if args.checkpoint_file or os.path.exists(checkpoint) else None
+    delivery = SlackDelivery(webhook_url, rate=args.rate, burst=args.burst)
+    if args.reconcile:
+        try:
+            with p4guard.deadline(args.deadline):
+                posted = reconcile(delivery, checkpoint, args.path, args.settle,
+                                   spool_path=args.spool_file)
+        except (OSError, RuntimeError, p4guard.DeadlineExceeded, p4guard.CircuitOpen) as e:
+            print(f"Reconcile failed: {e}", file=sys.stderr)
+            sys.exit(1)
+        if posted:
+            print(f"Posted {posted} missed changelists", file=sys.stderr)
+    elif args.forward:
+        if args.metrics_port:
+            p4metrics.METRICS.serve(args.metrics_port, prefix="submit_slack")
+        forward(args.spool_file, delivery, args.interval, args.batch, record_to, args.deadline)
+    else:
+        with p4guard.deadline(args.deadline):
+            notify(delivery, args.change, args.user, record_to)
 
 
-post_to_slack(message)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""Shared setup: the repository's scripts importable, backed by the bench fakes.
+
+The fake p4 executable (bench/bin) and the fake P4 and slack_bolt modules
+(bench/fakes) serve the same small synthetic depot the benchmarks use, so
+no Perforce server or Slack workspace is needed.
+"""
+
+import importlib.util
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+BENCH = ROOT / "bench"
+
+os.environ.setdefault("FAKE_P4_OPENED", "200")
+os.environ.setdefault("FAKE_P4_CHANGES", "300")
+os.environ.setdefault("SLACK_BOT_TOKEN", "xoxb-test")
+os.environ["PATH"] = f"{BENCH / 'bin'}{os.pathsep}{os.environ.get('PATH', '')}"
+for path in (BENCH / "fakes", BENCH, ROOT):
+    sys.path.insert(0, str(path))
+
+
+def load_script(filename: str, name: str):
+    """Import a script whose file name is not a module name (``submit-slack.py``)."""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, ROOT / filename)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope="session")
+def submit_slack():
+    return load_script("submit-slack.py", "submit_slack")
+
+
+@pytest.fixture(scope="session")
+def bot():
+    return load_script("slack-files.py", "slack_files")
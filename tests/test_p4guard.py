@@ -0,0 +1,109 @@
+import contextvars
+import threading
+import time
+
+import pytest
+
+import p4guard
+
+
+def test_budget_without_deadline_is_the_timeout():
+    assert p4guard.budget(5) == 5
+    assert p4guard.budget() is None
+
+
+def test_budget_is_cut_to_the_deadline():
+    with p4guard.deadline(1):
+        assert p4guard.budget(60) <= 1
+        assert p4guard.budget(0.5) == 0.5
+
+
+def test_nested_deadline_only_shortens():
+    with p4guard.deadline(0.2):
+        with p4guard.deadline(60):
+            assert p4guard.remaining() <= 0.2
+    assert p4guard.remaining() is None
+
+
+def test_expired_deadline_raises():
+    with p4guard.deadline(0.01):
+        time.sleep(0.02)
+        assert p4guard.expired()
+        with pytest.raises(p4guard.DeadlineExceeded):
+            p4guard.budget(5)
+
+
+def test_deadline_follows_a_copied_context():
+    seen = []
+    with p4guard.deadline(1):
+        context = contextvars.copy_context()
+    thread = threading.Thread(target=context.run, args=(lambda: seen.append(p4guard.remaining()),))
+    thread.start()
+    thread.join()
+    assert seen[0] is not None and 0 < seen[0] <= 1
+
+
+def test_guard_errors_are_not_oserrors():
+    # "except OSError" around a p4 run must not swallow them.
+    assert not issubclass(p4guard.DeadlineExceeded, OSError)
+    assert not issubclass(p4guard.CircuitOpen, OSError)
+
+
+def test_unreachable_messages():
+    assert p4guard.unreachable("Perforce client error:\n\tConnect to server failed; check $P4PORT.")
+    assert not p4guard.unreachable("File(s) not opened anywhere.")
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = p4guard.CircuitBreaker(failures=3, cooldown=60)
+    for _ in range(2):
+        breaker.check()
+        breaker.failure("timed out")
+    breaker.check()
+    breaker.failure("timed out")
+    assert breaker.state == "open"
+    with pytest.raises(p4guard.CircuitOpen):
+        breaker.check()
+    assert breaker.stats()["rejected"] == 1
+    assert breaker.stats()["opened"] == 1
+
+
+def test_success_resets_the_failure_count():
+    breaker = p4guard.CircuitBreaker(failures=2, cooldown=60)
+    breaker.failure("timed out")
+    breaker.success()
+    breaker.failure("timed out")
+    assert breaker.state == "closed"
+
+
+def test_half_open_probe_closes_the_breaker():
+    probes = []
+    breaker = p4guard.CircuitBreaker(failures=1, cooldown=0.01, probe=lambda: probes.append(1) or True)
+    breaker.failure("timed out")
+    time.sleep(0.02)
+    assert breaker.state == "half-open"
+    breaker.check()
+    assert probes == [1]
+    assert breaker.state == "closed"
+
+
+def test_failed_probe_keeps_the_breaker_open():
+    breaker = p4guard.CircuitBreaker(failures=1, cooldown=0.01, probe=lambda: False)
+    breaker.failure("timed out")
+    time.sleep(0.02)
+    with pytest.raises(p4guard.CircuitOpen):
+        breaker.check()
+    assert breaker.state == "open"
+    assert breaker.stats()["opened"] == 1
+
+
+def test_without_a_probe_the_next_call_is_the_trial():
+    breaker = p4guard.CircuitBreaker(failures=1, cooldown=0.01)
+    breaker.failure("timed out")
+    time.sleep(0.02)
+    breaker.check()
+    # Others fail fast while the trial call runs.
+    with pytest.raises(p4guard.CircuitOpen):
+        breaker.check()
+    breaker.failure("timed out")
+    assert breaker.state == "open"
@@ -0,0 +1,111 @@
+import datetime as _dt
+
+import pytest
+
+import p4history
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = p4history.connect(str(tmp_path / "history.db"))
+    yield db
+    db.close()
+
+
+def report(when, opened=(), conflicts=0, **metadata):
+    """A p4status report taken at ``when`` with (file, client, locked) opens."""
+    return {
+        "metadata": {"path": "//depot/...", "generated_at": when.isoformat(), **metadata},
+        "opened_files": [
+            {"file": file, "client": client, "user": client.split("-")[0], "action": "edit", "change": "default",
+             "locked": locked}
+            for file, client, locked in opened
+        ],
+        "opened_conflicts": [{"file": f"//depot/c{i}"} for i in range(conflicts)],
+        "pending_changes": {"total": 0},
+        "shelved_changes": {"total": None},
+        "errors": {},
+    }
+
+
+def at(day, hour=12):
+    return _dt.datetime.combine(day, _dt.time(hour), tzinfo=_dt.timezone.utc)
+
+
+TODAY = _dt.datetime.now(tz=_dt.timezone.utc).date()
+
+
+def spans(db):
+    return [tuple(row) for row in db.execute("SELECT file, locked, start, end FROM spans ORDER BY file, start")]
+
+
+def test_only_changes_start_or_close_spans(db):
+    t0, t1, t2 = (at(TODAY, hour) for hour in (1, 2, 3))
+    stats = p4history.record(db, report(t0, [("//a", "alice-ws", False), ("//b", "bob-ws", False)]))
+    assert (stats["spans_started"], stats["spans_closed"]) == (2, 0)
+    stats = p4history.record(db, report(t1, [("//a", "alice-ws", False), ("//b", "bob-ws", False)]))
+    assert (stats["spans_started"], stats["spans_closed"]) == (0, 0)
+    # //a gets locked (a new span), //b is reverted.
+    stats = p4history.record(db, report(t2, [("//a", "alice-ws", True)]))
+    assert (stats["spans_started"], stats["spans_closed"]) == (1, 2)
+    assert spans(db) == [
+        ("//a", 0, t0.timestamp(), t2.timestamp()),
+        ("//a", 1, t2.timestamp(), None),
+        ("//b", 0, t0.timestamp(), t2.timestamp()),
+    ]
+
+
+def test_filtered_reports_are_refused(db):
+    p4history.record(db, report(at(TODAY, 1), [("//a", "alice-ws", False), ("//b", "bob-ws", False)]))
+    with pytest.raises(ValueError):
+        p4history.record(db, report(at(TODAY, 2), [("//a", "alice-ws", False)], filters={"user": "alice"}))
+    # bob's checkout did not end.
+    assert db.execute("SELECT COUNT(*) FROM spans WHERE end IS NULL").fetchone()[0] == 2
+
+
+def test_another_path_is_refused(db):
+    p4history.record(db, report(at(TODAY, 1)))
+    other = report(at(TODAY, 2))
+    other["metadata"]["path"] = "//other/..."
+    with pytest.raises(ValueError):
+        p4history.record(db, other)
+
+
+def test_failed_and_stale_reports_are_skipped(db):
+    p4history.record(db, report(at(TODAY, 2), [("//a", "alice-ws", False)]))
+    failed = report(at(TODAY, 3))
+    failed["errors"]["opened"] = {"stderr": "timed out"}
+    assert "skipped" in p4history.record(db, failed)
+    assert "skipped" in p4history.record(db, report(at(TODAY, 1)))
+    assert db.execute("SELECT COUNT(*) FROM spans WHERE end IS NULL").fetchone()[0] == 1
+
+
+def test_old_snapshots_survive_in_the_daily_rollup(db):
+    old = TODAY - _dt.timedelta(days=10)
+    p4history.record(db, report(at(old), [("//a", "alice-ws", False)]))
+    stats = p4history.record(db, report(at(TODAY), [("//a", "alice-ws", False)]))
+    assert stats["snapshots_dropped"] == 1
+    assert db.execute("SELECT COUNT(*) FROM daily").fetchone()[0] == 2
+    opens = p4history.user_opens(db, days=30, user="alice")
+    assert [(row["day"], row["opened_max"]) for row in opens] == [(old.isoformat(), 1), (TODAY.isoformat(), 1)]
+
+
+def test_lock_durations(db):
+    start = at(TODAY - _dt.timedelta(days=1))
+    p4history.record(db, report(start, [("//a", "alice-ws", True)]))
+    p4history.record(db, report(start + _dt.timedelta(hours=6), []))
+    assert [(row["user"], row["locks"], row["held"], row["max_hours"]) for row in p4history.lock_durations(db)] == [
+        ("alice", 1, 0, 6.0),
+    ]
+
+
+def test_weekly_conflicts_use_iso_weeks(db):
+    # Sunday 29 December 2024 ends ISO week 52; Monday the 30th starts week 1 of 2025.
+    p4history.record(db, report(at(_dt.date(2024, 12, 29)), conflicts=4))
+    p4history.record(db, report(at(_dt.date(2024, 12, 30)), conflicts=2))
+    p4history.record(db, report(at(_dt.date(2025, 1, 1)), conflicts=0))
+    weeks = p4history.weekly_conflicts(db, weeks=100_000)
+    assert [(row["week"], row["conflicts_max"], row["conflicts_avg"]) for row in weeks] == [
+        ("2024-W52", 4, 4.0),
+        ("2025-W01", 2, 1.0),
+    ]
@@ -0,0 +1,154 @@
+import pytest
+
+import p4index
+import p4status
+
+
+class FakeBackend(p4status.P4Backend):
+    """Serves ``opened`` and ``changes`` from lists that a test edits between refreshes."""
+
+    def __init__(self):
+        super().__init__()
+        self.opened = []
+        self.changes = {}
+        self.counter = 0
+        self.calls = []
+
+    def open(self, file, client, action="edit", locked=False):
+        record = {"depotFile": file, "client": client, "user": client.split("-")[0], "action": action, "change": "default"}
+        if locked:
+            record["ourLock"] = ""
+        self.opened.append(record)
+
+    def submit(self, n, status="submitted", desc=""):
+        self.changes[n] = (status, desc or f"change {n}")
+        self.counter = max(self.counter, n)
+
+    def stream(self, args, limit=None):
+        self.calls.append(args)
+        if args[0] == "counter":
+            yield {"value": str(self.counter)}
+        elif args[0] == "info":
+            yield {"serverAddress": "p4:1666", "userName": "bot"}
+        elif args[0] == "opened":
+            yield from self.opened
+        elif args[0] == "changes":
+            status = args[args.index("-s") + 1]
+            low = int(args[-1].split("@")[1].split(",")[0]) if "@" in args[-1] else 0
+            for n in sorted(self.changes, reverse=True):
+                if self.changes[n][0] == status and n >= low:
+                    yield {"change": str(n), "user": "alice", "client": "alice-ws", "time": str(1_700_000_000 + n),
+                           "desc": self.changes[n][1], "status": status}
+        elif args[0] == "describe":
+            for n in args[2:]:
+                yield {"change": n, "depotFile0": f"//depot/src/file{n}.cpp"}
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = p4index.connect(str(tmp_path / "index.db"))
+    yield db
+    db.close()
+
+
+def test_refresh_opened_writes_only_the_difference(db):
+    backend = FakeBackend()
+    backend.open("//depot/a", "alice-ws")
+    backend.open("//depot/b", "bob-ws")
+    assert p4index.refresh(db, backend, "//depot/...")["opened_upserted"] == 2
+
+    stats = p4index.refresh(db, backend, "//depot/...")
+    assert (stats["opened_upserted"], stats["opened_removed"]) == (0, 0)
+
+    backend.opened[0]["ourLock"] = ""
+    backend.opened.pop(1)
+    backend.open("//depot/c", "carol-ws")
+    stats = p4index.refresh(db, backend, "//depot/...")
+    assert (stats["opened_upserted"], stats["opened_removed"]) == (2, 1)
+    rows = p4index.query_opened(db)
+    assert [(row["file"], row["locked"]) for row in rows] == [("//depot/a", 1), ("//depot/c", 0)]
+
+
+def test_submitted_changes_are_fetched_incrementally(db):
+    backend = FakeBackend()
+    for n in (1, 2, 3):
+        backend.submit(n)
+    assert p4index.refresh(db, backend, "//depot/...")["submitted_added"] == 3
+    # No new change, no submitted query.
+    backend.calls = []
+    assert "submitted_added" not in p4index.refresh(db, backend, "//depot/...")
+    assert not any("submitted" in args for args in backend.calls)
+
+    backend.submit(4)
+    assert p4index.refresh(db, backend, "//depot/...")["submitted_added"] == 1
+    assert ["changes", "-l", "-s", "submitted", "//depot/...@4,@now"] in backend.calls
+
+
+def test_pending_is_refetched_when_the_counter_moves_or_ages(db, monkeypatch):
+    backend = FakeBackend()
+    backend.submit(10, status="pending")
+    assert p4index.refresh(db, backend, "//depot/...")["pending"] == 1
+    # Deleting a pending change leaves the counter alone.
+    del backend.changes[10]
+    stats = p4index.refresh(db, backend, "//depot/...")
+    assert "pending" not in stats
+    assert p4index.count_changes(db, "pending") == 1
+
+    now = p4index.time.time()
+    monkeypatch.setattr(p4index.time, "time", lambda: now + p4index.DEFAULT_CHANGES_MAX_AGE)
+    assert p4index.refresh(db, backend, "//depot/...")["pending"] == 0
+
+    backend.submit(11, status="shelved")
+    assert p4index.refresh(db, backend, "//depot/...")["shelved"] == 1
+
+
+def test_refresh_refuses_another_path(db):
+    p4index.refresh(db, FakeBackend(), "//depot/...")
+    with pytest.raises(ValueError):
+        p4index.refresh(db, FakeBackend(), "//other/...")
+
+
+def test_read_report_totals_are_exact(db):
+    backend = FakeBackend()
+    for n in range(1, 31):
+        backend.submit(n, status="pending" if n % 10 == 0 else "submitted")
+    backend.open("//depot/a", "alice-ws")
+    backend.open("//depot/a", "bob-ws")
+    p4index.refresh(db, backend, "//depot/...")
+
+    report = p4index.read_report(db, "//depot/...", limit=5)
+    assert report["submitted_changes"]["total"] == 27
+    assert report["submitted_changes"]["has_more"] is True
+    assert [item["change"] for item in report["submitted_changes"]["items"]] == ["29", "28", "27", "26", "25"]
+    assert report["pending_changes"] == {"total": 3, "items": report["pending_changes"]["items"], "has_more": False}
+    assert [conflict["file"] for conflict in report["opened_conflicts"]] == ["//depot/a"]
+    assert p4index.count_changes(db, "submitted", user="nobody") == 0
+
+
+def test_read_report_before_the_first_refresh(db):
+    report = p4index.read_report(db, "//depot/...", limit=5)
+    assert "index" in report["errors"]
+
+
+def test_read_report_on_another_path_has_no_changes(db):
+    backend = FakeBackend()
+    backend.submit(2)
+    backend.open("//depot/sub/a", "alice-ws")
+    backend.open("//depot/b", "alice-ws")
+    p4index.refresh(db, backend, "//depot/...")
+    report = p4index.read_report(db, "//depot/sub/...", limit=5)
+    assert [entry["file"] for entry in report["opened_files"]] == ["//depot/sub/a"]
+    assert report["submitted_changes"]["total"] == 0
+    assert set(report["errors"]) == {"pending", "submitted", "shelved"}
+
+
+def test_search_ranks_rare_terms(db):
+    backend = FakeBackend()
+    backend.submit(1, desc="fix lighting bug")
+    backend.submit(2, desc="fix build")
+    backend.submit(3, desc="fix build again")
+    p4index.refresh(db, backend, "//depot/...", with_search=True)
+    assert [result["change"] for result in p4index.search(db, "fix")] == ["3", "2", "1"]
+    assert [result["change"] for result in p4index.search(db, "lighting fix")] == ["1"]
+    assert [result["change"] for result in p4index.search(db, "file2")] == ["2"]
+    assert p4index.search(db, "missing") == []
@@ -0,0 +1,236 @@
+import io
+import time
+
+import pytest
+
+import p4status
+
+
+class FakeBackend(p4status.P4Backend):
+    """Serves ``changes`` from a list of numbers and ``counter change`` from ``counter``."""
+
+    def __init__(self, changes, counter=100, port="ssl:p4:1666"):
+        super().__init__(port=port)
+        self.changes = changes
+        self.counter = counter
+        self.calls = []
+
+    def stream(self, args, limit=None):
+        self.calls.append(args)
+        if args[:2] == ["counter", "change"]:
+            yield {"counter": "change", "value": str(self.counter)}
+            return
+        rows = [
+            {"change": str(n), "user": "alice", "client": "ws", "time": str(1_700_000_000 + n), "desc": f"change {n}"}
+            for n in self.changes
+        ]
+        if "-m" in args:
+            rows = rows[:int(args[args.index("-m") + 1])]
+        yield from rows
+
+    def queries(self):
+        return [args for args in self.calls if args[0] == "changes"]
+
+
+# ---- totals
+
+def test_total_is_exact_when_everything_fits():
+    section = p4status.fetch_changes_section(FakeBackend([3, 2, 1]), "submitted", "//depot/...", 5)
+    assert section["total"] == 3
+    assert section["has_more"] is False
+
+
+def test_total_is_unknown_past_the_limit():
+    backend = FakeBackend(list(range(20, 0, -1)))
+    section = p4status.fetch_changes_section(backend, "submitted", "//depot/...", 5)
+    assert section["total"] is None
+    assert section["has_more"] is True
+    assert len(section["items"]) == 5
+    assert len(backend.queries()) == 1
+
+
+def test_exact_totals_counts_the_full_list():
+    backend = FakeBackend(list(range(20, 0, -1)))
+    section = p4status.fetch_changes_section(backend, "submitted", "//depot/...", 5, exact_totals=True)
+    assert section["total"] == 20
+    assert len(section["items"]) == 5
+
+
+# ---- ReportCache
+
+def cached(cache, backend, status="submitted"):
+    return p4status.fetch_changes_section(backend, status, "//depot/...", 5, cache=cache)
+
+
+def test_cache_hit_while_the_counter_holds(tmp_path):
+    path = str(tmp_path / "cache.json")
+    backend = FakeBackend([3, 2, 1])
+    first = p4status.ReportCache(path)
+    cached(first, backend)
+    first.save()
+    assert first.metadata()["sections"] == {"submitted": "miss"}
+
+    second = p4status.ReportCache(path)
+    assert cached(second, backend) == cached(first, backend)
+    assert second.metadata() == {"counter": 100, "sections": {"submitted": "hit"}}
+    assert len(backend.queries()) == 2
+
+
+def test_cache_misses_when_the_counter_moves(tmp_path):
+    path = str(tmp_path / "cache.json")
+    backend = FakeBackend([3, 2, 1])
+    cache = p4status.ReportCache(path)
+    cached(cache, backend)
+    cache.save()
+    backend.changes, backend.counter = [4, 3, 2, 1], 101
+    cache = p4status.ReportCache(path)
+    assert cached(cache, backend)["total"] == 4
+    assert cache.status == {"submitted": "miss"}
+
+
+def test_cache_entries_expire(tmp_path, monkeypatch):
+    path = str(tmp_path / "cache.json")
+    backend = FakeBackend([3, 2, 1])
+    cache = p4status.ReportCache(path, max_age=60)
+    cached(cache, backend)
+    cache.save()
+    now = time.time()
+    monkeypatch.setattr(p4status.time, "time", lambda: now + 61)
+    cache = p4status.ReportCache(path, max_age=60)
+    cached(cache, backend)
+    assert cache.status == {"submitted": "miss"}
+
+
+def test_pending_is_never_cached(tmp_path):
+    cache = p4status.ReportCache(str(tmp_path / "cache.json"))
+    cached(cache, FakeBackend([3]), status="pending")
+    assert cache.status == {}
+    cache.save()
+    assert not (tmp_path / "cache.json").exists()
+
+
+def test_save_merges_and_drops_older_counters(tmp_path):
+    path = str(tmp_path / "cache.json")
+    old = p4status.ReportCache(path)
+    cached(old, FakeBackend([1], counter=100))
+    old.save()
+    other = p4status.ReportCache(path)
+    cached(other, FakeBackend([1], counter=7, port="other:1666"))
+    other.save()
+    new = p4status.ReportCache(path)
+    cached(new, FakeBackend([2, 1], counter=101))
+    new.save()
+    entries = p4status.ReportCache(path)._entries.values()
+    assert sorted((entry["port"], entry["counter"]) for entry in entries) == [("other:1666", 7), ("ssl:p4:1666", 101)]
+
+
+def test_no_counter_means_no_caching(tmp_path):
+    class Broken(FakeBackend):
+        def stream(self, args, limit=None):
+            if args[0] == "counter":
+                raise p4status.P4CommandError({"error": "no permission"})
+            yield from super().stream(args, limit)
+
+    cache = p4status.ReportCache(str(tmp_path / "cache.json"))
+    cached(cache, Broken([1]))
+    cache.save()
+    assert cache.metadata()["error"] == {"error": "no permission"}
+    assert not (tmp_path / "cache.json").exists()
+
+
+# ---- merge_reports
+
+def report(path, opened=(), submitted=()):
+    empty = {"total": 0, "items": [], "has_more": False}
+    items = [{"change": str(n), "user": "alice", "client": "ws", "time_epoch": n} for n in submitted]
+    return {
+        "metadata": {"path": path, "server": "p4:1666"},
+        "opened_files": [{"file": file, "client": client, "user": user, "action": "edit", "change": "default"}
+                         for file, client, user in opened],
+        "opened_conflicts": [],
+        "pending_changes": dict(empty),
+        "submitted_changes": {"total": len(items), "items": items, "has_more": False},
+        "shelved_changes": dict(empty),
+        "errors": {},
+    }
+
+
+def test_merge_drops_duplicates_and_sums_totals():
+    merged = p4status.merge_reports({
+        "master": report("//a/...", opened=[("//a/x", "ws1", "alice")], submitted=[3, 2]),
+        "replica": report("//a/...", opened=[("//a/x", "ws1", "alice")], submitted=[2, 1]),
+    }, limit=10)
+    assert merged["metadata"]["duplicates"] == {"opened": 1, "changes": 1}
+    assert merged["opened_files"][0]["targets"] == ["master", "replica"]
+    assert merged["opened_conflicts"] == []
+    assert [item["change"] for item in merged["submitted_changes"]["items"]] == ["3", "2", "1"]
+    assert merged["submitted_changes"]["total"] == 3
+
+
+def test_merge_total_is_unknown_if_any_target_is():
+    reports = {"a": report("//a/...", submitted=[3]), "b": report("//b/...", submitted=[2])}
+    reports["b"]["submitted_changes"]["total"] = None
+    assert p4status.merge_reports(reports, limit=10)["submitted_changes"]["total"] is None
+
+
+@pytest.mark.parametrize("a_opens, b_opens, conflicts, cross", [
+    # Each target sees one workspace; only the merge shows the conflict.
+    ([("//f", "ws1", "alice")], [("//f", "ws2", "bob")], 1, True),
+    # Both targets see both workspaces (a master and its replica).
+    ([("//f", "ws1", "alice"), ("//f", "ws2", "bob")], [("//f", "ws1", "alice"), ("//f", "ws2", "bob")], 1, False),
+    # The same open seen by both targets is not a conflict.
+    ([("//f", "ws1", "alice")], [("//f", "ws1", "alice")], 0, None),
+])
+def test_merge_conflicts(a_opens, b_opens, conflicts, cross):
+    merged = p4status.merge_reports({"a": report("//a", opened=a_opens), "b": report("//b", opened=b_opens)}, limit=10)
+    assert len(merged["opened_conflicts"]) == conflicts
+    if conflicts:
+        assert merged["opened_conflicts"][0]["cross_target"] is cross
+
+
+# ---- watch diffing
+
+def test_diff_snapshots():
+    old = {"submitted_changes": {"1": {"desc": "a"}, "2": {"desc": "b"}}}
+    new = {"submitted_changes": {"2": {"desc": "b2"}, "3": {"desc": "c"}}}
+    ops = {(event["op"], event["key"]) for event in p4status.diff_snapshots(old, new)}
+    assert ops == {("changed", "2"), ("added", "3"), ("removed", "1")}
+
+
+def test_change_counter():
+    assert p4status.change_counter(FakeBackend([], counter=42)) == 42
+
+    class Broken(FakeBackend):
+        def stream(self, args, limit=None):
+            raise p4status.P4CommandError({"error": "down"})
+            yield
+
+    assert p4status.change_counter(Broken([])) is None
+
+
+def test_watch_fetches_pending_every_poll_and_gates_shelved(monkeypatch):
+    class Quiet(FakeBackend):
+        def stream(self, args, limit=None):
+            if args[0] in ("info", "opened"):
+                self.calls.append(args)
+                return iter(())
+            return super().stream(args, limit)
+
+    class Stop(Exception):
+        pass
+
+    polls = []
+
+    def sleep(seconds):
+        polls.append(seconds)
+        if len(polls) == 3:
+            raise Stop()
+
+    monkeypatch.setattr(p4status.time, "sleep", sleep)
+    backend = Quiet([3, 2, 1])
+    with pytest.raises(Stop):
+        p4status.watch("//depot/...", 5, backend, 10, jobs=1, out=io.StringIO())
+    fetched = [args[args.index("-s") + 1] for args in backend.queries() if "-m" in args and args[-2] != "1"]
+    assert fetched.count("pending") == 3
+    assert fetched.count("shelved") == 1
+    assert fetched.count("submitted") == 1
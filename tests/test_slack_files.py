@@ -0,0 +1,180 @@
+import threading
+
+import pytest
+
+import p4guard
+
+
+def lister(rows, calls=None):
+    """A ``fetch(n)`` over a list, as ``files -m n`` would return it."""
+    def fetch(count):
+        if calls is not None:
+            calls.append(count)
+        return rows[:count]
+    return fetch
+
+
+def same(row):
+    return row
+
+
+# ---- paging
+
+def test_first_page(bot):
+    rows = [f"f{i:02d}" for i in range(10)]
+    assert bot.page_after(lister(rows), same, 0, None, 4) == (rows[:4], True)
+
+
+def test_last_page_has_no_more(bot):
+    rows = [f"f{i:02d}" for i in range(8)]
+    assert bot.page_after(lister(rows), same, 4, "f03", 4) == (rows[4:], False)
+
+
+def test_page_follows_the_cursor_not_the_offset(bot):
+    rows = [f"f{i:02d}" for i in range(10)]
+    # Two rows were removed ahead of the cursor since the first page.
+    shrunk = rows[:1] + rows[3:]
+    page, more = bot.page_after(lister(shrunk), same, 4, "f03", 4)
+    assert page == rows[4:8]
+    assert more is True
+
+
+def test_rows_added_ahead_of_the_cursor_refetch_once(bot):
+    rows = [f"f{i:02d}" for i in range(10)]
+    grown = ["a0", "a1", "a2"] + rows
+    calls = []
+    page, more = bot.page_after(lister(grown, calls), same, 4, "f03", 4)
+    assert page == rows[4:8]
+    assert more is True
+    assert calls == [9, 12]
+
+
+def test_vanished_cursor_falls_back_to_the_offset(bot):
+    rows = [f"f{i:02d}" for i in range(10)]
+    assert bot.page_after(lister(rows), same, 4, "gone", 4)[0] == rows[4:8]
+
+
+def test_page_tokens_resolve_to_the_cursor(bot):
+    token = bot.page_token("files", "//depot/...", 25, "//depot/x", {"user": "alice"})
+    assert bot.PAGE_TOKENS.get(token) == ("files", "//depot/...", 25, "//depot/x", {"user": "alice"})
+    assert bot.page_token("files", "//depot/...", 25, "//depot/x") != token
+
+
+def test_show_more_passes_filters_only_to_commands_that_take_them(bot, monkeypatch):
+    calls, replies = [], []
+    for kind in ("files", "locked"):
+        monkeypatch.setitem(bot.PAGED_MESSAGES, kind, lambda *args, kind=kind, **filters: calls.append((kind, filters)))
+    monkeypatch.setattr(bot, "dispatch", lambda user, say, key, work: say(work()))
+    for kind in ("files", "locked"):
+        token = bot.page_token(kind, "//depot/...", 25, "//depot/x", {"user": "alice"})
+        bot.show_more_action(lambda: None, replies.append, {"actions": [{"value": token}], "user": {"id": "U1"}})
+    assert calls == [("files", {}), ("locked", {"user": "alice"})]
+
+
+# ---- caches
+
+def test_lru_evicts_the_least_recently_used(bot):
+    cache = bot.LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats() == {"hits": 3, "misses": 1, "entries": 2}
+
+
+def test_query_cache_drops_entries_when_the_counter_moves(bot, monkeypatch):
+    cache = bot.QueryCache(size=8, ttl=60, probe_interval=0)
+    counter = {"value": "10"}
+    monkeypatch.setattr(cache, "counter", lambda: counter["value"])
+    cache.put("files", "10", ["//depot/a"])
+    assert cache.get("files") == ["//depot/a"]
+    counter["value"] = "11"
+    assert cache.get("files") is None
+    assert cache.stats()["stale"] == 1
+
+
+def test_query_cache_falls_back_to_the_ttl(bot, monkeypatch):
+    cache = bot.QueryCache(size=8, ttl=60, probe_interval=0)
+    monkeypatch.setattr(cache, "counter", lambda: None)
+    cache.put("files", "10", ["//depot/a"])
+    assert cache.get("files") == ["//depot/a"]
+    now = bot.time.monotonic()
+    monkeypatch.setattr(bot.time, "monotonic", lambda: now + 61)
+    assert cache.get("files") is None
+
+
+# ---- dispatcher
+
+@pytest.fixture
+def dispatcher(bot):
+    dispatcher = bot.CommandDispatcher(workers=2, per_user=2, max_pending=2, deadline=5)
+    yield dispatcher
+    dispatcher._pool.shutdown(wait=True)
+
+
+def blocked(release, result="done", calls=None):
+    def work():
+        if calls is not None:
+            calls.append(1)
+        release.wait(5)
+        return result
+    return work
+
+
+def collect():
+    replies, done = [], threading.Semaphore(0)
+
+    def reply(message):
+        replies.append(message)
+        done.release()
+    return replies, done, reply
+
+
+def test_identical_commands_share_one_call(dispatcher):
+    release, calls = threading.Event(), []
+    replies, done, reply = collect()
+    assert dispatcher.submit("alice", ("files", "//a"), blocked(release, calls=calls), reply)
+    assert dispatcher.submit("bob", ("files", "//a"), blocked(release, calls=calls), reply)
+    release.set()
+    assert done.acquire(timeout=5) and done.acquire(timeout=5)
+    assert replies == ["done", "done"]
+    assert calls == [1]
+    assert dispatcher.stats()["coalesced"] == 1
+
+
+def test_per_user_and_global_limits(dispatcher):
+    release = threading.Event()
+    replies, done, reply = collect()
+    assert dispatcher.submit("alice", ("files", "1"), blocked(release), reply)
+    assert dispatcher.submit("alice", ("files", "2"), blocked(release), reply)
+    assert not dispatcher.submit("alice", ("files", "3"), blocked(release), reply)
+    # The pool is full too, but joining an in-flight call is still allowed.
+    assert not dispatcher.submit("bob", ("files", "3"), blocked(release), reply)
+    assert dispatcher.submit("bob", ("files", "1"), blocked(release), reply)
+    release.set()
+    for _ in range(3):
+        assert done.acquire(timeout=5)
+    assert dispatcher.stats()["rejected"] == 2
+    assert dispatcher.submit("alice", ("files", "4"), lambda: "again", reply)
+    assert done.acquire(timeout=5)
+
+
+def test_commands_run_under_the_deadline(dispatcher):
+    seen = []
+    replies, done, reply = collect()
+    dispatcher.submit("alice", ("files", "1"), lambda: seen.append(p4guard.remaining()) or "ok", reply)
+    assert done.acquire(timeout=5)
+    assert seen[0] is not None and 0 < seen[0] <= 5
+
+
+def test_guard_errors_reply_with_a_warning(dispatcher):
+    def work():
+        raise p4guard.CircuitOpen("Perforce marked degraded")
+
+    replies, done, reply = collect()
+    dispatcher.submit("alice", ("files", "1"), work, reply)
+    assert done.acquire(timeout=5)
+    assert replies[0].startswith(":warning:")
+    assert dispatcher.stats()["degraded"] == 1
@@ -0,0 +1,348 @@
+import http.server
+import json
+import threading
+import time
+
+import pytest
+
+import p4guard
+
+
+class Stop(Exception):
+    """Raised from time.sleep to end forward()'s loop after one pass."""
+
+
+class Webhook(http.server.BaseHTTPRequestHandler):
+    """Answers each post with the next (status, body, headers) from ``replies``; 200 when they run out."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        text = json.loads(self.rfile.read(int(self.headers["Content-Length"])))["text"]
+        self.server.posts.append(text)
+        status, body, headers = self.server.replies.pop(0) if self.server.replies else (200, b"ok", {})
+        if callable(status):
+            status, body = status(text)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def webhook():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Webhook)
+    server.posts = []
+    server.replies = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/hook"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class Recorder:
+    """A SlackDelivery stand-in that accepts every message except those in ``reject``."""
+
+    def __init__(self, submit_slack, reject=()):
+        self.submit_slack = submit_slack
+        self.reject = set(reject)
+        self.posted = []
+
+    def post_many(self, messages, on_delivered=None, on_rejected=None):
+        for index, message in enumerate(messages):
+            if any(f"`{change}`" in message for change in self.reject):
+                on_rejected(index, self.submit_slack.SlackRejected(400, "invalid_payload"))
+            else:
+                self.posted.append(message)
+            if on_delivered:
+                on_delivered(index + 1)
+        return len(messages)
+
+    def changes(self):
+        return [message.split("`")[1] for message in self.posted]
+
+
+# ---- spool
+
+def test_spool_round_trip(submit_slack, tmp_path):
+    spool = str(tmp_path / "spool")
+    submit_slack.spool_append(spool, "12", "alice")
+    submit_slack.spool_append(spool, "13", "bob")
+    entries = submit_slack.read_spool(spool, 0, 10)
+    assert [entry for entry, _ in entries] == [{"change": "12", "user": "alice"}, {"change": "13", "user": "bob"}]
+    # Each end offset resumes right after its line.
+    assert submit_slack.read_spool(spool, entries[0][1], 10)[0][0]["change"] == "13"
+
+
+def test_read_spool_skips_partial_and_flags_malformed_lines(submit_slack, tmp_path):
+    spool = tmp_path / "spool"
+    spool.write_bytes(b'not json\n{"change": "5", "user": "a"}\n{"change": "6"')
+    entries = submit_slack.read_spool(str(spool), 0, 10)
+    assert [entry for entry, _ in entries] == [None, {"change": "5", "user": "a"}]
+
+
+def test_offset_survives_a_restart(submit_slack, tmp_path):
+    offset = str(tmp_path / "spool.offset")
+    assert submit_slack.read_offset(offset) == 0
+    submit_slack.write_offset(offset, 42)
+    assert submit_slack.read_offset(offset) == 42
+
+
+def test_compact_only_truncates_a_fully_delivered_spool(submit_slack, tmp_path):
+    spool = str(tmp_path / "spool")
+    offset = f"{spool}.offset"
+    submit_slack.spool_append(spool, "1", "a")
+    submit_slack.spool_append(spool, "2", "a")
+    first_end = submit_slack.read_spool(spool, 0, 1)[0][1]
+    assert submit_slack.compact_spool(spool, offset, first_end) == first_end
+    assert len(submit_slack.read_spool(spool, 0, 10)) == 2
+    end = submit_slack.read_spool(spool, 0, 10)[-1][1]
+    assert submit_slack.compact_spool(spool, offset, end) == 0
+    assert submit_slack.read_spool(spool, 0, 10) == []
+    assert submit_slack.read_offset(offset) == 0
+
+
+# ---- Slack delivery
+
+def test_post_retries_after_429(submit_slack, webhook):
+    webhook.replies = [(429, b"rate_limited", {"Retry-After": "0"})]
+    delivery = submit_slack.SlackDelivery(webhook.url, rate=1000, burst=10)
+    assert delivery.post("hello") is True
+    assert webhook.posts == ["hello", "hello"]
+
+
+def test_server_errors_are_transient(submit_slack, webhook):
+    webhook.replies = [(500, b"oops", {})]
+    delivery = submit_slack.SlackDelivery(webhook.url, rate=1000, burst=10)
+    assert delivery.post("hello") is False
+
+
+def test_permanent_rejection_raises(submit_slack, webhook):
+    webhook.replies = [(404, b"no_service", {})]
+    delivery = submit_slack.SlackDelivery(webhook.url, rate=1000, burst=10)
+    with pytest.raises(submit_slack.SlackRejected) as raised:
+        delivery.post("hello")
+    assert raised.value.status == 404
+    assert raised.value.reason == "no_service"
+    assert len(webhook.posts) == 1
+
+
+def test_token_bucket_limits_bursts(submit_slack, webhook):
+    delivery = submit_slack.SlackDelivery(webhook.url, rate=0.001, burst=2)
+    assert delivery.available() == 2
+    delivery.post("one")
+    delivery.post("two")
+    assert delivery.available() == 0
+
+
+def test_backlog_is_folded_into_digests(submit_slack, webhook):
+    delivery = submit_slack.SlackDelivery(webhook.url, rate=1000, burst=1)
+    delivery._tokens = 0.5
+    settled = []
+    assert delivery.post_many([f"m{i}" for i in range(3)], settled.append) == 3
+    assert len(webhook.posts) == 1 and webhook.posts[0].startswith("*3 changelists submitted:*")
+    assert settled == [3]
+
+
+def test_rejected_digest_is_split_to_find_the_bad_message(submit_slack, webhook):
+    webhook.replies = [((lambda text: (400, b"invalid_payload") if "bad" in text else (200, b"ok")), b"", {})] * 4
+    delivery = submit_slack.SlackDelivery(webhook.url, rate=1000, burst=1)
+    delivery._tokens = 0.5
+    rejected, settled = [], []
+    count = delivery.post_many(["m0", "bad", "m2"], settled.append, lambda index, error: rejected.append(index))
+    assert count == 3
+    assert rejected == [1]
+    assert settled == [1, 2, 3]
+    assert webhook.posts[1:] == ["m0", "bad", "m2"]
+
+
+# ---- forwarder
+
+def run_forward_once(submit_slack, monkeypatch, spool, delivery, descriptions=None, fallback=None):
+    monkeypatch.setattr(submit_slack, "get_descriptions", lambda changes: descriptions or {})
+    monkeypatch.setattr(submit_slack, "get_description_from_change_spec", fallback or (lambda change: "desc"))
+
+    def sleep(seconds):
+        raise Stop()
+
+    monkeypatch.setattr(submit_slack.time, "sleep", sleep)
+    with pytest.raises(Stop):
+        submit_slack.forward(spool, delivery, 0, 10, f"{spool}.checkpoint")
+
+
+def test_forward_delivers_and_advances_the_offset(submit_slack, monkeypatch, tmp_path):
+    spool = str(tmp_path / "spool")
+    for change in ("7", "8"):
+        submit_slack.spool_append(spool, change, "alice")
+    delivery = Recorder(submit_slack)
+    run_forward_once(submit_slack, monkeypatch, spool, delivery)
+    assert delivery.changes() == ["7", "8"]
+    assert submit_slack.read_spool(spool, submit_slack.read_offset(f"{spool}.offset"), 10) == []
+
+
+def test_forward_dead_letters_rejected_posts(submit_slack, monkeypatch, tmp_path):
+    spool = str(tmp_path / "spool")
+    for change in ("7", "8", "9"):
+        submit_slack.spool_append(spool, change, "alice")
+    delivery = Recorder(submit_slack, reject={"8"})
+    run_forward_once(submit_slack, monkeypatch, spool, delivery)
+    assert delivery.changes() == ["7", "9"]
+    dead = [json.loads(line) for line in open(f"{spool}.dead")]
+    assert [(entry["change"], entry["status"], entry["error"]) for entry in dead] == [("8", 400, "invalid_payload")]
+    assert submit_slack.read_spool(spool, submit_slack.read_offset(f"{spool}.offset"), 10) == []
+
+
+def test_forward_holds_the_batch_when_the_fallback_times_out(submit_slack, monkeypatch, tmp_path):
+    spool = str(tmp_path / "spool")
+    submit_slack.spool_append(spool, "7", "alice")
+
+    def fallback(change):
+        raise p4guard.DeadlineExceeded("p4 change timed out")
+
+    delivery = Recorder(submit_slack)
+    run_forward_once(submit_slack, monkeypatch, spool, delivery, fallback=fallback)
+    assert delivery.posted == []
+    assert submit_slack.read_offset(f"{spool}.offset") == 0
+
+
+def test_description_helpers_do_not_swallow_guard_errors(submit_slack, monkeypatch):
+    def run_p4(*args, **kwargs):
+        raise p4guard.CircuitOpen("Perforce marked degraded")
+
+    monkeypatch.setattr(submit_slack, "run_p4", run_p4)
+    with pytest.raises(p4guard.CircuitOpen):
+        submit_slack.get_description_from_change_spec("7")
+    with pytest.raises(p4guard.CircuitOpen):
+        submit_slack.get_description_from_describe("7")
+
+
+def test_notify_posts_without_description_past_the_deadline(submit_slack, monkeypatch):
+    def describe(change):
+        raise p4guard.DeadlineExceeded("p4 describe timed out")
+
+    monkeypatch.setattr(submit_slack, "run_p4", lambda *args, **kwargs: None)
+    monkeypatch.setattr(submit_slack, "get_description_from_describe", describe)
+    posted = []
+
+    class Delivery:
+        def post(self, text):
+            posted.append(text)
+            return True
+
+    submit_slack.notify(Delivery(), "7", "alice")
+    assert "_No commit message provided_" in posted[0]
+
+
+# ---- reconciler
+
+def test_forward_records_deliveries_for_the_reconciler(submit_slack, monkeypatch, tmp_path):
+    spool = str(tmp_path / "spool")
+    for change in ("7", "8"):
+        submit_slack.spool_append(spool, change, "alice")
+    run_forward_once(submit_slack, monkeypatch, spool, Recorder(submit_slack))
+    assert submit_slack.read_delivered(f"{spool}.checkpoint") == {7, 8}
+
+
+def test_unwritable_delivered_file_is_only_logged(submit_slack, tmp_path, capsys):
+    submit_slack.record_delivered(str(tmp_path / "missing" / "checkpoint"), ["7"])
+    assert "Could not record delivered" in capsys.readouterr().err
+
+
+@pytest.mark.parametrize("option, existing, recorded", [
+    (None, False, False),
+    (None, True, True),
+    ("--checkpoint-file", False, True),
+])
+def test_trigger_records_deliveries_only_where_reconciling(submit_slack, monkeypatch, tmp_path,
+                                                           option, existing, recorded):
+    checkpoint = tmp_path / "submit-slack.checkpoint"
+    if existing:
+        checkpoint.write_text("5\n")
+    monkeypatch.setattr(submit_slack, "DEFAULT_CHECKPOINT", str(checkpoint))
+    monkeypatch.setenv("SLACK_WEBHOOK", "http://127.0.0.1:9/hook")
+    monkeypatch.delenv("SUBMIT_SLACK_CHECKPOINT", raising=False)
+    seen = []
+    monkeypatch.setattr(submit_slack, "notify", lambda delivery, change, user, path: seen.append(path))
+    argv = ["submit-slack.py", "7", "alice"] + ([option, str(checkpoint)] if option else [])
+    monkeypatch.setattr(submit_slack.sys, "argv", argv)
+    submit_slack.main()
+    assert seen == [str(checkpoint) if recorded else None]
+
+
+def changes_since(records):
+    def run_p4_marshal(*args):
+        if "-m" in args:
+            return [records[-1]]
+        low = int(args[-1].split("@")[1].rstrip(","))
+        return [record for record in records if int(record["change"]) >= low]
+    return run_p4_marshal
+
+
+def change(n, age=3600):
+    return {"change": str(n), "user": "alice", "time": str(int(time.time() - age)), "desc": f"change {n}"}
+
+
+def test_first_reconcile_only_records_the_newest_change(submit_slack, monkeypatch, tmp_path):
+    checkpoint = str(tmp_path / "checkpoint")
+    monkeypatch.setattr(submit_slack, "run_p4_marshal", changes_since([change(10), change(11)]))
+    delivery = Recorder(submit_slack)
+    assert submit_slack.reconcile(delivery, checkpoint) == 0
+    assert submit_slack.read_offset(checkpoint) == 11
+    assert delivery.posted == []
+
+
+def test_reconcile_posts_only_missed_changes(submit_slack, monkeypatch, tmp_path):
+    checkpoint = str(tmp_path / "checkpoint")
+    submit_slack.write_offset(checkpoint, 10)
+    submit_slack.record_delivered(checkpoint, ["12"])
+    monkeypatch.setattr(submit_slack, "run_p4_marshal", changes_since([change(11), change(12), change(13)]))
+    delivery = Recorder(submit_slack)
+    assert submit_slack.reconcile(delivery, checkpoint) == 2
+    assert delivery.changes() == ["11", "13"]
+    assert submit_slack.read_offset(checkpoint) == 13
+    # Settled entries are pruned from the delivered list.
+    assert submit_slack.read_delivered(checkpoint) == set()
+
+
+def test_reconcile_leaves_young_changes_to_their_trigger(submit_slack, monkeypatch, tmp_path):
+    checkpoint = str(tmp_path / "checkpoint")
+    submit_slack.write_offset(checkpoint, 10)
+    monkeypatch.setattr(submit_slack, "run_p4_marshal", changes_since([change(11), change(12, age=5)]))
+    delivery = Recorder(submit_slack)
+    assert submit_slack.reconcile(delivery, checkpoint, settle=120) == 1
+    assert submit_slack.read_offset(checkpoint) == 11
+
+
+def test_reconcile_stops_short_of_changes_still_in_the_spool(submit_slack, monkeypatch, tmp_path):
+    checkpoint = str(tmp_path / "checkpoint")
+    spool = str(tmp_path / "spool")
+    submit_slack.write_offset(checkpoint, 10)
+    submit_slack.spool_append(spool, "12", "alice")
+    monkeypatch.setattr(submit_slack, "run_p4_marshal", changes_since([change(11), change(12), change(13)]))
+    delivery = Recorder(submit_slack)
+    assert submit_slack.reconcile(delivery, checkpoint, spool_path=spool) == 1
+    assert delivery.changes() == ["11"]
+    assert submit_slack.read_offset(checkpoint) == 11
+
+    # Once the forwarder has delivered it, the next run settles the rest.
+    submit_slack.record_delivered(checkpoint, ["12"])
+    submit_slack.write_offset(f"{spool}.offset", submit_slack.read_spool(spool, 0, 10)[-1][1])
+    assert submit_slack.reconcile(delivery, checkpoint, spool_path=spool) == 1
+    assert delivery.changes() == ["11", "13"]
+    assert submit_slack.read_offset(checkpoint) == 13
+
+
+def test_reconcile_dead_letters_rejected_changes(submit_slack, monkeypatch, tmp_path):
+    checkpoint = str(tmp_path / "checkpoint")
+    submit_slack.write_offset(checkpoint, 10)
+    monkeypatch.setattr(submit_slack, "run_p4_marshal", changes_since([change(11), change(12)]))
+    delivery = Recorder(submit_slack, reject={"11"})
+    assert submit_slack.reconcile(delivery, checkpoint) == 1
+    assert submit_slack.read_offset(checkpoint) == 12
+    assert [json.loads(line)["change"] for line in open(f"{checkpoint}.dead")] == ["11"]